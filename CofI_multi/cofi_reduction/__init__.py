@@ -1,11 +1,39 @@
 # cofi_reduction/__init__.py
 
-from .processor import CofiProcessor
-from .widget import CofiReductionWidget
-from .rvprocessor import AstroAnalysis
-from .log import CofiLogger
-from .cofi_stacker import stacker
+# Public names are loaded on first access (PEP 562), so importing the package, or a
+# GUI-free part of it such as CofiProcessor or CofiPipeline, does not pull in
+# ipywidgets/IPython. The widgets need the [gui] extra.
+import importlib
+
+_LAZY = {
+    "CofiProcessor": ".processor",
+    "CofiPipeline": ".pipeline",
+    "MaskGeometry": ".geometry",
+    "CofiReductionWidget": ".widget",
+    "AstroAnalysis": ".rvprocessor",
+    "CofiLogger": ".log",
+    "replay_log": ".replay",
+    "StepGraph": ".graph",
+    "HeaderCatalog": ".catalog",
+    "propose_plans": ".classify",
+    "stacker": ".cofi_stacker",
+    "combine_spectra": ".cofi_stacker",
+    "StreamingStack": ".cofi_stacker",
+    "stack_targets": ".cofi_stacker",
+}
 # from .widget4 import CofiReductionWidget1
 # FunctionParameterWidget1 is no longer needed
 
-__all__ = ["CofiProcessor", "CofiReductionWidget", "AstroAnalysis", "CofiLogger","stacker"]
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
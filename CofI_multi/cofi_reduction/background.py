@@ -0,0 +1,158 @@
+# cofi_reduction/background.py
+
+import sys
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import ipywidgets as widgets
+from .progress import Cancelled
+
+
+class _ThreadStream:
+    """
+    sys.stdout/sys.stderr wrapper sending what worker threads write to their Output
+    widget (append_stdout/append_stderr); other threads write to the wrapped stream.
+    """
+    def __init__(self, stream, append):
+        self.stream = stream
+        self.append = append
+        self.targets = {} # thread id -> Output
+
+    def write(self, text):
+        output = self.targets.get(threading.get_ident())
+        if output is None or not text:
+            return self.stream.write(text)
+        getattr(output, self.append)(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _thread_stream(name, append):
+    stream = getattr(sys, name)
+    if not isinstance(stream, _ThreadStream):
+        stream = _ThreadStream(stream, append)
+        setattr(sys, name, stream)
+    return stream
+
+
+class BackgroundRunner:
+    """
+    Runs one long widget step at a time in a background thread, so the notebook stays
+    usable. The step gets `progress(done, total, label)` and a `cancel` Event; the
+    pipeline methods that accept them report per frame/master/slit and stop at the next
+    one once Cancel is pressed. What the step prints goes to `output` (an ipywidgets.Output)
+    through append_stdout. Steps must not touch the TV or matplotlib (GUI calls are only
+    safe on the notebook thread); show results with `on_done` instead.
+    """
+    def __init__(self, output=None):
+        self.output = output
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.failed = False
+
+        self.progress_bar = widgets.IntProgress(value=0, min=0, max=1, bar_style='info',
+                                                layout=widgets.Layout(width='40%'))
+        self.status_label = widgets.HTML('')
+        self.cancel_button = widgets.Button(description='Cancel', icon='stop', button_style='danger',
+                                            disabled=True)
+        self.cancel_button.on_click(self._cancel_handler)
+        self.widget = widgets.HBox([self.progress_bar, self.status_label, self.cancel_button])
+        self.widget.layout.display = 'none'
+
+    @property
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+    def run(self, title, func, on_done=None):
+        """
+        Starts func(progress=..., cancel=...) in the background. Returns its Future, or
+        None (with a warning) if another step is still running. If the step succeeds,
+        on_done() is called on the notebook thread (e.g. to display the result).
+        """
+        if self.busy:
+            print(f"⚠️ '{self.title}' is still running. Wait for it or press Cancel.")
+            return None
+        self.title = title
+        self.cancel_event.clear()
+        self.progress_bar.value, self.progress_bar.max = 0, 1
+        self.progress_bar.bar_style = 'info'
+        self.status_label.value = f"<b>{title}</b>: starting..."
+        self.cancel_button.disabled = False
+        self.widget.layout.display = 'flex'
+        self.future = self.executor.submit(self._run, title, func)
+        if on_done is not None:
+            self._call_on_main_thread(self.future, on_done)
+        return self.future
+
+    def _call_on_main_thread(self, future, on_done):
+        try:
+            loop = asyncio.get_event_loop() # the kernel's loop, on the notebook thread
+        except RuntimeError:
+            return
+
+        def done(f):
+            if not f.cancelled() and not self.failed:
+                loop.call_soon_threadsafe(self._on_done, on_done)
+        future.add_done_callback(done)
+
+    def _on_done(self, on_done):
+        try:
+            on_done()
+        except Exception as e:
+            self._print(f"⚠️ Could not show the result: {e}\n")
+
+    def _print(self, text):
+        if self.output is None:
+            print(text, end='')
+        else:
+            self.output.append_stdout(text)
+
+    def _run(self, title, func):
+        if self.output is None:
+            return self._call(title, func)
+        streams = [_thread_stream('stdout', 'append_stdout'), _thread_stream('stderr', 'append_stderr')]
+        ident = threading.get_ident()
+        for stream in streams:
+            stream.targets[ident] = self.output
+        try:
+            return self._call(title, func)
+        finally:
+            for stream in streams:
+                stream.targets.pop(ident, None)
+
+    def _call(self, title, func):
+        self.failed = True
+        try:
+            result = func(progress=self.update, cancel=self.cancel_event)
+            self.progress_bar.bar_style = 'success'
+            self.status_label.value = f"<b>{title}</b>: done"
+            self.failed = False
+            return result
+        except Cancelled:
+            self.progress_bar.bar_style = 'warning'
+            self.status_label.value = f"<b>{title}</b>: cancelled"
+            print(f"⚠️ {title} cancelled.")
+        except Exception as e:
+            self.progress_bar.bar_style = 'danger'
+            self.status_label.value = f"<b>{title}</b>: failed"
+            print(f"❌ Error during {title}: {e}")
+            traceback.print_exc()
+        finally:
+            self.cancel_button.disabled = True
+
+    def update(self, done, total, label=''):
+        """Progress callback handed to the running step."""
+        self.progress_bar.max = max(total, 1)
+        self.progress_bar.value = done
+        self.status_label.value = f"<b>{self.title}</b>: {done}/{total} {label}"
+
+    def _cancel_handler(self, b):
+        self.cancel_event.set()
+        self.status_label.value = f"<b>{self.title}</b>: cancelling after the current unit..."
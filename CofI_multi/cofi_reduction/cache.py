@@ -0,0 +1,193 @@
+# cofi_reduction/cache.py
+
+import os
+import glob
+import json
+import shutil
+import pickle
+import hashlib
+import numpy as np
+
+# Environment variable overriding the default cache location
+CACHE_ENV = 'COFI_CACHE_DIR'
+
+
+def default_cache_dir():
+    """$COFI_CACHE_DIR, or ~/.cache/cofi_reduction."""
+    return os.environ.get(CACHE_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'cofi_reduction')
+
+
+def fingerprint(*parts):
+    """sha256 hex digest of any JSON-able parts (other objects hashed through str())."""
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def data_digest(im):
+    """Digest of the pixel data (and uncertainty, if any) of a Data/CCDData object or array."""
+    h = hashlib.sha256()
+    for array in (getattr(im, 'data', im), getattr(getattr(im, 'uncertainty', None), 'array', None)):
+        if array is not None:
+            array = np.ascontiguousarray(array)
+            h.update(str((array.dtype, array.shape)).encode())
+            h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def frame_files(red, frames):
+    """
+    Files an imred.Reducer reads for a list of frame numbers/names, found the
+    same way Reducer.rd does. Returns None if any frame cannot be found.
+    """
+    files = []
+    for frame in frames:
+        for form in red.formstr:
+            if isinstance(frame, (int, np.integer)):
+                search = red.dir + '/' + red.root + form.format(frame)
+            elif '/' in str(frame):
+                search = str(frame)
+            else:
+                search = red.dir + '/' + str(frame)
+            found = sorted(glob.glob(search)) or sorted(glob.glob(search + '.gz'))
+            if not found:
+                return None
+            files.append(found[0])
+    return files
+
+
+def file_stamps(files):
+    """(absolute path, mtime, size) of each file, so an edited or replaced file changes the key."""
+    stamps = []
+    for file in files:
+        st = os.stat(file)
+        stamps.append((os.path.abspath(file), st.st_mtime_ns, st.st_size))
+    return stamps
+
+
+class CalibrationCache:
+    """
+    On-disk store of master calibrations (bias, dark, flat, arcs), content-addressed
+    by the input frames (paths, mtimes, sizes), the Reducer instrument and every
+    combine parameter. An identical request loads the pickled master instead of
+    recombining the frames.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(), 'masters')
+
+    def key(self, kind, red, frames, **params):
+        """Cache key of a master, or None if the input frames cannot be located."""
+        files = frame_files(red, frames)
+        if files is None:
+            return None
+        return fingerprint(kind, red.inst, file_stamps(files), params)
+
+    def path(self, kind, key):
+        return os.path.join(self.cache_dir, f'{kind}_{key[:32]}.pkl')
+
+    def load(self, kind, key):
+        """Cached master for a key, or None if not cached (or unreadable)."""
+        path = self.path(kind, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Could not read cached {kind} ({e}). Recomputing.")
+            return None
+
+    def save(self, kind, key, master):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(kind, key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(master, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path) # never leave a half-written master behind
+        return path
+
+    def get_or_compute(self, kind, key, compute, lookup=True):
+        """
+        Returns (master, hit). Runs `compute()` and stores the result on a miss;
+        with lookup=False the master is always recomputed (and the cache refreshed).
+        A None key disables caching for this call.
+        """
+        if key is not None and lookup:
+            master = self.load(kind, key)
+            if master is not None:
+                print(f"ℹ️ Loaded cached master {kind} ({key[:12]}).")
+                return master, True
+        master = compute()
+        if key is not None and master is not None:
+            try:
+                self.save(kind, key, master)
+            except Exception as e:
+                print(f"⚠️ Could not cache master {kind}: {e}")
+        return master, False
+
+    def clear(self, kind=None):
+        """Removes the cached masters (only those of one kind if given). Returns the number removed."""
+        pattern = f'{kind}_*.pkl' if kind else '*.pkl'
+        files = glob.glob(os.path.join(self.cache_dir, pattern))
+        for file in files:
+            os.remove(file)
+        return len(files)
+
+
+def path_stamp(path):
+    """(absolute path, mtime, size) of a file, or just the name if it is not a local file (e.g. a pyvista data file)."""
+    if os.path.isfile(path):
+        return file_stamps([path])[0]
+    return str(path)
+
+
+class WavecalCache:
+    """
+    Store of CofIwav_* wavelength solutions keyed by the arc slitlet data and every
+    fit/identify parameter. A slit is refitted only when its key changes; otherwise
+    the stored solution is copied back to its CofIwav_* file.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(), 'wavecal')
+
+    def key(self, arc, lamp_spec_file, **params):
+        """Key of one slit's solution: arc pixels, lamp file stamp and fit parameters."""
+        return fingerprint(data_digest(arc), path_stamp(lamp_spec_file), params)
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key[:32])
+        return f'{base}.fits', f'{base}.json'
+
+    def restore(self, key, wavname):
+        """
+        Copies a cached solution to wavname and returns its stored fit result
+        (rms, nlines, weak_waves), or None on a miss.
+        """
+        solution, meta = self._paths(key)
+        if not (os.path.exists(solution) and os.path.exists(meta)):
+            return None
+        with open(meta) as f:
+            result = json.load(f)
+        if os.path.dirname(wavname):
+            os.makedirs(os.path.dirname(wavname), exist_ok=True)
+        shutil.copyfile(solution, wavname)
+        result.update(file=wavname, error=None)
+        return result
+
+    def store(self, key, result):
+        """Keeps a copy of a freshly fitted solution (result of _fit_slit_wavelength)."""
+        if result.get('error') or not result.get('file'):
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        solution, meta = self._paths(key)
+        shutil.copyfile(result['file'], solution)
+        with open(meta, 'w') as f:
+            json.dump({'rms': float(result['rms']), 'nlines': int(result['nlines']),
+                       'weak_waves': [float(w) for w in result['weak_waves']]}, f)
+        return solution
+
+    def clear(self):
+        """Removes every cached solution. Returns the number of files removed."""
+        files = glob.glob(os.path.join(self.cache_dir, '*'))
+        for file in files:
+            os.remove(file)
+        return len(files)
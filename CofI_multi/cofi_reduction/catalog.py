@@ -0,0 +1,189 @@
+# cofi_reduction/catalog.py
+
+import os
+import fnmatch
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from astropy.io import fits
+from astropy.table import Table
+from .cache import default_cache_dir, fingerprint
+
+# Columns of the folder log, as imred.Reducer.log() shows them by default
+LOG_COLUMNS = ['DATE-OBS', 'OBJNAME', 'RA', 'DEC', 'EXPTIME']
+
+# Cards not worth indexing
+SKIP_CARDS = {'', 'COMMENT', 'HISTORY'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER);
+CREATE TABLE IF NOT EXISTS cards (name TEXT, key TEXT, value, PRIMARY KEY (name, key));
+CREATE INDEX IF NOT EXISTS cards_key_value ON cards (key, value COLLATE NOCASE);
+"""
+
+
+def _card_value(value):
+    """Header value as stored in SQLite (text stripped, undefined values as NULL)."""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (bool, int, float)):
+        return value
+    return None
+
+
+def read_header_cards(path, hdu=0):
+    """(key, value) pairs of one FITS header, without COMMENT/HISTORY cards."""
+    header = fits.getheader(path, hdu)
+    return [(key, _card_value(value)) for key, value in header.items() if key not in SKIP_CARDS]
+
+
+class HeaderCatalog:
+    """
+    Persistent index of the FITS headers of a data folder.
+
+    Headers are kept in an SQLite file under <cache dir>/catalog (one per folder), with
+    an index on (keyword, value). update() re-reads only the files whose mtime or size
+    changed (in a thread pool) and drops deleted ones, so opening a folder again does
+    not rescan it. query() answers e.g. query(IMAGETYP='arc', OBJNAME='M3') from the
+    index; string values match case-insensitively. With cache_dir=False the index is
+    kept in memory only.
+    """
+    def __init__(self, folder, cache_dir=None, pattern='*.fit*', hdu=0, workers=8):
+        self.folder = os.path.abspath(folder)
+        self.pattern = pattern
+        self.hdu = hdu
+        self.workers = workers
+        if cache_dir is False:
+            self.path = ':memory:'
+        else:
+            catalog_dir = os.path.join(cache_dir or default_cache_dir(), 'catalog')
+            os.makedirs(catalog_dir, exist_ok=True)
+            self.path = os.path.join(catalog_dir, f'{fingerprint(self.folder, pattern, hdu)[:32]}.sqlite')
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.updated = False
+
+    def _scan(self):
+        """name -> (mtime_ns, size) of the files in the folder matching the pattern."""
+        found = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                    st = entry.stat()
+                    found[entry.name] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def update(self):
+        """
+        Brings the index up to date with the folder. Returns (number of headers read,
+        number of files removed).
+        """
+        found = self._scan()
+        with self.lock:
+            known = {name: (mtime, size) for name, mtime, size in self.db.execute('SELECT name, mtime_ns, size FROM files')}
+            changed = sorted(name for name, stamp in found.items() if known.get(name) != stamp)
+            removed = [name for name in known if name not in found]
+
+            def read(name):
+                try:
+                    return name, read_header_cards(os.path.join(self.folder, name), self.hdu)
+                except Exception as e:
+                    print(f"⚠️ Could not read the header of {name}: {e}")
+                    return name, None
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                headers = list(executor.map(read, changed))
+
+            with self.db:
+                stale = [(name,) for name in removed + changed]
+                self.db.executemany('DELETE FROM cards WHERE name = ?', stale)
+                self.db.executemany('DELETE FROM files WHERE name = ?', stale)
+                for name, cards in headers:
+                    if cards is None:
+                        continue # not recorded, so retried on the next update
+                    self.db.execute('INSERT INTO files VALUES (?, ?, ?)', (name, *found[name]))
+                    self.db.executemany('INSERT OR REPLACE INTO cards VALUES (?, ?, ?)',
+                                        [(name, key, value) for key, value in cards])
+            self.updated = True
+        if changed or removed:
+            print(f"ℹ️ Header catalog of {self.folder}: {len(changed)} header(s) read, {len(removed)} removed.")
+        return len(changed), len(removed)
+
+    def _ensure(self):
+        if not self.updated:
+            self.update()
+
+    def query(self, where=None, **criteria):
+        """
+        Names of the files whose headers match every criterion, in DATE-OBS order.
+        Keywords can be given as a dict (for keys like 'DATE-OBS') or as keyword
+        arguments; a list/tuple/set value matches any of its items.
+        """
+        self._ensure()
+        criteria = {**(where or {}), **criteria}
+        sql, args = 'SELECT name FROM files', []
+        clauses = []
+        for key, value in criteria.items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            marks = ', '.join('?' * len(values))
+            clauses.append(f'name IN (SELECT name FROM cards WHERE key = ? AND value COLLATE NOCASE IN ({marks}))')
+            args += [key.upper(), *values]
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += " ORDER BY (SELECT value FROM cards WHERE cards.name = files.name AND key = 'DATE-OBS'), name"
+        with self.lock:
+            return [name for (name,) in self.db.execute(sql, args)]
+
+    def values(self, key):
+        """Distinct values of one keyword in the folder."""
+        self._ensure()
+        with self.lock:
+            return [value for (value,) in self.db.execute('SELECT DISTINCT value FROM cards WHERE key = ? ORDER BY value',
+                                                         (key.upper(),))]
+
+    def table(self, keys=None, names=None):
+        """
+        DataFrame of header values (FILE column plus one column per key; every keyword
+        if keys is None) for the given files (default all), in DATE-OBS order.
+        """
+        self._ensure()
+        names = self.query() if names is None else list(names)
+        sql, args = 'SELECT name, key, value FROM cards', []
+        if keys is not None:
+            keys = [key.upper() for key in keys]
+            sql += f" WHERE key IN ({', '.join('?' * len(keys))})"
+            args = keys
+        rows = {name: {'FILE': name} for name in names}
+        with self.lock:
+            for name, key, value in self.db.execute(sql, args):
+                if name in rows:
+                    rows[name][key] = value
+        return pd.DataFrame(list(rows.values()), columns=None if keys is None else ['FILE'] + keys)
+
+    def log(self, cols=None):
+        """
+        Chronological folder log like imred.Reducer.log() (an astropy Table of FILE and
+        `cols` as strings), read from the index instead of every header.
+        """
+        cols = list(cols or LOG_COLUMNS)
+        df = self.table(cols + ['OBJCTRA', 'OBJCTDEC'])
+        # MaximDL headers give the coordinates as OBJCTRA/OBJCTDEC, as in Reducer.log()
+        for col, alt in (('RA', 'OBJCTRA'), ('DEC', 'OBJCTDEC')):
+            if col in df:
+                df[col] = df[col].where(df[col].notna(), df[alt].map(lambda v: v.replace(' ', ':') if isinstance(v, str) else v))
+        columns = {'FILE': list(df['FILE'])}
+        for col in cols:
+            columns[col] = ['' if pd.isna(value) else str(value) for value in df[col]]
+        return Table(columns, names=['FILE'] + cols, dtype=[str] * (len(cols) + 1))
+
+    def clear(self):
+        """Empties the index (the next query rescans the folder)."""
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM cards')
+            self.db.execute('DELETE FROM files')
+        self.updated = False
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,177 @@
+# cofi_reduction/classify.py
+
+import re
+import pandas as pd
+from collections import OrderedDict
+
+# Header keywords the classification reads, by role
+FRAME_KEYWORDS = {'type': 'IMAGETYP', 'object': 'OBJNAME', 'exptime': 'EXPTIME', 'grating': 'GRATING', 'lamp': 'LAMP'}
+
+# Substrings of the image type (lower case) for each frame type, checked in this order
+TYPE_ALIASES = OrderedDict([
+    ('bias', ('bias', 'zero')),
+    ('dark', ('dark',)),
+    ('flat', ('flat',)),
+    ('arc', ('arc', 'comp', 'lamp', 'wave')),
+    ('science', ('object', 'science', 'obj', 'light', 'target')),
+])
+
+# Lamp names telling flats from arcs when the image type does not. Arc lamps match by
+# element name anywhere in the LAMP value ('Neon', 'Argon lamp') or as a word made of
+# element symbols ('Ne', 'ThAr', 'HeNeAr')
+FLAT_LAMPS = ('quartz', 'halogen', 'qth', 'flat', 'continuum')
+ARC_LAMPS = ('ar', 'ne', 'kr', 'he', 'hg', 'xe', 'cd', 'th')
+ARC_LAMP_NAMES = ('argon', 'neon', 'krypton', 'helium', 'mercury', 'xenon', 'cadmium', 'thorium')
+ARC_SYMBOLS = re.compile(f"^({'|'.join(ARC_LAMPS)})+$")
+
+FRAME_NUMBER = re.compile(r'(\d+)\.f[^.]*(\.gz)?$', re.IGNORECASE)
+
+
+def frame_number(name):
+    """Frame number of a file name (e.g. M3real.0008.fits -> 8), or the name itself if it has none."""
+    match = FRAME_NUMBER.search(str(name))
+    return int(match.group(1)) if match else name
+
+
+def _lamp_type(lamp):
+    lamp = str(lamp or '').lower()
+    if not lamp or lamp in ('none', 'off', 'nan'):
+        return None
+    if any(name in lamp for name in FLAT_LAMPS):
+        return 'flat'
+    if any(name in lamp for name in ARC_LAMP_NAMES) or \
+            any(ARC_SYMBOLS.match(word) for word in re.split(r'[^a-z]+', lamp)):
+        return 'arc'
+    return None
+
+
+def frame_type(imagetyp, exptime=None, lamp=None):
+    """bias, dark, flat, arc, science or unknown, from the image type, lamp and exposure time."""
+    text = str(imagetyp or '').lower()
+    for kind, aliases in TYPE_ALIASES.items():
+        if any(alias in text for alias in aliases):
+            if kind in ('flat', 'science'):
+                # a lamp that is on overrides a generic type (e.g. an 'object' frame of an arc lamp)
+                return _lamp_type(lamp) or kind
+            return kind
+    lamp_kind = _lamp_type(lamp)
+    if lamp_kind:
+        return lamp_kind
+    try:
+        if float(exptime) == 0:
+            return 'bias'
+    except (TypeError, ValueError):
+        pass
+    return 'unknown'
+
+
+def classify_frames(table, keywords=None):
+    """
+    Frame table for grouping: FILE, FRAME (number, or file name), TYPE and the
+    IMAGETYP/OBJECT/EXPTIME/GRATING/LAMP values, from a header table with a FILE
+    column (e.g. HeaderCatalog.table()). `keywords` overrides FRAME_KEYWORDS.
+    """
+    keywords = {**FRAME_KEYWORDS, **(keywords or {})}
+
+    def column(role):
+        return table[keywords[role]] if keywords[role] in table else None
+
+    frames = pd.DataFrame({'FILE': table['FILE'], 'IMAGETYP': column('type'), 'OBJECT': column('object'),
+                           'EXPTIME': column('exptime'), 'GRATING': column('grating'), 'LAMP': column('lamp')})
+    frames.insert(1, 'FRAME', [frame_number(name) for name in frames['FILE']])
+    frames.insert(2, 'TYPE', [frame_type(*row) for row in zip(frames['IMAGETYP'], frames['EXPTIME'], frames['LAMP'])])
+    return frames
+
+
+def _frames(rows):
+    return [frame.item() if hasattr(frame, 'item') else frame for frame in rows['FRAME']]
+
+
+def _same(a, b):
+    return (pd.isna(a) and pd.isna(b)) or a == b
+
+
+def group_frames(frames):
+    """
+    Groups classified frames (classify_frames) for reduction:
+    {'bias': [...], 'dark': {exptime: [...]}, 'masks': {(object, grating): {'flat', 'arc', 'science'}}}.
+    Each science object/grating is a mask. Flats and arcs go to the mask with the same
+    object and grating or, if none has that object, to every mask with the same grating.
+    """
+    groups = {'bias': _frames(frames[frames.TYPE == 'bias']), 'dark': {}, 'masks': OrderedDict()}
+    for exptime, rows in frames[frames.TYPE == 'dark'].groupby('EXPTIME', dropna=False):
+        groups['dark'][exptime] = _frames(rows)
+
+    science = frames[frames.TYPE == 'science']
+    for (obj, grating), rows in science.groupby(['OBJECT', 'GRATING'], dropna=False, sort=False):
+        groups['masks'][(obj, grating)] = {'flat': [], 'arc': [], 'science': _frames(rows),
+                                           'exptime': rows['EXPTIME'].iloc[0]}
+
+    for kind in ('flat', 'arc'):
+        for (obj, grating), rows in frames[frames.TYPE == kind].groupby(['OBJECT', 'GRATING'], dropna=False):
+            targets = [key for key in groups['masks'] if _same(key[0], obj) and _same(key[1], grating)]
+            if not targets:
+                targets = [key for key in groups['masks'] if _same(key[1], grating) or pd.isna(grating)]
+            for key in targets:
+                groups['masks'][key][kind] += _frames(rows)
+    return groups
+
+
+def _matching_darks(darks, exptime):
+    """Darks with the exposure time closest to the science exposure time."""
+    if not darks:
+        return []
+    try:
+        return darks[min(darks, key=lambda t: abs(float(t) - float(exptime)))]
+    except (TypeError, ValueError):
+        return next(iter(darks.values()))
+
+
+def mask_name(obj, grating):
+    return '_'.join(str(part) for part in (obj, grating) if not pd.isna(part) and str(part))
+
+
+def propose_plans(frames, indir, kms_files=None):
+    """
+    One reduction plan per mask from classified frames, in the replay plan format
+    (see replay.run_plan): master bias/dark/flat/arcs from the matching calibration
+    frames and every science frame of the mask in reduce_sciences. find_slits (and
+    update_arc_headers) are included when `kms_files` gives the mask's KMS file
+    (keyed by mask name, object or None for all). Returns {mask name: plan}.
+    """
+    groups = group_frames(frames)
+    kms_files = kms_files if isinstance(kms_files, dict) else {None: kms_files}
+    plans = OrderedDict()
+    for (obj, grating), mask in groups['masks'].items():
+        name = mask_name(obj, grating)
+        darks = _matching_darks(groups['dark'], mask['exptime'])
+        plan = OrderedDict(read_folder=dict(indir=indir))
+        if groups['bias']:
+            plan['compute_bias'] = dict(frames=groups['bias'])
+        if darks:
+            plan['compute_dark'] = dict(frames=darks, apply_bias=bool(groups['bias']))
+        if mask['flat']:
+            plan['compute_flat'] = dict(frames=mask['flat'], apply_bias=bool(groups['bias']), apply_dark=bool(darks))
+        if mask['arc']:
+            plan['compute_arcs'] = dict(frames=mask['arc'])
+        kms_file = kms_files.get(name, kms_files.get(obj, kms_files.get(None)))
+        if kms_file and mask['flat']:
+            plan['find_slits'] = dict(flat_frame=mask['flat'][0], kms_file=kms_file)
+            if mask['arc']:
+                plan['update_arc_headers'] = {}
+        plan['reduce_sciences'] = dict(frames=mask['science'], apply_bias=bool(groups['bias']), apply_dark=bool(darks))
+        plans[name] = plan
+    return plans
+
+
+def summarize_plans(plans):
+    """One row per mask: frame counts of each step, for checking a proposal before running it."""
+    rows = []
+    for name, plan in plans.items():
+        row = {'mask': name}
+        for step, column in (('compute_bias', 'bias'), ('compute_dark', 'dark'), ('compute_flat', 'flat'),
+                             ('compute_arcs', 'arc'), ('reduce_sciences', 'science')):
+            row[column] = len(plan.get(step, {}).get('frames', []))
+        row['find_slits'] = 'find_slits' in plan
+        rows.append(row)
+    return pd.DataFrame(rows)
@@ -1,12 +1,14 @@
 import os
+import sys
+import glob
+import argparse
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pandas as pd
 import ast
 from astropy.io import fits
-from astropy.nddata import CCDData
-from ccdproc import Combiner
-import matplotlib.pyplot as plt
-import ipywidgets as widgets
-from IPython.display import display, clear_output
 # --- 1. Define input files and load them ---
 # Using a list makes the code cleaner and easier to extend
 # file_list = [
@@ -26,12 +28,529 @@ def get_srt_or_list(widget_value):
     else:
         return cleaned_value
 
+# HDUs of a 1D extraction file: (flux, uncertainty) pairs that are combined, and the bitmask
+SCIENCE_HDUS = (1, 2)
+SKY_HDUS = (5, 6)
+BITMASK_HDU = 3
+
+# Header keywords identifying a target: the mask (OBJNAME) and the slit target ID written at extraction
+TARGET_KEYWORDS = ('OBJNAME', 'TARGID')
+# Header keyword naming the exposure a spectrum was extracted from (copied from the science frame)
+EXPOSURE_KEYWORD = 'FILE'
+
+# combine_spectra methods: running mean (StreamingStack) and the chunked, bitmask-aware combines
+COMBINE_METHODS = ('average', 'ivar', 'median', 'sigclip')
+
+
+def _read_template(hdul):
+    """Headers, flux HDU name and WAVE HDU of the first input, used to build the output."""
+    return {'headers': [hdu.header.copy() for hdu in hdul],
+            'name': hdul[SCIENCE_HDUS[0]].name,
+            'wave': fits.ImageHDU(data=np.array(hdul['WAVE'].data), header=hdul['WAVE'].header.copy(), name='WAVE')}
+
+
+def _stack_hdulist(template, files, science, science_err, bitmask, sky, sky_err, method='average'):
+    """The stack with the layout of the inputs: primary, flux, UNCERT, BITMASK, WAVE, SKY, SKYERR."""
+    headers = template['headers']
+    # Copy the primary header and document the stacking in HISTORY cards
+    primary_hdu = fits.PrimaryHDU(header=headers[0])
+    primary_hdu.header['NCOMBINE'] = len(files)
+    primary_hdu.header['COMBMETH'] = (method, 'cofi_stacker combine method')
+    primary_hdu.header['HISTORY'] = 'Stacked from {} files.'.format(len(files))
+    for f in files:
+        primary_hdu.header['HISTORY'] = f'  - {os.path.basename(f)}' # Add source files to history
+    return fits.HDUList([
+        primary_hdu,
+        fits.ImageHDU(data=science, header=headers[1], name=template['name']),
+        fits.ImageHDU(data=science_err, header=headers[2], name='UNCERT'),
+        fits.ImageHDU(data=bitmask, header=headers[3], name='BITMASK'),
+        template['wave'], # The wavelength solution is the same, so the whole HDU is copied
+        fits.ImageHDU(data=sky, header=headers[5], name='SKY'),
+        fits.ImageHDU(data=sky_err, header=headers[6], name='SKYERR'),
+    ])
+
+
+class _RunningMean:
+    """Per-pixel weighted running mean and variance (West/Welford update); NaN pixels are skipped."""
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self.wsum = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, data, weight=1.0):
+        valid = np.isfinite(data)
+        x = np.where(valid, data, 0.0)
+        w = np.where(valid, weight, 0.0)
+        self.count += valid
+        self.wsum += w
+        delta = x - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean += np.where(valid, w / self.wsum * delta, 0.0)
+        self.m2 += w * delta * (x - self.mean)
+
+    def result(self):
+        """(mean, standard error of the mean); NaN where no input had data."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+            std = np.sqrt(self.m2 / self.wsum)
+            return mean, std / np.sqrt(self.count)
+
+
+class StreamingStack:
+    """
+    Constant-memory coadd of 1D extraction files.
+
+    Each add() opens one file (memory-mapped), folds its science and sky spectra into
+    running weighted means/variances and ORs its bitmask in, then closes it, so memory
+    does not grow with the number of inputs. With unit weights the result matches
+    Combiner.average_combine: the mean, and the standard deviation of the inputs over
+    sqrt(N) as uncertainty. The first file provides the headers and WAVE extension.
+    """
+    def __init__(self):
+        self.files = []
+        self.science = None
+        self.sky = None
+        self.bitmask = None
+        self.template = None # headers/names of the first file, and its WAVE HDU
+
+    def add(self, path, weight=1.0):
+        with fits.open(path, memmap=True) as hdul:
+            science = np.array(hdul[SCIENCE_HDUS[0]].data, dtype=float)
+            sky = np.array(hdul[SKY_HDUS[0]].data, dtype=float)
+            bitmask = np.array(hdul[BITMASK_HDU].data)
+            if self.template is None:
+                self.template = _read_template(hdul)
+                self.science = _RunningMean(science.shape)
+                self.sky = _RunningMean(sky.shape)
+                self.bitmask = np.zeros_like(bitmask)
+            elif science.shape != self.science.mean.shape:
+                raise ValueError(f"{path} has {science.shape} pixels, the stack has {self.science.mean.shape}.")
+        self.science.add(science, weight)
+        self.sky.add(sky, weight)
+        # A flag is set in the output if it was set in ANY input mask
+        self.bitmask |= bitmask
+        self.files.append(path)
+
+    def to_hdulist(self):
+        """The stack with the layout of the inputs: primary, flux, UNCERT, BITMASK, WAVE, SKY, SKYERR."""
+        if self.template is None:
+            raise ValueError("No files were added to the stack.")
+        science, science_err = self.science.result()
+        sky, sky_err = self.sky.result()
+        return _stack_hdulist(self.template, self.files, science, science_err, self.bitmask, sky, sky_err)
+
+
+def _combine_pixels(values, errors, bad, method, weights, sigma=3.0, maxiters=5):
+    """
+    Combines (N, ...) stacks of flux and uncertainty along axis 0, leaving out `bad`
+    pixels. Returns (flux, propagated uncertainty); NaN where no input is left.
+    """
+    var = errors ** 2
+    good = ~bad & np.isfinite(values) & np.isfinite(var)
+    if method == 'ivar':
+        good &= var > 0
+    values = np.where(good, values, np.nan)
+    if method == 'sigclip':
+        # Iteratively reject pixels more than `sigma` standard deviations from the median;
+        # the scatter comes from the median absolute deviation, so one outlier cannot hide itself
+        for _ in range(maxiters):
+            center = np.nanmedian(values, axis=0)
+            std = 1.4826 * np.nanmedian(np.abs(values - center), axis=0)
+            clipped = np.abs(values - center) > sigma * std
+            if not clipped.any():
+                break
+            values = np.where(clipped, np.nan, values)
+        good = np.isfinite(values)
+    n = good.sum(axis=0)
+    var = np.where(good, var, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'median':
+            flux = np.nanmedian(values, axis=0)
+            # standard error of the median of (nearly) gaussian inputs
+            error = np.sqrt(np.pi / 2) * np.sqrt(var.sum(axis=0)) / n
+        else:
+            # ivar: weights 1/sigma^2 (times the file weights); average/sigclip: file weights over the kept pixels
+            w = np.where(good, weights / var if method == 'ivar' else weights, 0.0)
+            wsum = w.sum(axis=0)
+            flux = (w * np.nan_to_num(values)).sum(axis=0) / wsum
+            error = np.sqrt((w ** 2 * var).sum(axis=0)) / wsum
+    flux = np.where(n > 0, flux, np.nan)
+    error = np.where(n > 0, error, np.nan)
+    return flux, error
+
+
+def combine_chunked(file_list, method='ivar', weights=None, bad_bits=None, sigma=3.0, maxiters=5, chunk_size=1024):
+    """
+    Inverse-variance weighted mean ('ivar'), median or iterative sigma-clipped mean
+    ('sigclip') of 1D extraction files, with propagated uncertainties in UNCERT/SKYERR.
+
+    Pixels whose bitmask has any of `bad_bits` set (any bit if None) are left out.
+    The inputs are memory-mapped and read `chunk_size` wavelength pixels at a time,
+    so memory is bounded by N x chunk_size. `weights` scales each file (e.g. by
+    exposure time). The output BITMASK is the OR of the input masks.
+    """
+    if method not in COMBINE_METHODS[1:]:
+        raise ValueError(f"Unknown combine method '{method}'. Use one of: {', '.join(COMBINE_METHODS)}")
+    if not file_list:
+        raise ValueError("No files to stack.")
+    with fits.open(file_list[0], memmap=True) as hdul:
+        template = _read_template(hdul)
+        shape = hdul[SCIENCE_HDUS[0]].data.shape
+        bitmask = np.zeros(shape, dtype=hdul[BITMASK_HDU].data.dtype)
+    weights = np.ones(len(file_list)) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights.reshape((-1,) + (1,) * len(shape))
+    outputs = {hdu: np.full(shape, np.nan) for hdu in SCIENCE_HDUS + SKY_HDUS}
+
+    npix = shape[-1]
+    for start in range(0, npix, chunk_size):
+        cut = (Ellipsis, slice(start, min(start + chunk_size, npix)))
+        chunk = {hdu: [] for hdu in SCIENCE_HDUS + SKY_HDUS + (BITMASK_HDU,)}
+        for f in file_list:
+            with fits.open(f, memmap=True) as hdul:
+                if hdul[SCIENCE_HDUS[0]].data.shape != shape:
+                    raise ValueError(f"{f} has {hdul[SCIENCE_HDUS[0]].data.shape} pixels, the stack has {shape}.")
+                for hdu in chunk:
+                    chunk[hdu].append(np.array(hdul[hdu].data[cut]))
+        flags = np.array(chunk[BITMASK_HDU])
+        bitmask[cut] = np.bitwise_or.reduce(flags, axis=0)
+        bad = (flags != 0) if bad_bits is None else (flags & bad_bits) != 0
+        for flux_hdu, err_hdu in (SCIENCE_HDUS, SKY_HDUS):
+            with warnings.catch_warnings():
+                # pixels with no good input come out NaN; numpy's empty-slice warnings add nothing
+                warnings.simplefilter('ignore', RuntimeWarning)
+                flux, error = _combine_pixels(np.array(chunk[flux_hdu], dtype=float), np.array(chunk[err_hdu], dtype=float),
+                                              bad, method, weights, sigma=sigma, maxiters=maxiters)
+            outputs[flux_hdu][cut] = flux
+            outputs[err_hdu][cut] = error
+
+    return _stack_hdulist(template, list(file_list), outputs[SCIENCE_HDUS[0]], outputs[SCIENCE_HDUS[1]], bitmask,
+                          outputs[SKY_HDUS[0]], outputs[SKY_HDUS[1]], method=method)
+
+
+def wavelength_grid(waves, step=None, log_lambda=False):
+    """
+    Common wavelength grid covering every spectrum in `waves` (arrays of wavelengths).
+    `step` is in Angstrom, or in ln(lambda) with log_lambda; by default the median
+    dispersion of the inputs. Bins an input does not cover come out NaN for it.
+    """
+    waves = [np.asarray(w, dtype=float) for w in waves]
+    lo = min(np.nanmin(w) for w in waves)
+    hi = max(np.nanmax(w) for w in waves)
+    if log_lambda:
+        if step is None:
+            step = np.nanmedian(np.concatenate([np.abs(np.diff(np.log(w), axis=-1)).ravel() for w in waves]))
+        return np.exp(np.arange(np.log(lo), np.log(hi) + step / 2, step))
+    if step is None:
+        step = np.nanmedian(np.concatenate([np.abs(np.diff(w, axis=-1)).ravel() for w in waves]))
+    return np.arange(lo, hi + step / 2, step)
+
+
+def _pixel_edges(centers):
+    """Pixel edges (..., P+1) from pixel centers (..., P), halfway between neighbours."""
+    mid = (centers[..., 1:] + centers[..., :-1]) / 2
+    return np.concatenate([2 * centers[..., :1] - mid[..., :1], mid, 2 * centers[..., -1:] - mid[..., -1:]], axis=-1)
+
+
+def _batched_searchsorted(edges, values, side='left'):
+    """searchsorted of `values` (G,) in every row of `edges` (M, E), in one call."""
+    # shifting each row by more than the span of all values keeps the flattened rows sorted
+    span = max(np.nanmax(edges), values.max()) - min(np.nanmin(edges), values.min()) + 1
+    offset = span * np.arange(len(edges))[:, None]
+    return np.searchsorted((edges + offset).ravel(), (values[None, :] + offset).ravel(), side=side).reshape(len(edges), -1) \
+        - (edges.shape[1] * np.arange(len(edges)))[:, None]
+
+
+def resample_spectra(wave, flux, error, new_wave, bad=None):
+    """
+    Flux-conserving resampling of M spectra at once: wave, flux, error (and the `bad`
+    pixel mask) are (M, P) arrays, new_wave the (G,) grid of bin centers. Pixels are
+    treated as constant over their width, so each new bin gets the flux density
+    averaged over the input pixels it overlaps (by overlap width), and the uncertainty
+    is propagated the same way. Wavelengths must be finite and monotonic in each row.
+    Returns (M, G) flux and uncertainty; bins not fully
+    covered by the input or overlapping a bad pixel are NaN.
+    """
+    wave = np.asarray(wave, dtype=float)
+    flux, error = np.asarray(flux, dtype=float), np.asarray(error, dtype=float)
+    # native wavelengths may run either way; the grid is increasing
+    descending = wave[:, :1] > wave[:, -1:]
+    wave, flux, error = (np.where(descending, a[:, ::-1], a) for a in (wave, flux, error))
+    bad = np.zeros(flux.shape, dtype=bool) if bad is None else np.where(descending, bad[:, ::-1], bad)
+    bad = bad | ~np.isfinite(flux) | ~np.isfinite(error)
+    flux, error = np.where(bad, 0.0, flux), np.where(bad, 0.0, error)
+
+    M, P = flux.shape
+    edges = _pixel_edges(wave)
+    width = np.diff(edges, axis=-1)
+    new_edges = _pixel_edges(np.asarray(new_wave, dtype=float)[None, :])[0]
+    # cumulative flux, variance and bad-pixel count at the input pixel edges
+    zero = np.zeros((M, 1))
+    cum_flux = np.concatenate([zero, np.cumsum(flux * width, axis=-1)], axis=-1)
+    cum_var = np.concatenate([zero, np.cumsum((error * width) ** 2, axis=-1)], axis=-1)
+    cum_bad = np.concatenate([zero, np.cumsum(bad, axis=-1)], axis=-1)
+
+    # first and last input pixel each new bin overlaps by a nonzero width: a lower edge
+    # on a pixel edge starts in the pixel above it, an upper edge ends in the one below
+    a = _batched_searchsorted(edges, new_edges[:-1], side='right') - 1
+    b = _batched_searchsorted(edges, new_edges[1:], side='left') - 1
+    outside = (a < 0) | (a >= P) | (b < 0) | (b >= P)
+    a, b = np.clip(a, 0, P - 1), np.clip(b, 0, P - 1)
+
+    def at(a, index):
+        return np.take_along_axis(a, index, axis=-1)
+
+    lo, hi = new_edges[None, :-1], new_edges[None, 1:]
+    dlam = hi - lo
+    # integral of the flux density from the start of the spectrum to each new edge
+    def integral(x, pix):
+        return at(cum_flux, pix) + at(flux, pix) * (x - at(edges, pix))
+    new_flux = (integral(hi, b) - integral(lo, a)) / dlam
+    # partial first and last input pixels, plus the whole ones in between
+    same = a == b
+    first = np.where(same, hi, at(edges, a + 1)) - lo
+    last = np.where(same, 0.0, hi - at(edges, b))
+    var = (first * at(error, a)) ** 2 + (last * at(error, b)) ** 2 + np.where(same, 0.0, at(cum_var, b) - at(cum_var, a + 1))
+    new_error = np.sqrt(var) / dlam
+
+    masked = outside | (at(cum_bad, b + 1) - at(cum_bad, a) > 0)
+    return np.where(masked, np.nan, new_flux), np.where(masked, np.nan, new_error)
+
+
+def combine_resampled(file_list, method='ivar', weights=None, grid=None, log_lambda=False, step=None,
+                      bad_bits=None, sigma=3.0, maxiters=5):
+    """
+    Stacks 1D extraction files whose wavelength solutions differ (other nights,
+    flexure): flux, uncertainty and sky of every input are resampled onto a common
+    grid (resample_spectra, all inputs in one batch) and then combined with `method`
+    as in combine_chunked. `grid` gives the bin centers; by default one covering all
+    inputs (wavelength_grid, linear or with log_lambda logarithmic). The WAVE
+    extension of the output holds the grid and BITMASK the OR of the input bits at
+    the input pixels nearest to each bin.
+    """
+    if method not in COMBINE_METHODS:
+        raise ValueError(f"Unknown combine method '{method}'. Use one of: {', '.join(COMBINE_METHODS)}")
+    if not file_list:
+        raise ValueError("No files to stack.")
+    arrays = {hdu: [] for hdu in SCIENCE_HDUS + SKY_HDUS + (BITMASK_HDU, 'WAVE')}
+    template = None
+    for f in file_list:
+        with fits.open(f, memmap=True) as hdul:
+            if template is None:
+                template = _read_template(hdul)
+            for hdu in arrays:
+                arrays[hdu].append(np.atleast_2d(np.array(hdul[hdu].data)))
+    shapes = {a.shape for a in arrays[SCIENCE_HDUS[0]]}
+    if len({shape[0] for shape in shapes}) > 1:
+        raise ValueError(f"The inputs have different numbers of spectra: {sorted(shapes)}")
+    if grid is None:
+        grid = wavelength_grid(arrays['WAVE'], step=step, log_lambda=log_lambda)
+    grid = np.asarray(grid, dtype=float)
+
+    # one (N*S, P) batch per extension; inputs of different lengths are NaN-padded
+    npix = max(shape[1] for shape in shapes)
+    def batch(hdu, fill=np.nan):
+        return np.concatenate([np.pad(np.asarray(a, dtype=float), ((0, 0), (0, npix - a.shape[1])), constant_values=fill)
+                               for a in arrays[hdu]])
+    # wavelengths of the padding continue the last dispersion, so every row stays monotonic
+    wave = np.concatenate([np.concatenate([a, a[:, -1:] + (a[:, -1:] - a[:, -2:-1]) * np.arange(1, npix - a.shape[1] + 1)], axis=-1)
+                           for a in (np.asarray(w, dtype=float) for w in arrays['WAVE'])])
+    flags = batch(BITMASK_HDU, fill=0).astype(np.int64)
+    bad = (flags != 0) if bad_bits is None else (flags & bad_bits) != 0
+    nfiles, nspec = len(file_list), arrays[SCIENCE_HDUS[0]][0].shape[0]
+
+    # bitmask: input pixel nearest to each bin center
+    nearest = np.clip(_batched_searchsorted(_pixel_edges(np.sort(wave, axis=-1)), grid) - 1, 0, npix - 1)
+    ascending = np.where(wave[:, :1] > wave[:, -1:], flags[:, ::-1], flags)
+    bitmask = np.bitwise_or.reduce(np.take_along_axis(ascending, nearest, axis=-1).reshape(nfiles, nspec, -1), axis=0)
+
+    weights = np.ones(nfiles) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights.reshape(-1, 1, 1)
+    outputs = {}
+    for flux_hdu, err_hdu in (SCIENCE_HDUS, SKY_HDUS):
+        flux, error = resample_spectra(wave, batch(flux_hdu), batch(err_hdu), grid, bad=bad)
+        flux, error = flux.reshape(nfiles, nspec, -1), error.reshape(nfiles, nspec, -1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            outputs[flux_hdu], outputs[err_hdu] = _combine_pixels(flux, error, np.zeros(flux.shape, dtype=bool),
+                                                                  method, weights, sigma=sigma, maxiters=maxiters)
+
+    template = dict(template)
+    header = template['wave'].header.copy()
+    header['RESAMPLE'] = ('log-lambda' if log_lambda else 'linear', 'cofi_stacker common grid')
+    template['wave'] = fits.ImageHDU(data=np.tile(grid, (nspec, 1)), header=header, name='WAVE')
+    return _stack_hdulist(template, list(file_list), outputs[SCIENCE_HDUS[0]], outputs[SCIENCE_HDUS[1]],
+                          bitmask.astype(arrays[BITMASK_HDU][0].dtype), outputs[SKY_HDUS[0]], outputs[SKY_HDUS[1]],
+                          method=method)
+
+
+def combine_spectra(file_list, weights=None, method='average', resample=None, **params):
+    """
+    Combines the 1D extraction files in file_list (science HDUs 1/2, sky 5/6,
+    bitmasks OR-ed) into a new HDUList with the same layout. No GUI involved.
+
+    'average' streams the files one at a time (see StreamingStack); 'ivar', 'median'
+    and 'sigclip' leave out flagged pixels and propagate the uncertainties (see
+    combine_chunked, which takes `params`). `weights` gives one weight per file.
+    With resample='linear' or 'log' the inputs are first put on a common wavelength
+    or log-lambda grid (see combine_resampled), for inputs whose WAVE differ.
+    """
+    if resample:
+        return combine_resampled(file_list, method=method, weights=weights, log_lambda=resample == 'log', **params)
+    if method != 'average':
+        return combine_chunked(file_list, method=method, weights=weights, **params)
+    stack = StreamingStack()
+    for i, f in enumerate(file_list):
+        stack.add(f, 1.0 if weights is None else weights[i])
+    return stack.to_hdulist()
+
+
+def write_stacked(final_hdul, output_name, outdir='.'):
+    """Writes a stacked HDUList as <outdir>/stacked_<name>/stacked_<output_name>.fits and returns the path."""
+    # Define output filename
+    output_filename = f'stacked_{output_name}.fits'
+
+    # Write to FITS file
+    name = output_name.split("_")[0]
+
+    folder_name = os.path.join(outdir, f"stacked_{name}")
+    os.makedirs(folder_name, exist_ok=True) # Safely create directory
+
+    full_path = os.path.join(folder_name, output_filename)
+
+    final_hdul.writeto(full_path, overwrite=True)
+    return full_path
+
+
+def find_extractions(root='.', folders='*_1d_extractions', pattern='*.fits'):
+    """1D extraction files under root, from every folder matching `folders`, sorted."""
+    return sorted(glob.glob(os.path.join(root, folders, pattern)))
+
+
+def group_spectra(paths, keys=TARGET_KEYWORDS, exposure_key=EXPOSURE_KEYWORD):
+    """
+    Groups 1D extraction files by the values of the header `keys` (by default the
+    mask OBJNAME and the target ID). Returns {tuple of values: [paths]}; files whose
+    header lacks a key are reported and left out.
+
+    Each exposure (header `exposure_key`) counts once per target: re-extractions of
+    the same exposure (another radius or sky calibration, which stay in the folder)
+    are reported and only the most recently written one is kept.
+    """
+    groups = OrderedDict()
+    missing = []
+    for path in paths:
+        header = fits.getheader(path)
+        if any(key not in header for key in keys):
+            missing.append(path)
+            continue
+        # files without the exposure keyword cannot be matched up, so each counts as its own exposure
+        exposure = str(header[exposure_key]).strip() if exposure_key in header else path
+        target = groups.setdefault(tuple(str(header[key]).strip() for key in keys), OrderedDict())
+        target.setdefault(exposure, []).append(path)
+    if missing:
+        print(f"⚠️ {len(missing)} file(s) without {'/'.join(keys)} in the header were skipped "
+              f"(extractions written before TARGID was recorded need to be extracted again), e.g. {missing[0]}")
+
+    for target, exposures in groups.items():
+        for exposure, files in exposures.items():
+            if len(files) > 1:
+                files.sort(key=os.path.getmtime)
+                print(f"⚠️ {'_'.join(target)}: {len(files)} extractions of exposure {exposure}; "
+                      f"stacking only the newest, {files[-1]} (skipped: {', '.join(files[:-1])})")
+        groups[target] = [files[-1] for files in exposures.values()]
+    return groups
+
+
+def _stack_target(target, paths, outdir, method, resample, params):
+    """Stacks and writes the spectra of one target (run in a worker process). Returns the output path."""
+    hdul = combine_spectra(paths, method=method, resample=resample, **params)
+    return write_stacked(hdul, '_'.join(target), outdir=outdir)
+
+
+def stack_targets(root='.', folders='*_1d_extractions', pattern='*.fits', keys=TARGET_KEYWORDS, method='ivar',
+                  resample=None, outdir='.', min_files=2, workers=None, **params):
+    """
+    Coadds every target of a mask over all its exposures in one pass: the 1D
+    extractions in the `folders` under root are grouped by header (group_spectra)
+    and each target with at least `min_files` spectra is stacked with
+    combine_spectra(method, resample, **params) and written with write_stacked
+    (stacked_<OBJNAME>/stacked_<OBJNAME>_<TARGID>.fits under outdir). With
+    workers > 1 the targets are stacked in a process pool. Returns one row per
+    target: the key values, the number of files and the output path (None if skipped
+    or failed).
+    """
+    groups = group_spectra(find_extractions(root, folders, pattern), keys)
+    if not groups:
+        print(f"❌ No 1D extractions found in {os.path.join(root, folders)}.")
+    rows, jobs = [], []
+    for target, paths in groups.items():
+        row = dict(zip(keys, target), nfiles=len(paths), output=None)
+        rows.append(row)
+        if len(paths) < min_files:
+            print(f"ℹ️ {'_'.join(target)}: {len(paths)} spectra (fewer than {min_files}), not stacked.")
+            continue
+        jobs.append((row, (target, paths, outdir, method, resample, params)))
+
+    def finish(row, result):
+        try:
+            row['output'] = result()
+            print(f"✅ {row['output']} ({row['nfiles']} spectra)")
+        except Exception as e:
+            print(f"❌ Stacking {'_'.join(str(row[key]) for key in keys)} failed: {e}")
+
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        for row, job in jobs:
+            finish(row, lambda: _stack_target(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(row, pool.submit(_stack_target, *job)) for row, job in jobs]
+            for row, future in futures:
+                finish(row, future.result)
+    return pd.DataFrame(rows, columns=list(keys) + ['nfiles', 'output'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cofi-stack',
+                                     description='Stack the 1D extractions of every target across exposures.')
+    parser.add_argument('root', nargs='?', default='.', help='folder holding the *_1d_extractions folders')
+    parser.add_argument('--folders', default='*_1d_extractions', help='glob of the extraction folders')
+    parser.add_argument('--pattern', default='*.fits', help='glob of the spectra inside them (e.g. "2d_ad_5_*")')
+    parser.add_argument('--keys', default=','.join(TARGET_KEYWORDS), help='header keywords identifying a target')
+    parser.add_argument('--method', choices=COMBINE_METHODS, default='ivar', help='combine method')
+    parser.add_argument('--resample', choices=['linear', 'log'], help='stack on a common wavelength grid')
+    parser.add_argument('--outdir', default='.', help='where the stacked_<OBJNAME> folders are written')
+    parser.add_argument('--min-files', type=int, default=2, help='smallest number of spectra to stack')
+    parser.add_argument('--workers', type=int, help='worker processes (one target each)')
+    parser.add_argument('--dry-run', action='store_true', help='list the targets and their files and exit')
+    args = parser.parse_args(argv)
+
+    keys = tuple(key.strip().upper() for key in args.keys.split(','))
+    if args.dry_run:
+        for target, paths in group_spectra(find_extractions(args.root, args.folders, args.pattern), keys).items():
+            print(f"{'_'.join(target)}: {len(paths)}")
+            for path in paths:
+                print(f"  {path}")
+        return 0
+    table = stack_targets(args.root, folders=args.folders, pattern=args.pattern, keys=keys, method=args.method,
+                          resample=args.resample, outdir=args.outdir, min_files=args.min_files, workers=args.workers)
+    print(table.to_string(index=False))
+    failed = table[table['output'].isna() & (table['nfiles'] >= args.min_files)]
+    return 1 if table.empty or len(failed) else 0
+
+
 def stacker():
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, clear_output
     
     file_entry = widgets.Text(description="""Files' paths""",
                               placeholder= 'e.g [file1.fits,file2.fits,file3.fits]')
     output_file = widgets.Text(description="Output file",
                               placeholder= 'e.g. M3_TARG101')
+    method_dropdown = widgets.Dropdown(description='Combine', options=COMBINE_METHODS, value='average')
+    grid_dropdown = widgets.Dropdown(description='Grid', value=None,
+                                     options=[('input pixels', None), ('linear', 'linear'), ('log-lambda', 'log')])
     
     button = widgets.Button(description='Stack', button_style='success')
     output = widgets.Output() # An area to print messages
@@ -43,119 +562,8 @@ def stacker():
         with output:
             clear_output(wait=True)
             file_list = get_srt_or_list(file_entry.value)
-            # Open all files and store their HDULists
-            hdul_list = [fits.open(f) for f in file_list]
-            # Let's inspect the first one to remember the structure
-            print("Original FITS Structure:")
-            hdul_list[0].info()
-            print("-" * 30)
-            
-            
-            # --- 2. Prepare data for combining ---
-            # We will create lists of CCDData objects for both science and sky spectra
-            science_ccd_list = []
-            sky_ccd_list = []
-            bitmasks = []
-            
-            for hdul in hdul_list:
-                # Science data (HDU 1 and 2)
-                science_ccd = CCDData(data=hdul[1].data, 
-                                      uncertainty=hdul[2].data, 
-                                      unit='adu') # Using 'adu' or 'electron' might be more accurate than 'pixel'
-                science_ccd_list.append(science_ccd)
-            
-                # Sky data (HDU 5 and 6)
-                sky_ccd = CCDData(data=hdul[5].data, 
-                                  uncertainty=hdul[6].data, 
-                                  unit='adu')
-                sky_ccd_list.append(sky_ccd)
-            
-                # Collect bitmasks (HDU 3)
-                bitmasks.append(hdul[3].data)
-            
-            
-            # --- 3. Perform the combining operations ---
-            
-            # Combine the SCIENCE spectra
-            combiner_sci = Combiner(science_ccd_list)
-            combined_science = combiner_sci.average_combine()
-            
-            # Combine the SKY spectra
-            combiner_sky = Combiner(sky_ccd_list)
-            combined_sky = combiner_sky.average_combine()
-            
-            # Combine the BITMASKS using a bitwise OR
-            # This ensures a flag is set in the output if it was set in ANY input mask.
-            # np.bitwise_or.reduce() applies the OR operation across the list of arrays.
-            combined_mask = np.bitwise_or.reduce(bitmasks)
-            
-            
-            # --- 4. Build the new FITS file with the original structure ---
-            
-            # Use the first file as a template for headers.
-            template_hdul = hdul_list[0]
-            
-            # Create the Primary HDU. It's good practice to copy the original header.
-            # We add a HISTORY card to document the stacking.
-            primary_hdu = fits.PrimaryHDU(header=template_hdul[0].header)
-            primary_hdu.header['HISTORY'] = 'Stacked from {} files.'.format(len(file_list))
-            for f in file_list:
-                primary_hdu.header['HISTORY'] = f'  - {f.split("/")[-1]}' # Add source files to history
-            
-            # Create the new ImageHDUs for the combined data.
-            # We copy the header from the corresponding extension in the template file.
-            # Note: The original data had shape (4096, 1). Combiner returns a 1D array.
-            # We reshape it back to match the original dimensions.
-            # The data extension in the original is unnamed but corresponds to the science flux.
-            science_hdu = fits.ImageHDU(data=combined_science.data,
-                                         header=template_hdul[1].header,
-                                         name=template_hdul[1].name) # Name is likely ' ' or can be set to 'SCI'
-            
-            uncert_hdu = fits.ImageHDU(data=combined_science.uncertainty.array,
-                                        header=template_hdul[2].header,
-                                        name='UNCERT')
-            
-            bitmask_hdu = fits.ImageHDU(data=combined_mask,
-                                         header=template_hdul[3].header,
-                                         name='BITMASK')
-            
-            # The Wavelength solution is the same, so we can just copy the whole HDU.
-            wave_hdu = template_hdul['WAVE']
-            
-            # Create the new HDUs for the combined sky.
-            sky_hdu = fits.ImageHDU(data=combined_sky.data,
-                                     header=template_hdul[5].header,
-                                     name='SKY')
-            
-            skyerr_hdu = fits.ImageHDU(data=combined_sky.uncertainty.array,
-                                      header=template_hdul[6].header,
-                                      name='SKYERR')
-            
-            # --- 5. Assemble and save the final FITS file ---
-            
-            # Create the final HDUList in the correct order
-            final_hdul = fits.HDUList([
-                primary_hdu,
-                science_hdu,
-                uncert_hdu,
-                bitmask_hdu,
-                wave_hdu,
-                sky_hdu,
-                skyerr_hdu
-            ])
-            
-            # Define output filename
-            output_filename = f'stacked_{output_file.value}.fits'
-            
-            # Write to FITS file
-            name = output_file.value.split("_")[0]
-            
-            folder_name = f"stacked_{name}"
-            os.makedirs(folder_name, exist_ok=True) # Safely create directory
-            
-            full_path = os.path.join(folder_name, output_filename)
-            
-            final_hdul.writeto(full_path, overwrite=True)
+            final_hdul = combine_spectra(file_list, method=method_dropdown.value, resample=grid_dropdown.value)
+            full_path = write_stacked(final_hdul, output_file.value)
             
             # --- 6. Verify the output file structure ---
             print(f"Stacked file '{full_path}' created. Verifying structure:")
@@ -164,10 +572,11 @@ def stacker():
             
             # --- Optional: Plot and compare ---
             plt.figure(figsize=(12, 6))
-            # Plot one of the original spectra
-            for i in range(len(file_list)):
-                plt.plot(hdul_list[i]['WAVE'].data[0], hdul_list[i][1].data[0], 
-                         label=f'Original Spectrum {hdul_list[i][0].header['OBJNAME']} {i}', alpha=0.7)
+            # Plot the original spectra, opening one file at a time
+            for i, f in enumerate(file_list):
+                with fits.open(f) as hdul:
+                    plt.plot(hdul['WAVE'].data[0], hdul[1].data[0],
+                             label=f"Original Spectrum {hdul[0].header['OBJNAME']} {i}", alpha=0.7)
             # Plot the final stacked spectrum
             plt.plot(final_hdul['WAVE'].data[0], final_hdul[1].data[0], label='Stacked Spectrum', color='black', linewidth=1.5)
             plt.title('Comparison of Original and Stacked Spectrum')
@@ -176,10 +585,10 @@ def stacker():
             plt.legend()
             plt.grid(True, linestyle='--', alpha=0.6)
             plt.show()
-            
-            # Close all the opened FITS files
-            for hdul in hdul_list:
-                hdul.close()
     
     button.on_click(on_button_clicked)
-    display(widgets.HBox([file_entry,output_file,button]), output)
\ No newline at end of file
+    display(widgets.HBox([file_entry,output_file,method_dropdown,grid_dropdown,button]), output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# cofi_reduction/geometry.py
+
+import os
+import copy
+import pickle
+from .processor import CofiProcessor, wavcal_path
+
+
+class MaskGeometry:
+    """
+    Everything about a KMS mask that is shared by all of its exposures in a night:
+    the slit trace, the (filtered) targets and each slit's CofIwav_* wavelength solution.
+
+    Build it once from a pipeline that has run Find Slits, Update Arc Headers and
+    Wave Cal, then apply it to any number of reduced science frames. The solution
+    file of each slit is kept in the WAVCAL column of `targets`, which the
+    extraction steps use in place of the OBJNAME-based file name.
+    """
+    def __init__(self, trace, targets, wavecal_files, objname=None):
+        """
+        Parameters
+        ----------
+        trace : pyvista.spectra.Trace
+            slit trace from find_slits (and filter_slits)
+        targets : astropy.table.Table
+            targets matching the trace, in slit order
+        wavecal_files : dict
+            target ID -> wavelength solution file
+        objname : str, optional
+            OBJNAME of the arc the solutions were fitted on
+        """
+        self.trace = copy.deepcopy(trace)
+        self.targets = targets.copy()
+        self.objname = objname
+        self.targets['WAVCAL'] = [os.path.abspath(wavecal_files[str(targ_id)]) for targ_id in targets['ID']]
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Geometry of the current trace/targets of a CofiPipeline (or widget) after wavelength calibration."""
+        for name in ('trace', 'targets', 'arcec'):
+            if getattr(pipeline, name) is None:
+                raise RuntimeError(f"'{name}' is not available. Run Find Slits, Update Arc Headers and Wave Cal first.")
+        objname = pipeline.arcec[0].header['OBJNAME']
+        wavecal_files = {str(targ['ID']): wavcal_path(objname, targ['ID']) for targ in pipeline.targets}
+        geometry = cls(pipeline.trace, pipeline.targets, wavecal_files, objname=objname)
+        missing = geometry.missing_solutions()
+        if missing:
+            print(f"⚠️ No wavelength solution yet for: {', '.join(missing)}")
+        return geometry
+
+    def missing_solutions(self):
+        """IDs of the targets whose wavelength solution file does not exist."""
+        return [str(targ['ID']) for targ in self.targets if not os.path.exists(targ['WAVCAL'])]
+
+    def save(self, path):
+        """Pickles the geometry; the wavelength solutions stay in their own files."""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def apply(self, frames, red, flat_frame=None, folder=None, adjust_wavelength=False, skyline_radii=None,
+              workers=None, processor=None, **params):
+        """
+        Cuts and wavelength-corrects several reduced science frames with this geometry.
+
+        `frames` is a dict of reduced frames (e.g. CofiPipeline.reduced_frames) or a
+        list of them. Each frame goes through CofiProcessor.extract2d_slitlets with
+        the same trace, targets and solutions; other keywords are passed through.
+        Returns a dict with the same keys (list positions for a list) holding the
+        corrected slitlets of each frame.
+        """
+        missing = self.missing_solutions()
+        if missing:
+            raise FileNotFoundError(f"Wavelength solutions missing for: {', '.join(missing)}")
+        if not isinstance(frames, dict):
+            frames = dict(enumerate(frames))
+        processor = processor or CofiProcessor()
+
+        spec2d = {}
+        for key, imcr in frames.items():
+            print(f"🚀 Extracting frame {key} with mask geometry ({len(self.targets)} slits)...")
+            spec2d[key] = processor.extract2d_slitlets(red, self.trace, self.targets, imcr, flat_frame,
+                                                       folder=folder, adjust_wavelength=adjust_wavelength,
+                                                       skyline_radii=skyline_radii, workers=workers, **params)
+        return spec2d
@@ -0,0 +1,188 @@
+# cofi_reduction/graph.py
+
+from collections import OrderedDict
+from .cache import fingerprint
+from .log import read_log
+from .replay import PLAN_STEPS, log_to_plan
+
+# Steps each plan step reads the results of
+STEP_DEPENDS = {
+    'read_folder': [],
+    'compute_bias': ['read_folder'],
+    'compute_dark': ['read_folder', 'compute_bias'],
+    'compute_flat': ['read_folder', 'compute_bias', 'compute_dark'],
+    'compute_arcs': ['read_folder'],
+    'find_slits': ['read_folder'],
+    'filter_slits': ['find_slits'],
+    'update_arc_headers': ['compute_arcs', 'find_slits', 'filter_slits'],
+    'calibrate_wavelength': ['update_arc_headers'],
+    'reduce_science': ['read_folder', 'compute_bias', 'compute_dark', 'compute_flat'],
+    'reduce_sciences': ['read_folder', 'compute_bias', 'compute_dark', 'compute_flat'],
+    'extract2d': ['reduce_science', 'reduce_sciences', 'find_slits', 'filter_slits', 'calibrate_wavelength', 'compute_flat'],
+    'extract1d': ['extract2d'],
+}
+
+# (step, dependency) -> (keyword, default): the dependency only holds while the keyword is true
+OPTIONAL_DEPENDS = {
+    ('compute_dark', 'compute_bias'): ('apply_bias', True),
+    ('compute_flat', 'compute_bias'): ('apply_bias', True),
+    ('compute_flat', 'compute_dark'): ('apply_dark', True),
+    ('reduce_science', 'compute_bias'): ('apply_bias', True),
+    ('reduce_science', 'compute_dark'): ('apply_dark', True),
+    ('reduce_science', 'compute_flat'): ('apply_flat', False),
+    ('reduce_sciences', 'compute_bias'): ('apply_bias', True),
+    ('reduce_sciences', 'compute_dark'): ('apply_dark', True),
+    ('reduce_sciences', 'compute_flat'): ('apply_flat', False),
+    ('extract2d', 'compute_flat'): ('apply_flat', True),
+}
+
+# Pipeline attributes each step sets, restored from the memo instead of recomputing
+STEP_OUTPUTS = {
+    'read_folder': ['red'],
+    'compute_bias': ['bias_frame'],
+    'compute_dark': ['dark_frame'],
+    'compute_flat': ['flat_frame'],
+    'compute_arcs': ['arcs_frame'],
+    'find_slits': ['trace', 'targets', 'full_trace', 'full_targets'],
+    'filter_slits': ['trace', 'targets'],
+    'update_arc_headers': ['arcec'],
+    'calibrate_wavelength': [], # writes CofIwav_* files
+    'reduce_science': ['reduced_frame'],
+    'reduce_sciences': ['reduced_frame', 'reduced_frames'],
+    'extract2d': ['spec2d_out'],
+    'extract1d': ['spec1d_out'],
+}
+
+# Steps whose files on disk must match their parameters, so they are rerun rather than restored
+FILE_STEPS = {'calibrate_wavelength', 'extract2d', 'extract1d'}
+
+
+class StepGraph:
+    """
+    Dependency graph of the reduction steps of a CofiPipeline, with memoized outputs.
+
+    Steps and their keyword arguments use the replay plan format (see replay.log_to_plan).
+    Each step gets a fingerprint of its own keywords and of the fingerprints of the
+    steps it depends on, so changing one parameter (set()) only makes that step and the
+    steps downstream of it stale. run() recomputes the stale steps; in-memory outputs of
+    earlier runs with the same fingerprint (the last `memo_size` per step) are put back
+    on the pipeline instead of being recomputed. Steps that write files (FILE_STEPS)
+    always rerun, relying on the wavelength-solution cache where there is one.
+    """
+    def __init__(self, pipeline, plan=None, memo_size=2):
+        self.pipeline = pipeline
+        self.plan = OrderedDict()
+        self.memo_size = memo_size
+        self.done = {}  # step -> fingerprint of the outputs currently on the pipeline
+        self.memo = {}  # step -> OrderedDict(fingerprint -> {attribute: value})
+        for step, kwargs in (plan or {}).items():
+            self.set(step, **kwargs)
+
+    @classmethod
+    def from_log(cls, pipeline, log_file, folder=None, memo_size=2):
+        """Graph of the steps recorded in a widget log."""
+        return cls(pipeline, log_to_plan(read_log(log_file), folder=folder), memo_size=memo_size)
+
+    def _order(self):
+        self.plan = OrderedDict((step, self.plan[step]) for step in PLAN_STEPS if step in self.plan)
+
+    def set(self, step, replace=False, **kwargs):
+        """
+        Updates (or with replace, sets) the keywords of a step. Returns the steps made stale.
+        """
+        if step not in STEP_DEPENDS:
+            raise ValueError(f"Unknown step '{step}'. Use one of: {', '.join(PLAN_STEPS)}")
+        before = self.stale()
+        if replace or step not in self.plan:
+            self.plan[step] = dict(kwargs)
+        else:
+            self.plan[step].update(kwargs)
+        self._order()
+        return [s for s in self.stale() if s not in before]
+
+    def remove(self, step):
+        """Drops a step (e.g. filter_slits) from the graph."""
+        self.plan.pop(step, None)
+        self.done.pop(step, None)
+
+    def depends(self, step):
+        """Steps of the graph that `step` currently depends on."""
+        kwargs = self.plan.get(step, {})
+        deps = []
+        for dep in STEP_DEPENDS[step]:
+            if dep not in self.plan:
+                continue
+            flag = OPTIONAL_DEPENDS.get((step, dep))
+            if flag is not None and not kwargs.get(*flag):
+                continue
+            deps.append(dep)
+        return deps
+
+    def downstream(self, step):
+        """Steps that (directly or not) depend on `step`, in run order."""
+        affected = {step}
+        for other in self.plan:
+            if any(dep in affected for dep in self.depends(other)):
+                affected.add(other)
+        return [other for other in self.plan if other in affected and other != step]
+
+    def fingerprints(self):
+        """step -> fingerprint of its keywords and of its dependencies' fingerprints."""
+        keys = {}
+        for step, kwargs in self.plan.items():
+            keys[step] = fingerprint(step, kwargs, [keys[dep] for dep in self.depends(step)])
+        return keys
+
+    def stale(self):
+        """Steps whose outputs are missing or out of date, in run order."""
+        keys = self.fingerprints()
+        return [step for step in self.plan if self.done.get(step) != keys[step]]
+
+    def invalidate(self, step):
+        """Forces a step (and so everything downstream of it) to be recomputed on the next run."""
+        self.done.pop(step, None)
+        self.memo.pop(step, None)
+        return [step] + self.downstream(step)
+
+    def _snapshot(self, step):
+        outputs = {}
+        for name in STEP_OUTPUTS[step]:
+            value = getattr(self.pipeline, name)
+            outputs[name] = dict(value) if isinstance(value, dict) else value
+        return outputs
+
+    def _remember(self, step, key):
+        memo = self.memo.setdefault(step, OrderedDict())
+        memo[key] = self._snapshot(step)
+        memo.move_to_end(key)
+        while len(memo) > self.memo_size:
+            memo.popitem(last=False)
+
+    def run(self, stop_after=None):
+        """
+        Brings every step up to date, in order, optionally stopping after `stop_after`.
+        Returns the list of steps that were actually recomputed.
+        """
+        keys = self.fingerprints()
+        recomputed = []
+        for step, kwargs in self.plan.items():
+            key = keys[step]
+            if self.done.get(step) == key:
+                print(f"✅ {step} up to date.")
+            elif step not in FILE_STEPS and key in self.memo.get(step, {}):
+                for name, value in self.memo[step][key].items():
+                    setattr(self.pipeline, name, value)
+                self.memo[step].move_to_end(key)
+                self.done[step] = key
+                print(f"ℹ️ {step} restored from an earlier run with the same parameters.")
+            else:
+                print(f"🚀 {step} ...")
+                self.done.pop(step, None)
+                getattr(self.pipeline, step)(**kwargs)
+                self.done[step] = key
+                self._remember(step, key)
+                recomputed.append(step)
+                print(f"✅ {step} done.")
+            if step == stop_after:
+                break
+        return recomputed
@@ -51,4 +51,48 @@ class CofiLogger:
             # Write parameters as a JSON block for easy and robust parsing
             f.write("PARAMETERS:\n")
             f.write(json.dumps(parameters, indent=4))
-            f.write("\n" + "-" * 60 + "\n")
\ No newline at end of file
+            f.write("\n" + "-" * 60 + "\n")
+
+def parse_log(log_content):
+    """
+    Parses the text of a CofiLogger log into its logged actions.
+
+    Returns a dict with the 'target' named in the log header (None if absent) and
+    'actions', a list of dicts with 'tab', 'action', 'timestamp' and 'parameters'
+    in the order they were logged.
+    """
+    target = None
+    actions = []
+    current = None
+    in_params_block = False
+    json_str_buffer = ""
+    for line in log_content.splitlines():
+        stripped = line.strip()
+        if in_params_block:
+            json_str_buffer += line
+            try:
+                current['parameters'] = json.loads(json_str_buffer)
+                in_params_block = False
+            except json.JSONDecodeError:
+                pass
+            continue
+        if stripped.startswith("# CofI Reduction Log for Target:"):
+            target = stripped.split(":", 1)[1].strip()
+        elif stripped.startswith("[TAB:") and stripped.endswith("]"):
+            current = {'tab': stripped[len("[TAB:"):-1].strip(), 'action': None,
+                       'timestamp': None, 'parameters': {}}
+            actions.append(current)
+        elif current is not None and stripped.startswith("ACTION:"):
+            current['action'] = stripped.split(":", 1)[1].strip()
+        elif current is not None and stripped.startswith("TIMESTAMP:"):
+            current['timestamp'] = stripped.split(":", 1)[1].strip()
+        elif current is not None and stripped == "PARAMETERS:":
+            in_params_block = True
+            json_str_buffer = ""
+    return {'target': target, 'actions': actions}
+
+
+def read_log(log_file):
+    """Reads and parses a CofiLogger log file (see parse_log)."""
+    with open(log_file, 'r') as f:
+        return parse_log(f.read())
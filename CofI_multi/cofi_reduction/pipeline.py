@@ -0,0 +1,728 @@
+# cofi_reduction/pipeline.py
+
+import os
+import copy
+import time
+import inspect
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from pyvista import imred, slitmask, spectra
+from .processor import CofiProcessor, EXTRACTION_RADII
+from .geometry import MaskGeometry
+from .cache import CalibrationCache, WavecalCache, data_digest
+from .catalog import HeaderCatalog
+from . import classify
+from .session import Session, SESSION_STATE
+from .progress import Cancelled, check_cancelled, report
+
+
+def parse_frames(input_str):
+    """
+    Frame list as typed in the widget: '7,8,9' or '7-9' give [7, 8, 9]; entries that
+    are not numbers are kept as file names.
+    """
+    if isinstance(input_str, (list, tuple, range)):
+        return list(input_str)
+    if isinstance(input_str, int):
+        return [input_str]
+    frames = []
+    for item in (x.strip() for x in str(input_str).split(',')):
+        if not item:
+            continue
+        first, sep, last = item.partition('-')
+        if sep and first.isdigit() and last.isdigit():
+            frames.extend(range(int(first), int(last) + 1))
+        elif item.isdigit():
+            frames.append(int(item))
+        else:
+            frames.append(item)
+    return frames
+
+
+# Reducer and master calibrations shared with the reduce workers, sent once per process
+_worker_state = {}
+
+
+def _init_reduce_worker(red, bias, dark, flat):
+    _worker_state.update(red=red, bias=bias, dark=dark, flat=flat)
+
+
+def _reduce_frame(frame, params):
+    """Reduces one science frame in a worker process with the shared master calibrations."""
+    red = _worker_state['red']
+    return red.reduce(num=frame, bias=_worker_state['bias'], dark=_worker_state['dark'],
+                      flat=_worker_state['flat'], display=None, **params)
+
+
+# Calibrations built by build_calibrations, the pipeline attribute each one fills and
+# the calibrations it needs first (when applied)
+CALIBRATION_ATTRS = {'bias': 'bias_frame', 'dark': 'dark_frame', 'flat': 'flat_frame', 'arcs': 'arcs_frame'}
+CALIBRATION_DEPENDS = {'bias': [], 'arcs': [], 'slit_flat': [], 'dark': ['bias'], 'flat': ['bias', 'dark']}
+
+
+def _init_calibration_worker(red):
+    _worker_state.update(red=red)
+
+
+def _build_calibration(kind, frames, params, bias=None, dark=None, red=None):
+    """Builds one master (or the reduced slit-finding flat); module level so it can run in a worker."""
+    red = red or _worker_state['red']
+    if kind == 'bias':
+        return red.mkbias(frames, display=None, **params)
+    if kind == 'dark':
+        return red.mkdark(frames, bias=bias, display=None, **params)
+    if kind == 'flat':
+        return red.mkflat(frames, bias=bias, dark=dark, display=None, **params)
+    if kind == 'arcs':
+        return red.sum(frames)
+    if kind == 'slit_flat':
+        return red.reduce(frames[0], display=None)
+    raise ValueError(f"Unknown calibration '{kind}'")
+
+
+class CofiPipeline:
+    """
+    Widget-free driver for the KOSMOS multi-slit reduction chain.
+
+    Each step of the CofiReductionWidget (read folder, bias, dark, flat, arcs,
+    find/filter slits, arc headers, reduce, wavelength calibration, 2D and 1D
+    extraction) is a method with explicit arguments. Results are returned and
+    also kept on the instance, so later steps pick them up the same way the
+    widget buttons do.
+    """
+    def __init__(self, indir=None, inst='KOSMOS', display=None, logger=None, use_cache=True, cache_dir=None,
+                 session_dir=None):
+        """
+        Parameters
+        ----------
+        indir : str, optional
+            data folder; if given, read_folder() is run immediately
+        inst : str, default='KOSMOS'
+            instrument name passed to imred.Reducer
+        display : pyvista.tv.TV, optional
+            display used by the pyvista calls; None runs fully headless
+        logger : CofiLogger, optional
+            if given, per-target 1D extraction parameters are logged
+        use_cache : bool, default=True
+            load master bias/dark/flat/arcs from the calibration cache when the
+            same frames were already combined with the same parameters, and reuse
+            wavelength solutions whose arc data and fit parameters are unchanged
+        cache_dir : str, optional
+            cache location (default: cache.default_cache_dir())
+        session_dir : str, optional
+            if given, the state is checkpointed there after every step (see session.Session)
+        """
+        self.inst = inst
+        self.display = display
+        self.logger = logger
+        self.processor = CofiProcessor(display_1=display)
+        self.calib_cache = CalibrationCache(cache_dir) if use_cache else None
+        self.catalog_dir = cache_dir if use_cache else False
+        self.catalog = None # HeaderCatalog of the data folder, see header_catalog()
+        self.wave_cache = WavecalCache(cache_dir) if use_cache else None
+        self._calib_keys = {} # master attribute -> (master, cache key) it was built/loaded with
+        self.session = Session(session_dir) if session_dir else None
+        self._lazy = {} # state saved in a resumed session, read on first access
+
+        # Reduction state, filled in as the steps run
+        self.red = None
+        self.bias_frame = None
+        self.dark_frame = None
+        self.flat_frame = None
+        self.arcs_frame = None
+        self.trace = None
+        self.targets = None
+        self.reduced_frame = None
+        self.reduced_frames = {}
+        self.slit_flats = {} # flat frame -> reduced image used by find_slits
+        self.spec2d_out = None
+        self.spec2d_by_frame = {}
+        self.spec1d_out = None
+        self.radius_summary = None
+        self.arcec = None
+        self.full_trace = None
+        self.full_targets = None
+
+        if indir is not None:
+            self.read_folder(indir)
+
+    def __getattr__(self, name):
+        # Only called for attributes not set yet, i.e. state still on disk after resume()
+        loaders = self.__dict__.get('_lazy')
+        if loaders and name in loaders:
+            print(f"ℹ️ Loading '{name}' from session...")
+            value = loaders.pop(name)()
+            setattr(self, name, value)
+            return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    # --- Session checkpoints ---
+    def start_session(self, session_dir):
+        """Checkpoints the state to `session_dir` from now on, starting with everything already computed."""
+        self.session = Session(session_dir)
+        names = [name for name in SESSION_STATE if self.__dict__.get(name) not in (None, {})]
+        if names:
+            self.session.save(self, names, step='start_session')
+        return self.session
+
+    def checkpoint(self, step, *names, frames=None):
+        """Writes the named state to the session, if one is active. Failures only warn."""
+        if self.session is None:
+            return
+        try:
+            self.session.save(self, names, step=step, frames=frames)
+        except Exception as e:
+            print(f"⚠️ Could not checkpoint {step}: {e}")
+
+    def resume(self, session_dir=None, lazy=True):
+        """
+        Restores the state saved in a session directory (default: the active one) and
+        keeps checkpointing there. With lazy, each piece is read from disk the first time
+        it is used. Returns the names of the restored state.
+        """
+        session = Session(session_dir) if session_dir else self.session
+        if session is None:
+            raise ValueError("No session directory given.")
+        if not session.saved():
+            raise FileNotFoundError(f"No saved session in '{session.session_dir}'")
+        self.session = session
+        loaders = session.loaders()
+        if 'red' in loaders:
+            self.inst = session.metadata['saved']['red']['inst']
+        for name in loaders:
+            self.__dict__.pop(name, None) # so __getattr__ picks them up
+        self._lazy = loaders
+        if not lazy:
+            for name in list(loaders):
+                getattr(self, name)
+        return list(loaders)
+
+    def output_folder(self, folder=None):
+        """
+        Name the extraction folders ({folder}_2d_extractions, {folder}_1d_extractions)
+        start with: `folder`, or else the mask (OBJNAME of the reduced frame), or else
+        the name of the data folder.
+        """
+        if folder:
+            return folder
+        def frames():
+            yield getattr(self, 'reduced_frame', None)
+            yield from (getattr(self, 'reduced_frames', None) or {}).values()
+        for frame in frames():
+            obj = frame.header.get('OBJNAME') if frame is not None else None
+            if obj and str(obj).strip():
+                folder = str(obj).strip().replace(' ', '_')
+                break
+        else:
+            if not getattr(self, 'red', None):
+                raise ValueError("No output folder given and no reduced frame or data folder to name it after.")
+            folder = os.path.basename(os.path.normpath(self.red.dir))
+        print(f"ℹ️ No output folder given; writing to {folder}_*_extractions.")
+        return folder
+
+    def _require(self, *names):
+        """Raises a RuntimeError naming the first missing piece of state."""
+        for name in names:
+            value = getattr(self, name)
+            if value is None or (name == 'red' and not value):
+                raise RuntimeError(f"'{name}' is not available. Run the previous steps first.")
+
+    # --- Data input & calibrations ---
+    def read_folder(self, indir):
+        """Creates the imred.Reducer for a data folder."""
+        if not os.path.isdir(indir):
+            raise FileNotFoundError(f"Folder not found at '{indir}'")
+        self.red = imred.Reducer(self.inst, dir=indir)
+        self.catalog = None
+        self.checkpoint('read_folder', 'red')
+        return self.red
+
+    def header_catalog(self, update=False):
+        """
+        HeaderCatalog of the current data folder (persistent unless use_cache=False).
+        It is brought up to date on first use; update=True rescans the folder now.
+        """
+        self._require('red')
+        folder = os.path.abspath(self.red.dir)
+        if self.catalog is None or self.catalog.folder != folder:
+            self.catalog = HeaderCatalog(folder, cache_dir=self.catalog_dir)
+        if update:
+            self.catalog.update()
+        return self.catalog
+
+    def folder_log(self):
+        """Chronological log of the data folder (like Reducer.log()), from the header catalog."""
+        return self.header_catalog().log(cols=self.red.cols)
+
+    def classify_frames(self, keywords=None):
+        """Type (bias/dark/flat/arc/science) of every frame of the folder, see classify.classify_frames."""
+        keys = {**classify.FRAME_KEYWORDS, **(keywords or {})}
+        return classify.classify_frames(self.header_catalog().table(list(keys.values())), keywords=keywords)
+
+    def propose_plans(self, kms_files=None, keywords=None):
+        """
+        Reduction plans for every mask of the folder, from the header keywords (see
+        classify.propose_plans). Each plan runs with replay.run_plan or a StepGraph.
+        """
+        self._require('red')
+        return classify.propose_plans(self.classify_frames(keywords), self.red.dir, kms_files=kms_files)
+
+    def _master_key(self, name):
+        """Content key of a master in use (None if not set), for the keys of the masters built on it."""
+        master = getattr(self, name)
+        if master is None:
+            return None
+        known = self._calib_keys.get(name)
+        if known is not None and known[0] is master and known[1] is not None:
+            return known[1]
+        return data_digest(master) # set from outside the pipeline
+
+    def _cached_master(self, name, kind, frames, compute, display=None, **params):
+        """
+        Runs `compute` through the calibration cache, keyed on the frames and `params`,
+        and stores the master as attribute `name`. Individual-frame display always recomputes.
+        """
+        if self.calib_cache is None:
+            master, key = compute(), None
+        else:
+            key = self.calib_cache.key(kind, self.red, frames, **params)
+            master, _ = self.calib_cache.get_or_compute(kind, key, compute, lookup=display is None)
+        return self._set_master(name, kind, master, key)
+
+    def _set_master(self, name, kind, master, key):
+        setattr(self, name, master)
+        self._calib_keys[name] = (master, key)
+        self.checkpoint(f'compute_{kind}', name)
+        return master
+
+    def compute_bias(self, frames, type='median', sigreject=5.0, trim=False, display=None):
+        """Master bias from a list of frame numbers/names."""
+        self._require('red')
+        if not frames:
+            raise ValueError("Bias frames input is empty.")
+        return self._cached_master('bias_frame', 'bias', frames,
+                                   lambda: self.red.mkbias(frames, display=display, type=type,
+                                                           sigreject=sigreject, trim=trim),
+                                   display=display, type=type, sigreject=sigreject, trim=trim)
+
+    def compute_dark(self, frames, type='median', sigreject=5.0, clip=None, apply_bias=True,
+                     trim=False, display=None):
+        """Master dark, bias-subtracted with the current master bias if apply_bias."""
+        self._require('red')
+        if not frames:
+            raise ValueError("Dark frames input is empty.")
+        bias = self.bias_frame if apply_bias else None
+        return self._cached_master('dark_frame', 'dark', frames,
+                                   lambda: self.red.mkdark(frames, bias=bias, display=display, type=type,
+                                                           sigreject=sigreject, clip=clip, trim=trim),
+                                   display=display, type=type, sigreject=sigreject, clip=clip, trim=trim,
+                                   bias=self._master_key('bias_frame') if apply_bias else None)
+
+    def compute_flat(self, frames, type='median', sigreject=5.0, spec=True, width=101, normalize=True,
+                     snmin=50.0, apply_bias=True, apply_dark=True, littrow=False, trim=False, display=None):
+        """Master (spectral) flat using the current master bias/dark as requested."""
+        self._require('red')
+        if not frames:
+            raise ValueError("Flat frames input is empty.")
+        bias = self.bias_frame if apply_bias else None
+        dark = self.dark_frame if apply_dark else None
+        return self._cached_master('flat_frame', 'flat', frames,
+                                   lambda: self.red.mkflat(frames, bias=bias, dark=dark, display=display,
+                                                           type=type, sigreject=sigreject, spec=spec,
+                                                           width=width, normalize=normalize, snmin=snmin,
+                                                           trim=trim, littrow=littrow),
+                                   display=display, type=type, sigreject=sigreject, spec=spec, width=width,
+                                   normalize=normalize, snmin=snmin, trim=trim, littrow=littrow,
+                                   bias=self._master_key('bias_frame') if apply_bias else None,
+                                   dark=self._master_key('dark_frame') if apply_dark else None)
+
+    def compute_arcs(self, frames):
+        """Sum of the arc frames."""
+        self._require('red')
+        if not frames:
+            raise ValueError("Arc frames input is empty.")
+        return self._cached_master('arcs_frame', 'arcs', frames,
+                                   lambda: self.red.sum(frames)) # sum doesn't take display
+
+    def _calibration_request(self, kind, spec):
+        """
+        (frames, build keywords, cache-key keywords, dependencies) of one build_calibrations
+        entry; keywords and defaults are those of the matching compute_* method.
+        """
+        if kind == 'arcs':
+            return parse_frames(spec), {}, {}, []
+        if kind == 'slit_flat':
+            return parse_frames(spec)[:1], {}, None, []
+        spec = dict(spec)
+        frames = parse_frames(spec.pop('frames'))
+        bound = inspect.signature(getattr(self, f'compute_{kind}')).bind(frames, **spec)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        for name in ('frames', 'display'):
+            params.pop(name)
+        deps = [dep for dep in CALIBRATION_DEPENDS[kind] if params.pop(f'apply_{dep}', False)]
+        key_params = dict(params, **{dep: None for dep in CALIBRATION_DEPENDS[kind]}) # as keyed by compute_*
+        return frames, params, key_params, deps
+
+    def build_calibrations(self, bias=None, dark=None, flat=None, arcs=None, slit_flat=None, workers=None,
+                           progress=None, cancel=None):
+        """
+        Builds the requested masters at once, each as soon as the masters it needs exist.
+
+        bias, dark and flat are dicts of the compute_bias/compute_dark/compute_flat keywords
+        (with 'frames'); arcs is the arc frame list and slit_flat the flat frame that
+        find_slits will use. Bias, arcs and the slit flat start together, the dark after
+        the bias, the flat after bias and dark (when applied). With workers > 1 they run
+        in a process pool; cached masters are loaded instead. Each one is reported and
+        stored on the pipeline as it finishes (and reported to `progress`); once `cancel`
+        is set no new build starts and progress.Cancelled is raised. Returns
+        {calibration: seconds taken}.
+        """
+        self._require('red')
+        requested = {kind: spec for kind, spec in
+                     dict(bias=bias, dark=dark, flat=flat, arcs=arcs, slit_flat=slit_flat).items() if spec is not None}
+        if not requested:
+            raise ValueError("No calibrations requested.")
+        requests = {kind: self._calibration_request(kind, spec) for kind, spec in requested.items()}
+        for kind, (frames, _, _, _) in requests.items():
+            if not frames:
+                raise ValueError(f"{kind} frames input is empty.")
+
+        timings = {}
+        start = {}
+        pending = dict(requests)
+
+        def ready():
+            # a dependency not built here is taken as it currently is on the pipeline
+            return [kind for kind, (_, _, _, deps) in pending.items()
+                    if not any(dep in pending or dep in start for dep in deps)]
+
+        def finish(kind, result, key, cached=False):
+            timings[kind] = time.time() - start.pop(kind)
+            if kind == 'slit_flat':
+                self.slit_flats[requests[kind][0][0]] = result
+            else:
+                if self.calib_cache is not None and key is not None and not cached:
+                    self.calib_cache.save(kind, key, result)
+                self._set_master(CALIBRATION_ATTRS[kind], kind, result, key)
+            print(f"✅ {kind} ready in {timings[kind]:.1f} s{' (cached)' if cached else ''}.")
+            report(progress, len(timings), len(requests), 'calibrations')
+
+        def launch(kind, submit):
+            check_cancelled(cancel)
+            frames, params, key_params, deps = pending.pop(kind)
+            start[kind] = time.time()
+            key = None
+            if self.calib_cache is not None and key_params is not None:
+                for dep in deps:
+                    key_params[dep] = self._master_key(CALIBRATION_ATTRS[dep])
+                key = self.calib_cache.key(kind, self.red, frames, **key_params)
+                master = self.calib_cache.load(kind, key) if key is not None else None
+                if master is not None:
+                    finish(kind, master, key, cached=True)
+                    return None
+            print(f"🚀 Building {kind} from frames {frames} ...")
+            args = dict(bias=self.bias_frame if 'bias' in deps else None,
+                        dark=self.dark_frame if 'dark' in deps else None)
+            return submit(kind, frames, params, key, args)
+
+        if workers is not None and workers > 1 and len(requests) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_calibration_worker,
+                                     initargs=(self.red,)) as pool:
+                running = {}
+                def submit(kind, frames, params, key, args):
+                    running[pool.submit(_build_calibration, kind, frames, params, **args)] = (kind, key)
+                while pending or running:
+                    for kind in ready():
+                        launch(kind, submit)
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        kind, key = running.pop(future)
+                        finish(kind, future.result(), key)
+                    if cancel is not None and cancel.is_set():
+                        pool.shutdown(wait=True, cancel_futures=True)
+                        raise Cancelled()
+        else:
+            def submit(kind, frames, params, key, args):
+                finish(kind, _build_calibration(kind, frames, params, red=self.red, **args), key)
+            while pending:
+                for kind in ready():
+                    launch(kind, submit)
+        return timings
+
+    # --- Slits & targets ---
+    def find_slits(self, flat_frame, kms_file, smooth=3.0, thresh=0.5, degree=2, skip=50, sn=True,
+                   cent=None):
+        """
+        Finds the slit edges on a single reduced flat and reads the targets from the KMS file.
+        Returns (bottom, top) edge lists as given by Trace.findslits.
+        """
+        self._require('red')
+        if not os.path.isfile(kms_file):
+            raise FileNotFoundError(f"KMS file not found: {kms_file}")
+        # Reduce the single flat frame specified for slit finding (unless build_calibrations did)
+        flat_image_data = self.slit_flats.get(flat_frame)
+        if flat_image_data is None:
+            flat_image_data = self.red.reduce(flat_frame, display=None)
+        if flat_image_data is None:
+            raise RuntimeError(f"Failed to reduce flat frame {flat_frame}.")
+
+        self.trace = spectra.Trace(transpose=True) # KOSMOS specific
+        bottom, top = self.trace.findslits(flat_image_data, display=self.display, smooth=smooth,
+                                           thresh=thresh, degree=degree, skip=skip, sn=sn, cent=cent)
+        self.targets = slitmask.read_kms(kms_file, sort='YMM') # YMM sort is KOSMOS typical
+
+        # Store the original full list for potential reset
+        self.full_trace = copy.deepcopy(self.trace)
+        self.full_targets = self.targets.copy()
+        self.checkpoint('find_slits', 'trace', 'targets', 'full_trace', 'full_targets')
+        return bottom, top
+
+    def filter_slits(self, method, values):
+        """
+        Keeps only the slits selected by 'Index', 'ID' or 'Name'.
+
+        `values` is a list or a comma-separated string. Filtering always starts
+        from the full find_slits result. Returns the selected targets, or None
+        (leaving the selection unchanged) if nothing matched.
+        """
+        self._require('full_targets', 'full_trace')
+        if isinstance(values, str):
+            values = [val.strip().strip("'\"") for val in values.split(',') if val.strip()]
+        if not values:
+            raise ValueError("Filter values are empty.")
+
+        data = self.full_targets.to_pandas() # Filter from the original full list
+        selected_indices = [] # Store indices relative to self.full_targets
+        if method == 'Index':
+            for idx_str in values:
+                if str(idx_str).isdigit():
+                    idx = int(idx_str)
+                    if 0 <= idx < len(self.full_targets):
+                        selected_indices.append(idx)
+                    else:
+                        print(f"⚠️ Index {idx} out of range (0-{len(self.full_targets)-1}).")
+                else:
+                    print(f"⚠️ Invalid index '{idx_str}'.")
+        elif method in ('ID', 'Name'):
+            column = method.upper()
+            if column in data.columns:
+                mask = data[column].astype(str).str.strip().isin([str(v) for v in values])
+                selected_indices = data.index[mask].tolist()
+            else:
+                print(f"⚠️ '{column}' column not found in targets table.")
+        else:
+            raise ValueError(f"Unknown filter method '{method}'. Use 'Index', 'ID' or 'Name'.")
+
+        if not selected_indices:
+            return None
+
+        # Filter the trace object based on selected_indices from full_trace
+        gdtrace = copy.deepcopy(self.full_trace)
+        gdtrace.model = [self.full_trace.model[i] for i in selected_indices if i < len(self.full_trace.model)]
+        gdtrace.rows = [self.full_trace.rows[i] for i in selected_indices if i < len(self.full_trace.rows)]
+        self.trace = gdtrace
+        self.targets = self.full_targets[selected_indices]
+        self.checkpoint('filter_slits', 'trace', 'targets')
+        return self.targets
+
+    def reset_filter(self):
+        """Restores the full trace and target list from find_slits."""
+        self._require('full_targets', 'full_trace')
+        self.trace = copy.deepcopy(self.full_trace)
+        self.targets = self.full_targets.copy()
+        self.checkpoint('reset_filter', 'trace', 'targets')
+        return self.targets
+
+    def update_arc_headers(self):
+        """Cuts the arc frame into slitlets and copies XMM/YMM of each target into their headers."""
+        self._require('trace', 'arcs_frame', 'targets')
+        self.arcec = self.trace.extract2d(self.arcs_frame, display=self.display)
+        for arc, target in zip(self.arcec, self.targets):
+            arc.header['XMM'] = target['XMM']
+            arc.header['YMM'] = target['YMM']
+        self.checkpoint('update_arc_headers', 'arcec')
+        return self.arcec
+
+    # --- Science & extraction ---
+    def reduce_science(self, frame, crbox='lacosmic', crsig=5.0, objlim=5.0, apply_bias=True,
+                       apply_dark=True, apply_flat=False, channel=None, scat=None, badpix=None,
+                       trim=True, utr=False, ext=0, solve=False, seeing=2.0, sigfrac=0.3, display=None):
+        """Bias/dark/flat-corrects and cosmic-ray cleans one science frame."""
+        self._require('red')
+        self.reduced_frame = self.red.reduce(num=frame,
+                                             bias=self.bias_frame if apply_bias else None,
+                                             dark=self.dark_frame if apply_dark else None,
+                                             flat=self.flat_frame if apply_flat else None,
+                                             display=display, crbox=crbox, crsig=crsig, objlim=objlim,
+                                             channel=channel, scat=scat, badpix=badpix, trim=trim,
+                                             utr=utr, ext=ext, solve=solve, seeing=seeing, sigfrac=sigfrac)
+        self.reduced_frames[frame] = self.reduced_frame
+        self.checkpoint('reduce_science', 'reduced_frame', 'reduced_frames', frames=[frame])
+        return self.reduced_frame
+
+    def reduce_sciences(self, frames, workers=None, write_dir=None, apply_bias=True, apply_dark=True,
+                        apply_flat=False, progress=None, cancel=None, **params):
+        """
+        Reduces several science frames with the same master bias/dark/flat.
+
+        `frames` is a list, range or widget-style string ('7,8,9', '7-9'). With
+        workers > 1 the frames are reduced concurrently in a process pool.
+        With write_dir, each result is also written there as <FILE>_reduced.fits.
+        Other keywords are those of reduce_science. Returns a dict keyed by frame
+        (also stored as reduced_frames); reduced_frame is set to the first frame.
+        `progress`/`cancel` report each reduced frame and stop before the next one (see progress.py);
+        frames finished before a cancel are kept.
+        """
+        self._require('red')
+        frames = parse_frames(frames)
+        if not frames:
+            raise ValueError("Science frames input is empty.")
+        params.pop('display', None)
+        bias = self.bias_frame if apply_bias else None
+        dark = self.dark_frame if apply_dark else None
+        flat = self.flat_frame if apply_flat else None
+
+        results = {}
+        try:
+            if workers is not None and workers > 1 and len(frames) > 1:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_reduce_worker,
+                                         initargs=(self.red, bias, dark, flat)) as pool:
+                    futures = {pool.submit(_reduce_frame, frame, params): frame for frame in frames}
+                    for future in as_completed(futures):
+                        results[futures[future]] = future.result()
+                        report(progress, len(results), len(frames), 'frames')
+                        if cancel is not None and cancel.is_set():
+                            pool.shutdown(wait=True, cancel_futures=True)
+                            raise Cancelled()
+            else:
+                for frame in frames:
+                    check_cancelled(cancel)
+                    results[frame] = self.red.reduce(num=frame, bias=bias, dark=dark, flat=flat, display=None,
+                                                     **params)
+                    report(progress, len(results), len(frames), 'frames')
+        except Cancelled:
+            self.reduced_frames.update(results)
+            self.checkpoint('reduce_sciences', 'reduced_frames', frames=list(results))
+            raise
+        results = {frame: results[frame] for frame in frames} # frame order
+
+        if write_dir is not None:
+            os.makedirs(write_dir, exist_ok=True)
+            for frame, reduced in results.items():
+                name = os.path.splitext(os.path.basename(str(reduced.header.get('FILE', frame))))[0]
+                reduced.write(os.path.join(write_dir, f'{name}_reduced.fits'), overwrite=True)
+
+        self.reduced_frames.update(results)
+        self.reduced_frame = results[frames[0]]
+        self.checkpoint('reduce_sciences', 'reduced_frame', 'reduced_frames', frames=list(results))
+        return results
+
+    def select_reduced(self, frame):
+        """Makes one of the reduced_frames the frame that the extraction steps work on."""
+        if frame not in self.reduced_frames:
+            raise KeyError(f"Frame {frame} has not been reduced.")
+        self.reduced_frame = self.reduced_frames[frame]
+        self.checkpoint('select_reduced', 'reduced_frame')
+        return self.reduced_frame
+
+    def calibrate_wavelength(self, clobber=False, lamp_spec_file='KOSMOS/KOSMOS_red_waves.fits',
+                             fit_degree=3, shift_multiplier=-22.5, wave_fit_degree_after_identify=5,
+                             identify_thresh=10.0, plot=False, plotinter=False, workers=None, **params):
+        """
+        Fits and writes a CofIwav_* solution for every current target.
+
+        Plots and interactive line rejection are off by default; any other
+        CofiProcessor.calibrate_wavelength keyword can be passed through. With
+        workers > 1 the slits are fitted in a process pool. Slits whose arc and
+        parameters match a cached fit are not refitted (see cache.WavecalCache).
+        `progress`/`cancel` keywords report each slit and stop between slits.
+        Returns the per-target results of CofiProcessor.calibrate_wavelength.
+        """
+        self._require('arcec', 'targets')
+        return self.processor.calibrate_wavelength(self.arcec, self.targets, clobber, lamp_spec_file, fit_degree,
+                                            shift_multiplier, wave_fit_degree_after_identify,
+                                            identify_thresh, plot=plot, plotinter=plotinter, workers=workers,
+                                            cache=self.wave_cache, **params)
+
+    def extract2d(self, folder=None, adjust_wavelength=False, apply_flat=True, skyline_radii=None, workers=None,
+                  **params):
+        """
+        Cuts the reduced frame into slitlets and wavelength-corrects them.
+
+        With adjust_wavelength the skyline solution at `skyline_obj_rad` is accepted
+        without prompting, or, if `skyline_radii` is given (e.g. range(2, 16)), the
+        radius with the lowest skyline rms is picked per slit. workers > 1 processes
+        the slits in a process pool. Other keywords are those of CofiProcessor.multi_extract2d.
+        `folder` names the output folder (see output_folder for the default).
+        Returns (and stores as spec2d_out) the corrected slitlets.
+        """
+        self._require('red', 'reduced_frame', 'trace', 'targets')
+        self.spec2d_out = self.processor.extract2d_slitlets(
+            self.red, self.trace, self.targets, self.reduced_frame,
+            self.flat_frame if apply_flat else None, folder=self.output_folder(folder),
+            adjust_wavelength=adjust_wavelength, skyline_radii=skyline_radii, workers=workers, **params)
+        self.checkpoint('extract2d', 'spec2d_out')
+        return self.spec2d_out
+
+    def mask_geometry(self):
+        """MaskGeometry (trace, targets, wavelength solutions) of the current mask, see geometry.py."""
+        return MaskGeometry.from_pipeline(self)
+
+    def apply_geometry(self, geometry=None, frames=None, folder=None, adjust_wavelength=False, apply_flat=True,
+                       skyline_radii=None, workers=None, **params):
+        """
+        2D-extracts several reduced frames with one MaskGeometry in a single call.
+
+        `geometry` defaults to mask_geometry() and `frames` to all reduced_frames.
+        Returns (and stores and checkpoints as spec2d_by_frame) a dict frame ->
+        corrected slitlets; keywords are those of extract2d.
+        """
+        self._require('red')
+        geometry = geometry or self.mask_geometry()
+        frames = self.reduced_frames if frames is None else frames
+        if not frames:
+            raise ValueError("No reduced frames to extract. Run reduce_sciences first.")
+        results = geometry.apply(frames, self.red, flat_frame=self.flat_frame if apply_flat else None,
+                                 folder=self.output_folder(folder), adjust_wavelength=adjust_wavelength,
+                                 skyline_radii=skyline_radii, workers=workers, processor=self.processor, **params)
+        self.spec2d_by_frame.update(results)
+        self.checkpoint('apply_geometry', 'spec2d_by_frame', frames=list(results))
+        return results
+
+    def extract1d(self, folder=None, rad=5, back=10, back_offset=2, sky=False, per_target=None, workers=None,
+                  **params):
+        """
+        Extracts a 1D spectrum from every 2D slitlet in spec2d_out.
+
+        `per_target` maps a target ID to rad/back/back_offset/sky overrides and
+        workers > 1 extracts the targets in a process pool. Other keywords are those of CofiProcessor.multi_extract1d.
+        Returns (and stores as spec1d_out) the extracted spectra.
+        """
+        self._require('spec2d_out', 'targets')
+        if len(self.spec2d_out) != len(self.targets):
+            print(f"⚠️ Warning: Mismatch between number of 2D spectra ({len(self.spec2d_out)}) and targets ({len(self.targets)}). Results may be inconsistent.")
+        self.spec1d_out = self.processor.extract1d_spectra(self.spec2d_out, self.targets,
+                                                           folder=self.output_folder(folder),
+                                                           rad=rad, back=back, back_offset=back_offset,
+                                                           sky=sky, logger=self.logger,
+                                                           per_target=per_target, workers=workers, **params)
+        self.checkpoint('extract1d', 'spec1d_out')
+        return self.spec1d_out
+
+    def extract1d_best_radius(self, folder=None, radii=None, back=10, back_offset=2, sky=False, workers=None,
+                              **params):
+        """
+        Extracts every slitlet in spec2d_out at each radius of `radii` (3-15 by default)
+        and keeps the best-S/N one. Returns (spectra, summary DataFrame); the summary is
+        also stored as radius_summary.
+        """
+        self._require('spec2d_out', 'targets')
+        if radii is None:
+            radii = EXTRACTION_RADII
+        self.spec1d_out, self.radius_summary = self.processor.extract1d_best_radius(
+            self.spec2d_out, self.targets, folder=self.output_folder(folder), radii=radii, back=back, back_offset=back_offset,
+            sky=sky, logger=self.logger, workers=workers, **params)
+        self.checkpoint('extract1d_best_radius', 'spec1d_out', 'radius_summary')
+        return self.spec1d_out, self.radius_summary
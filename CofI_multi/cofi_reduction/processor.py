@@ -4,12 +4,438 @@ import os
 import copy
 import numpy as np
 import matplotlib.pyplot as plt
-import ipywidgets as widgets
-from IPython.display import display, clear_output
 import pandas as pd
 from astropy.io import fits
 from pyvista import imred, stars, slitmask, image, spectra
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .progress import Cancelled, check_cancelled, report
+
+# Labels used both by the interactive dropdowns and the FITS header notes
+ADJUST_LABELS = {True: '2D wavelength adjustment', False: 'No 2D wavelength adjustment'}
+SKY_LABELS = {True: 'Sky adjustment', False: 'No sky adjustment'}
+EXTRACTION_RADII = [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+
+
+def wavcal_path(objname, targ_id):
+    """Path of the per-slit wavelength solution written by calibrate_wavelength."""
+    # The leading './' matters: WaveCal otherwise looks inside the pyvista data directory
+    return os.path.join('.', 'CofIwav_{:s}_{:s}.fits'.format(objname, targ_id))
+
+
+def _slit_wavcal_file(o, targ):
+    """Wavelength solution of a slit: the target's WAVCAL entry if it has one (see MaskGeometry), else wavcal_path."""
+    names = targ.colnames if hasattr(targ, 'colnames') else targ.keys()
+    if 'WAVCAL' in names:
+        return str(targ['WAVCAL'])
+    return wavcal_path(o.header["OBJNAME"], targ["ID"])
+
+
+def _extract2d_settings(trace_file=None, trace_inst=None, trace_type='Polynomial1D', trace_degree=2,
+                        trace_sigdegree=0, trace_pix0=0, trace_rad=5, trace_model=None, trace_sc0=None,
+                        trace_rows=None, trace_transpose=False, trace_lags=None, trace_channel=None, trace_hdu=1,
+                        trace_spectrum=None,
+                        extract2d_rows=None, extract2d_buffer=0,
+                        findpeak_sc0=None, findpeak_width=100, findpeak_thresh=50, findpeak_sort=False,
+                        findpeak_back_percentile=10, findpeak_method='linear', findpeak_smooth=5,
+                        findpeak_diff=10000, findpeak_bundle=10000, findpeak_verbose=False, findpeak_plot=False,
+                        skyline_thresh=50, skyline_inter=True, skyline_linear=False,
+                        skyline_file='skyline.dat', skyline_rows=None, skyline_obj_rad=5, correcting_value=2):
+    """Groups the flat 2D-extraction keyword arguments by the pyvista call they feed."""
+    return {
+        'trace': dict(file=trace_file, transpose=trace_transpose, lags=trace_lags, sc0=trace_sc0,
+                      degree=trace_degree, sigdegree=trace_sigdegree, inst=trace_inst, type=trace_type,
+                      pix0=trace_pix0, rad=trace_rad, model=trace_model, rows=trace_rows,
+                      channel=trace_channel, hdu=trace_hdu, spectrum=trace_spectrum),
+        'extract2d': dict(rows=extract2d_rows, buffer=extract2d_buffer),
+        'findpeak': dict(thresh=findpeak_thresh, width=findpeak_width, sc0=findpeak_sc0, plot=findpeak_plot,
+                         sort=findpeak_sort, back_percentile=findpeak_back_percentile, smooth=findpeak_smooth,
+                         method=findpeak_method, verbose=findpeak_verbose, diff=findpeak_diff,
+                         bundle=findpeak_bundle),
+        'skyline': dict(thresh=skyline_thresh, linear=skyline_linear, file=skyline_file, inter=skyline_inter),
+        'skyline_rows': skyline_rows,
+        'skyline_obj_rad': skyline_obj_rad,
+        'correcting_value': correcting_value,
+    }
+
+
+def _extract1d_settings(trace_class_file=None, trace_class_inst=None, trace_class_type='Polynomial1D',
+                        trace_class_degree=2, trace_class_sigdegree=0, trace_class_pix0=0,
+                        trace_class_rad=5, trace_class_model=None, trace_class_sc0=None,
+                        trace_class_rows=None, trace_class_transpose=False, trace_class_lags=None,
+                        trace_class_channel=None, trace_class_hdu=1, trace_class_spectrum=None,
+                        findpeak_sc0=None, findpeak_width=None, findpeak_thresh=50, findpeak_sort=False,
+                        findpeak_back_percentile=10, findpeak_method='linear', findpeak_smooth=5,
+                        findpeak_diff=10000, findpeak_bundle=10000, findpeak_verbose=False, findpeak_plot=False,
+                        trace_method_sc0=None, trace_method_rad=None, trace_method_thresh=20,
+                        trace_method_index=None, trace_method_skip=10, trace_method_gaussian=False,
+                        trace_method_verbose=False, trace_method_srows=None,
+                        extract_fit=False, extract_old=False,
+                        extract_nout=None, extract_threads=0, extract_medfilt=None,
+                        skyline_thresh=50, skyline_inter=True, skyline_linear=False,
+                        skyline_file='skyline.dat', skyline_rows=None, skyline_plot=True):
+    """Groups the flat 1D-extraction keyword arguments by the pyvista call they feed."""
+    return {
+        # degree=sigdegree is how the interactive extraction has always built this trace
+        'trace': dict(file=trace_class_file, inst=trace_class_inst, type=trace_class_type,
+                      degree=trace_class_sigdegree, sigdegree=trace_class_sigdegree, pix0=trace_class_pix0,
+                      rad=trace_class_rad, sc0=trace_class_sc0, transpose=trace_class_transpose,
+                      lags=trace_class_lags, model=trace_class_model, spectrum=trace_class_spectrum),
+        'findpeak': dict(sc0=findpeak_sc0, width=findpeak_width, thresh=findpeak_thresh, sort=findpeak_sort,
+                         back_percentile=findpeak_back_percentile, method=findpeak_method,
+                         smooth=findpeak_smooth, diff=findpeak_diff, bundle=findpeak_bundle,
+                         verbose=findpeak_verbose, plot=findpeak_plot),
+        'srows': trace_method_srows,
+        'trace_method': dict(skip=trace_method_skip, gaussian=trace_method_gaussian, sc0=trace_method_sc0,
+                             rad=trace_method_rad, thresh=trace_method_thresh, verbose=trace_method_verbose),
+        'extract': dict(fit=extract_fit, old=extract_old, nout=extract_nout,
+                        threads=extract_threads, medfilt=extract_medfilt),
+        'skyline': dict(thresh=skyline_thresh, linear=skyline_linear, plot=skyline_plot,
+                        rows=skyline_rows, file=skyline_file),
+    }
+
+
+def _findpeak(trace_obj, o, width=None, **findpeak_kwargs):
+    """Runs Trace.findpeak on a slitlet, searching the whole slit when no width is given."""
+    if width is None:
+        trace_obj.rows = [0, o.data.shape[0]]
+        trace_obj.index = [0]
+        width = o.shape[0] // 2
+    peak, ind = trace_obj.findpeak(o, width=width, **findpeak_kwargs)
+    return peak
+
+
+def _sky_rows(o, peak, rad, skyline_rows=None):
+    """Rows used for the skyline fit: everything farther than rad from the object peak."""
+    if skyline_rows is not None:
+        return skyline_rows
+    return [x for x in range(o.shape[0]) if abs(x - peak[0]) > rad]
+
+
+def _correct_and_write_2d(wav, o, targ, folder, adjust_wavelength, skyrad, correcting_value=2):
+    """Resamples a slitlet onto its central-row wavelengths and writes it to {folder}_2d_extractions."""
+    o_corrected = wav.correct(o, o.wave[o.shape[0] // correcting_value])
+    name = o.header["FILE"].split(".")[0]
+    o_corrected[0].header['ADJUST'] = f'The extraction method used is: {ADJUST_LABELS[adjust_wavelength]}'
+    o_corrected[0].header['SKYRAD'] = f'The radius used in skyline calibration adjustment is: {skyrad}'
+
+    folder_name = f"{folder}_2d_extractions"
+    os.makedirs(folder_name, exist_ok=True) # Safely create directory
+    suffix = '2d' if adjust_wavelength else 'not_adjusted_2d'
+    full_path = os.path.join(folder_name, f'{name}_{targ["ID"]}_{suffix}.fits')
+    o_corrected.write(full_path, overwrite=True)
+    return o_corrected
+
+
+def _fit_quality(wav):
+    """rms (Angstroms) and number of lines kept in the last WaveCal fit."""
+    diff = wav.waves - wav.wave(pixels=[wav.pix, wav.y])
+    gd = np.where(wav.weights > 0)[0]
+    if len(gd) == 0:
+        return np.inf, 0
+    return diff[gd].std(), len(gd)
+
+
+def _best_skyline(o, targ, peak, settings, skyline_radii):
+    """
+    Runs the skyline adjustment once per object radius and keeps the lowest-rms solution.
+
+    Each radius starts from a fresh copy of the arc solution, so candidates do not
+    build on each other. Ties in rms go to the fit with more sky lines. A fit that kept
+    no more than degree + 1 lines has a meaninglessly small rms, so it is only chosen
+    when no radius did better, and then the one with the most lines wins.
+    Returns (wav, radius), or (None, None) if no radius gave a fit.
+    """
+    best = None
+    for rad in skyline_radii:
+        wav = spectra.WaveCal(_slit_wavcal_file(o, targ))
+        wav.add_wave(o)
+        rows = _sky_rows(o, peak, rad, settings['skyline_rows'])
+        try:
+            wav.skyline(o, rows=rows, plot=False, **dict(settings['skyline'], inter=False))
+        except Exception as e:
+            print(f"   ⚠️ Skyline fit failed for target {targ['ID']} with radius {rad}: {e}")
+            continue
+        rms, nlines = _fit_quality(wav)
+        print(f"   radius {rad}: rms = {rms:.4f} A ({nlines} lines)")
+        rank = (0, rms, -nlines) if nlines > wav.degree + 1 else (1, -nlines, rms)
+        if best is None or rank < best[0]:
+            best = (rank, wav, rad)
+    if best is None:
+        return None, None
+    if best[0][0]:
+        print(f"   ⚠️ No skyline fit for target {targ['ID']} kept more than {best[1].degree + 1} lines; "
+              f"using radius {best[2]} with the most lines.")
+    return best[1], best[2]
+
+
+def _extract2d_slitlet(o, targ, settings, folder=None, adjust_wavelength=False, skyline_radii=None):
+    """
+    Non-interactive 2D extraction of one (already flat-fielded) slitlet.
+
+    The skyline solution, if requested, is accepted as is at `skyline_obj_rad`,
+    or, when `skyline_radii` is given, taken from the radius with the lowest
+    skyline-fit rms. Returns the corrected slitlet, the object peak and the
+    zero-point shift (None without adjustment).
+    """
+    wav = spectra.WaveCal(_slit_wavcal_file(o, targ))
+    orig = wav.model.c0_0
+    wav.add_wave(o)
+    trace1 = spectra.Trace(**settings['trace'])
+    peak = _findpeak(trace1, o, **settings['findpeak'])
+
+    if adjust_wavelength and skyline_radii:
+        best_wav, skyrad = _best_skyline(o, targ, peak, settings, skyline_radii)
+        if best_wav is None:
+            raise RuntimeError(f"No skyline solution found for target {targ['ID']}.")
+        print(f"   -> target {targ['ID']}: using skyline radius {skyrad}")
+        wav = best_wav
+        wav.add_wave(o)
+    elif adjust_wavelength:
+        skyrad = settings['skyline_obj_rad']
+        rows = _sky_rows(o, peak, skyrad, settings['skyline_rows'])
+        wav.skyline(o, rows=rows, plot=False, **dict(settings['skyline'], inter=False))
+        wav.add_wave(o)
+    else:
+        skyrad = 'N/A'
+    o_corrected = _correct_and_write_2d(wav, o, targ, folder, adjust_wavelength, skyrad,
+                                        settings['correcting_value'])
+    shift = wav.model.c0_0 - orig if adjust_wavelength else None
+    return o_corrected, peak, shift
+
+
+# Reducer shared with the 2D extraction workers, sent once per process by the pool initializer
+_worker_reducer = None
+
+
+def _init_extract2d_worker(red):
+    global _worker_reducer
+    _worker_reducer = red
+
+
+def _extract2d_job(science_slit, flat_slit, targ, settings, folder, adjust_wavelength, skyline_radii):
+    """Flat-fields and extracts one slitlet in a worker process (see _extract2d_slitlet)."""
+    processed_slit = science_slit if flat_slit is None else _worker_reducer.flat(science_slit, superflat=flat_slit)
+    return _extract2d_slitlet(processed_slit, targ, settings, folder=folder, adjust_wavelength=adjust_wavelength,
+                              skyline_radii=skyline_radii)
+
+
+def _trace_target(spec2d_slice, settings, display=None):
+    """Finds and traces the object in a 2D spectrum. Returns (trace, peak), trace is None if no peak."""
+    trace_obj = spectra.Trace(**settings['trace'])
+    peak = _findpeak(trace_obj, spec2d_slice, **settings['findpeak'])
+    if len(peak) == 0:
+        return None, peak
+    srows = [peak[0]] if settings['srows'] is None else settings['srows']
+    trace_obj.model = [lambda x: x * 0. + peak[0]]
+    trace_obj.trace(spec2d_slice, srows, display=display, **settings['trace_method'])
+    return trace_obj, peak
+
+
+def _back_regions(rad, back, back_offset):
+    """Background windows on either side of an aperture of radius rad."""
+    sky_width = rad - 5
+    return [[-1*back + (-1 * sky_width), -rad-back_offset],
+            [back + sky_width, rad+back_offset]] # [[-10, -rad], [10, rad]]
+
+
+def _extract_spectrum(trace_obj, spec2d_slice, peak, rad, back, back_offset, settings, display=None):
+    """Boxcar/profile extraction of a traced object with the given aperture radius."""
+    spec1d = trace_obj.extract(spec2d_slice, rad=rad, back=_back_regions(rad, back, back_offset),
+                               display=display, **settings['extract'])
+    spec1d.wave = spec2d_slice.wave[peak]
+    return spec1d
+
+
+def _spectrum_snr(spec1d):
+    """Median per-pixel S/N of an extracted spectrum (pixels with a valid uncertainty only)."""
+    data = np.atleast_2d(spec1d.data)[0]
+    err = np.atleast_2d(spec1d.uncertainty.array)[0]
+    gd = np.isfinite(data) & np.isfinite(err) & (err > 0)
+    if not gd.any():
+        return np.nan
+    return float(np.median(data[gd] / err[gd]))
+
+
+def _apply_skyline(spec1d, spec2d_slice, targ, skyline_kwargs):
+    """Adjusts the wavelengths of an extracted spectrum with its own sky lines."""
+    wavcal = spectra.WaveCal(_slit_wavcal_file(spec2d_slice, targ))
+    swav = copy.deepcopy(wavcal)
+    swav.skyline(spec1d, **skyline_kwargs)
+
+
+def _write_spectrum(spec1d, spec2d_slice, targ, i, folder, rad, back, back_offset, do_sky):
+    """Writes an extracted spectrum to {folder}_1d_extractions and returns its path."""
+    prefix = '2d_ad' if not do_sky else '1d_ad'
+    name   = spec2d_slice.header["FILE"].split(".")[0]
+    filename = f"{prefix}_{rad}_{name}_{targ['ID']}_{i}.fits"
+    folder_name = f"{folder}_1d_extractions"
+    os.makedirs(folder_name, exist_ok=True) # Safely create directory
+
+    spec1d[0].header['TARGID'] = (str(targ['ID']), 'slit mask target ID')
+    spec1d[0].header['1D_CAL'] = f'The calibration method used is: {SKY_LABELS[do_sky]}'
+    spec1d[0].header['EXT_RAD'] = f'The radius used for extracting this spectrum is: {rad}'
+    spec1d[0].header['BKG_WIDTH'] = f'The value used to define the sky background window is: {back}'
+    spec1d[0].header['BKG_OFF'] = f'The value used to offset the sky background window from the spectrum radius is: {back_offset}'
+
+    full_path = os.path.join(folder_name, filename)
+    spec1d.write(full_path, overwrite=True)
+    return full_path
+
+
+def _row_dict(targ):
+    """Plain-dict copy of a targets table row, cheap to send to a worker process."""
+    return {name: targ[name] for name in targ.colnames}
+
+
+def _run_target_jobs(func, jobs, workers=None):
+    """
+    Runs func(*job) for every job (job[2] is the target row), in a process pool if
+    workers > 1. Returns (results, errors): results keep the job order, with None for
+    a target that failed, and errors maps the job index to its message. A failed
+    target does not stop the others.
+    """
+    results, errors = [], {}
+
+    def collect(i, job, result):
+        try:
+            results.append(result())
+        except Exception as e:
+            print(f"❌ 1D extraction failed for target {job[2]['ID']}: {e}")
+            results.append(None)
+            errors[i] = str(e)
+
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        for i, job in enumerate(jobs):
+            collect(i, job, lambda: func(*job))
+        return results, errors
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(func, *job) for job in jobs]
+        for i, (job, future) in enumerate(zip(jobs, futures)):
+            collect(i, job, future.result)
+    return results, errors
+
+
+def _report_failed(errors, jobs):
+    if errors:
+        print(f"⚠️ {len(errors)} target(s) failed and were skipped: "
+              f"{', '.join(str(jobs[i][2]['ID']) for i in errors)}")
+
+
+def _log_1d_choice(logger, targ_id, rad, back, back_offset, sky):
+    log_params = {
+        f"{targ_id}_rad": rad,
+        f"{targ_id}_Bkg Region": back,
+        'Sky window offset': back_offset,
+        '1d_calibration_choice': sky,
+    }
+    logger.log_action("Science & Extraction - 1D Extract", "Setup & Run 1D Extraction", log_params)
+
+
+def _extract1d_target(i, spec2d_slice, targ, settings, folder, rad, back, back_offset, sky, display=None):
+    """Traces, extracts and writes one target at a fixed radius. Returns the spectrum, or None if no peak."""
+    print(f"Extracting slit {i}, target = {targ['ID']} ...")
+    trace_obj, peak = _trace_target(spec2d_slice, settings, display=display)
+    if trace_obj is None:
+        print(f"   -> No peak found for slit {i}. Skipping.")
+        return None
+    spec1d = _extract_spectrum(trace_obj, spec2d_slice, peak, rad, back, back_offset, settings, display=display)
+    if sky:
+        _apply_skyline(spec1d, spec2d_slice, targ, dict(settings['skyline'], plot=False))
+        print("   -> Skyline calibration applied.")
+    full_path = _write_spectrum(spec1d, spec2d_slice, targ, i, folder, rad, back, back_offset, sky)
+    print(f"   -> Saved spectrum to {full_path}")
+    return spec1d
+
+
+def _extract1d_best_target(i, spec2d_slice, targ, settings, folder, radii, back, back_offset, sky):
+    """
+    Extracts one target at every radius in radii and writes the best-S/N one.
+    Returns (spectrum or None, summary row).
+    """
+    print(f"Extracting slit {i}, target = {targ['ID']} ...")
+    row = {'slit': i, 'ID': str(targ['ID']), 'best_rad': None, 'best_snr': np.nan}
+    trace_obj, peak = _trace_target(spec2d_slice, settings, display=None)
+    if trace_obj is None:
+        print(f"   -> No peak found for slit {i}. Skipping.")
+        return None, row
+
+    best = None
+    for rad in radii:
+        try:
+            spec1d = _extract_spectrum(trace_obj, spec2d_slice, peak, rad, back, back_offset, settings)
+        except Exception as e:
+            print(f"   ⚠️ Extraction with radius {rad} failed: {e}")
+            row[f'snr_{rad}'] = np.nan
+            continue
+        snr = _spectrum_snr(spec1d)
+        row[f'snr_{rad}'] = snr
+        if np.isfinite(snr) and (best is None or snr > best[0]):
+            best = (snr, rad, spec1d)
+
+    if best is None:
+        print(f"   -> No usable extraction for slit {i}. Skipping.")
+        return None, row
+    snr, rad, spec1d = best
+    row.update(best_rad=rad, best_snr=snr)
+    if sky:
+        _apply_skyline(spec1d, spec2d_slice, targ, dict(settings['skyline'], plot=False))
+    full_path = _write_spectrum(spec1d, spec2d_slice, targ, i, folder, rad, back, back_offset, sky)
+    print(f"   -> radius {rad} (S/N = {snr:.1f}) saved to {full_path}")
+    return spec1d, row
+
+
+def _fit_slit_wavelength(arc, wavname, lamp_spec_file, fit_degree, shift, lags_offset, identify_thresh,
+                         wave_fit_degree_after_identify, sampling_value, weight_thresh, arc_line_position,
+                         identify_kwargs, plot=False, plotinter=False):
+    """
+    Fits the wavelength solution of one extracted arc slitlet and writes it to wavname.
+
+    Module level so it can run in a worker process. Returns a dict with the solution
+    'file', 'rms', 'nlines', the 'weak_waves' flagged below weight_thresh and 'error' (None).
+    """
+    wav = spectra.WaveCal(lamp_spec_file)
+    wav.fit(degree=fit_degree)
+    nrow = arc.shape[0]
+
+    # Initial lags based on calculated shift and configured offset
+    lags_initial = np.arange(shift - lags_offset, shift + lags_offset)
+
+    iter_flag = True
+    while iter_flag:
+        iter_flag = wav.identify(arc[nrow // arc_line_position], plot=plot, plotinter=plotinter,
+                                 lags=lags_initial, thresh=identify_thresh, **identify_kwargs)
+        # Subsequent lags after first identify attempt, as per original logic, using configured offset
+        lags_initial = np.arange(-lags_offset, lags_offset)
+        if plot: # Close plots if they were made
+            plt.close()
+
+    bd = np.where(wav.weights < weight_thresh)[0]
+    print("Identified weak weights at wavelengths:", wav.waves[bd])
+    weak_waves = list(wav.waves[bd])
+    wav.degree = wave_fit_degree_after_identify
+    # For the second identify call, the original code doesn't specify lags.
+    wav.identify(arc, plot=plot, nskip=nrow // sampling_value, thresh=identify_thresh)
+    if plot:
+        plt.close()
+    wav.write(wavname)
+    rms, nlines = _fit_quality(wav)
+    return {'file': wavname, 'rms': rms, 'nlines': nlines, 'weak_waves': weak_waves, 'error': None, 'cached': False}
+
+
+def _failed_fit(targ_id, error):
+    """Result recorded for a slit whose wavelength fit raised `error`."""
+    print(f"❌ {targ_id}: wavelength calibration failed: {error}")
+    return {'file': None, 'rms': np.nan, 'nlines': 0, 'weak_waves': [], 'error': repr(error), 'cached': False}
+
+
+def _existing_solution(wavname, weight_thresh):
+    """Fit result (as _fit_slit_wavelength returns it) of a CofIwav_* file already on disk."""
+    wav = spectra.WaveCal(wavname)
+    rms, nlines = _fit_quality(wav)
+    weak_waves = list(wav.waves[np.where(wav.weights < weight_thresh)[0]])
+    return {'file': wavname, 'rms': rms, 'nlines': nlines, 'weak_waves': weak_waves, 'error': None, 'cached': False}
+
 
 class CofiProcessor:
     def __init__(self, display_1=None):
@@ -69,10 +495,31 @@ class CofiProcessor:
                              # Parameters from identify()
                              sky=False, wav=None, wref=None, inter=False, orders=None, file =None,
                              verbose=False, rad=5, fit=True, maxshift=10000000000.0, disp=None,
-                             display=None, plot=None, plotinter=True, pixplot=False, domain=False, xmin=None, xmax=None,
+                             display=True, plot=None, plotinter=True, pixplot=False, domain=False, xmin=None, xmax=None,
                              lags_offset=50, nskip=None, rows=None, sampling_value=10, correcting_value=2, 
-                            weight_thresh=0.5, arc_line_position=2,):
-        
+                            weight_thresh=0.5, arc_line_position=2, workers=None, cache=None,
+                            progress=None, cancel=None):
+        """
+        Fits and writes a CofIwav_* wavelength solution for every slit that does not have one
+        (or for all of them with clobber).
+
+        With a cache.WavecalCache, a slit is refitted only if its arc data or any fit/identify
+        parameter changed since the cached fit; unchanged slits get the cached solution back
+        (marked 'cached' in the results). Without clobber, an existing CofIwav_* file the cache
+        does not know (an earlier session, a hand-tuned fit) is kept and cached as is.
+        clobber always refits; interactive identify never takes a cached solution.
+
+        `progress(done, total, label)` is called after each slit and, once the `cancel`
+        Event is set, the remaining slits are skipped and progress.Cancelled is raised.
+
+        `display` is the TV showing each corrected arc: True (default) for the processor's
+        display, None for none (required off the notebook thread, e.g. in a BackgroundRunner).
+
+        With workers > 1 the slits are fitted in a process pool; plots and interactive line
+        rejection are then turned off. Each solution is written as soon as its slit finishes.
+        Returns a dict keyed by target ID with the solution 'file', its 'rms' and 'nlines',
+        'weak_waves', whether it was 'cached' and, for slits whose fit failed, the 'error'.
+        """
         try:
             lags_offset_ = lags_offset
         except ValueError:
@@ -86,45 +533,179 @@ class CofiProcessor:
         # clobber parameter: method argument takes precedence, then param_widget, then default False
         use_clobber = clobber
 
-        for i, (arc, targ) in enumerate(zip(arcec, targets)):
-            wavname = 'CofIwav_{:s}_{:s}.fits'.format(arc.header['OBJNAME'],targ['ID'])
-            if use_clobber or not os.path.exists(wavname):
-                wav = spectra.WaveCal(lamp_spec_file)
-                wav.fit(degree=fit_degree)
-                nrow = arc.shape[0]
-                
-                shift = int(arc.header['XMM'] * shift_multiplier_)
-                
-                # Initial lags based on calculated shift and configured offset
-                lags_initial = np.arange(shift - lags_offset_, shift + lags_offset_)
-
-                iter_flag = True
-                while iter_flag:
-                    iter_flag = wav.identify(arc[nrow // arc_line_position], plot=plot, plotinter=plotinter,
-                                             lags=lags_initial, thresh=identify_thresh,
-                                             file=file,sky=sky,inter=inter,pixplot=pixplot,domain=domain,fit=fit,maxshift=maxshift,
-                                             rad=rad,xmin=xmin, xmax=xmax,nskip=nskip,orders=orders,wref=wref,rows=rows,
-                                            )
-                                            # wav=wav
-                                            # )  # Use initial lags here
-                    # Subsequent lags after first identify attempt, as per original logic, using configured offset
-                    lags_initial = np.arange(-lags_offset_, lags_offset_) 
-                    if plot or plot: # Close plots if they were made
-                        plt.close()
-
-                bd = np.where(wav.weights < weight_thresh)[0]
-                print("Identified weak weights at wavelengths:", wav.waves[bd])
-                wav.degree = wave_fit_degree_after_identify
-                # For the second identify call, the original code doesn't specify lags.
-                # Assuming it should use the refined lags_initial or default behavior of the identify method.
-                # Let's use the refined lags_initial:
-                wav.identify(arc, plot=plot, nskip=nrow // sampling_value, thresh=identify_thresh) # lags=lags_initial
-                if plot:
-                    plt.close()
-                wav.write(wavname)
+        identify_kwargs = dict(file=file, sky=sky, inter=inter, pixplot=pixplot, domain=domain, fit=fit,
+                               maxshift=maxshift, rad=rad, xmin=xmin, xmax=xmax, nskip=nskip, orders=orders,
+                               wref=wref, rows=rows)
+        results = {}
+        keys = {}
+        jobs = []
+        for arc, targ in zip(arcec, targets):
+            targ_id = str(targ['ID'])
+            wavname = wavcal_path(arc.header['OBJNAME'], targ['ID'])
+            shift = int(arc.header['XMM'] * shift_multiplier_)
+            job = dict(wavname=wavname, lamp_spec_file=lamp_spec_file, fit_degree=fit_degree, shift=shift,
+                       lags_offset=lags_offset_, identify_thresh=identify_thresh,
+                       wave_fit_degree_after_identify=wave_fit_degree_after_identify,
+                       sampling_value=sampling_value, weight_thresh=weight_thresh,
+                       arc_line_position=arc_line_position, identify_kwargs=identify_kwargs)
+            if cache is not None:
+                # inter only changes how lines are picked, so an interactive fit is reused by later runs
+                params = dict(job, identify_kwargs={k: v for k, v in identify_kwargs.items() if k != 'inter'})
+                del params['wavname']
+                keys[targ_id] = cache.key(arc, **params)
+                cached = None if use_clobber or inter else cache.restore(keys[targ_id], wavname)
+                if cached is not None:
+                    results[targ_id] = dict(cached, cached=True)
+                    spectra.WaveCal(wavname).add_wave(arc)
+                    print(f"ℹ️ {targ_id}: unchanged, using cached solution (rms = {cached['rms']:.4f} A).")
+                    continue
+                if not use_clobber and os.path.exists(wavname):
+                    results[targ_id] = _existing_solution(wavname, weight_thresh)
+                    cache.store(keys[targ_id], results[targ_id])
+                    spectra.WaveCal(wavname).add_wave(arc)
+                    print(f"ℹ️ {targ_id}: keeping existing {wavname} (use clobber to refit).")
+                    continue
+            elif not use_clobber and os.path.exists(wavname):
+                continue
+            jobs.append((targ_id, arc, job))
+
+        total = len(jobs)
+        if workers is not None and workers > 1 and len(jobs) > 1:
+            if plot or plotinter or inter:
+                print("⚠️ Plots and interactive identify are disabled for parallel wavelength calibration.")
+            identify_kwargs['inter'] = False
+            arcs = {targ_id: arc for targ_id, arc, _ in jobs}
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_fit_slit_wavelength, arc, **job): targ_id for targ_id, arc, job in jobs}
+                for done, future in enumerate(as_completed(futures), 1):
+                    targ_id = futures[future]
+                    try:
+                        results[targ_id] = future.result()
+                        if cache is not None:
+                            cache.store(keys[targ_id], results[targ_id])
+                        spectra.WaveCal(results[targ_id]['file']).add_wave(arcs[targ_id])
+                        print(f"✅ {targ_id}: rms = {results[targ_id]['rms']:.4f} A, written to {results[targ_id]['file']}")
+                    except Exception as e:
+                        results[targ_id] = _failed_fit(targ_id, e)
+                    report(progress, done, total, 'slits')
+                    if cancel is not None and cancel.is_set():
+                        pool.shutdown(wait=True, cancel_futures=True)
+                        raise Cancelled()
+            return results
+
+        for done, (targ_id, arc, job) in enumerate(jobs, 1):
+            check_cancelled(cancel)
+            try:
+                results[targ_id] = _fit_slit_wavelength(arc, plot=plot, plotinter=plotinter, **job)
+                if cache is not None:
+                    cache.store(keys[targ_id], results[targ_id])
+                wav = spectra.WaveCal(job['wavname'])
                 wav.add_wave(arc)
-                if self.display is not None:
-                    self.display.tv(wav.correct(arc, arc.wave[nrow // correcting_value]))
+            except Exception as e:
+                results[targ_id] = _failed_fit(targ_id, e)
+                report(progress, done, total, 'slits')
+                continue
+            tv_display = self.display if display is True else display
+            if tv_display is not None:
+                nrow = arc.shape[0]
+                tv_display.tv(wav.correct(arc, arc.wave[nrow // correcting_value]))
+            report(progress, done, total, 'slits')
+        return results
+
+
+    def _cut_slitlets(self, trace, imcr, flat_im, rows=None, buffer=0):
+        """Cuts the science (and optional flat) frame into per-slit 2D images."""
+        # --- FIX: Convert bitmask dtype before calling extract2d ---
+        if hasattr(imcr, 'bitmask') and imcr.bitmask is not None:
+            imcr.bitmask = imcr.bitmask.astype(np.uint32)
+
+        out = trace.extract2d(imcr, rows=rows, display=self.display, buffer=buffer)
+        flat_out = None
+        if flat_im is not None:
+            print("Extracting flat field slits...")
+            if hasattr(flat_im, 'bitmask') and flat_im.bitmask is not None:
+                 flat_im.bitmask = flat_im.bitmask.astype(np.uint32)
+            flat_out = trace.extract2d(flat_im, rows=rows, display=self.display, buffer=buffer)
+        return out, flat_out
+
+    def _flat_field_slit(self, red, science_slit, flat_slit, targ):
+        if flat_slit is None:
+            return science_slit
+        print(f"Applying flat field to slit for target {targ['ID']}...")
+        if self.display:
+            self.display.clear()
+        return red.flat(science_slit, superflat=flat_slit, display=self.display)
+
+    def extract2d_slitlets(self, red, trace, targets, imcr, flat_im, folder=None, adjust_wavelength=False,
+                           skyline_radii=None, workers=None, **params):
+        """
+        Non-interactive counterpart of multi_extract2d.
+
+        Cuts, flat-fields, wavelength-corrects and writes every slit in one call.
+        With adjust_wavelength, the skyline fit at `skyline_obj_rad` is accepted, or,
+        if `skyline_radii` is given, the radius with the lowest skyline rms is used.
+        With workers > 1 the slits are processed in a process pool.
+        `params` are the trace_*, extract2d_*, findpeak_* and skyline_* keywords of multi_extract2d.
+        Returns the list of corrected slitlets, in target order.
+        """
+        return self._extract2d_all(red, trace, targets, imcr, flat_im, _extract2d_settings(**params), folder,
+                                   adjust_wavelength, skyline_radii, workers)
+
+    def _extract2d_all(self, red, trace, targets, imcr, flat_im, settings, folder, adjust_wavelength,
+                       skyline_radii, workers=None):
+        out, flat_out = self._cut_slitlets(trace, imcr, flat_im, **settings['extract2d'])
+        if not flat_out:
+            flat_out = [None]*len(out)
+        if workers is not None and workers > 1 and len(out) > 1:
+            return self._extract2d_parallel(red, out, flat_out, targets, settings, folder, adjust_wavelength,
+                                            skyline_radii, workers)
+
+        diffs = []
+        final_corrected_slits = []
+        for science_slit, flat_slit, targ in zip(out, flat_out, targets):
+            processed_slit = self._flat_field_slit(red, science_slit, flat_slit, targ)
+            o_corrected, _, shift = _extract2d_slitlet(processed_slit, targ, settings, folder=folder,
+                                                       adjust_wavelength=adjust_wavelength,
+                                                       skyline_radii=skyline_radii)
+            if shift is not None:
+                diffs.append(shift)
+            final_corrected_slits.append(o_corrected)
+
+        if adjust_wavelength:
+            print("Wavelength shifts:", diffs)
+        print("\nExtraction complete! spec2d output ready.\n")
+        return final_corrected_slits
+
+    def _extract2d_parallel(self, red, out, flat_out, targets, settings, folder, adjust_wavelength,
+                            skyline_radii, workers):
+        """Fans the per-slit jobs out to a process pool and gathers the corrected slits in target order."""
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract2d_worker,
+                                 initargs=(red,)) as pool:
+            futures = [pool.submit(_extract2d_job, science_slit, flat_slit,
+                                   _row_dict(targ), settings, folder,
+                                   adjust_wavelength, skyline_radii)
+                       for science_slit, flat_slit, targ in zip(out, flat_out, targets)]
+
+            diffs = []
+            final_corrected_slits = []
+            failed = []
+            for future, targ in zip(futures, targets):
+                try:
+                    o_corrected, _, shift = future.result()
+                except Exception as e:
+                    print(f"❌ 2D extraction failed for target {targ['ID']}: {e}")
+                    failed.append(str(targ['ID']))
+                    continue
+                if shift is not None:
+                    diffs.append(shift)
+                final_corrected_slits.append(o_corrected)
+
+        if failed:
+            raise RuntimeError(f"2D extraction failed for targets: {', '.join(failed)}")
+        if adjust_wavelength:
+            print("Wavelength shifts:", diffs)
+        print("\nExtraction complete! spec2d output ready.\n")
+        return final_corrected_slits
 
     def multi_extract2d(self, red, trace, targets, imcr,flat_im,folder=None,
                     # --- Main control parameters ---
@@ -147,7 +728,47 @@ class CofiProcessor:
                     # --- skyline() parameters ---
                     skyline_thresh=50, skyline_inter=True, skyline_linear=False,
                     skyline_file='skyline.dat', skyline_rows=None, skyline_obj_rad=5,correcting_value=2,
-                    logger=None):
+                    logger=None,
+
+                    # --- Unattended mode ---
+                    auto_accept=False, adjust_wavelength=True, skyline_radii=None, workers=None):
+        """
+        Interactive 2D extraction: cuts the reduced frame into slitlets, wavelength-corrects
+        and writes them, asking for each slit whether the skyline adjustment is acceptable.
+
+        With auto_accept=True no controls are shown: every slit is processed in one call
+        (see extract2d_slitlets), with the skyline solution at `skyline_obj_rad` accepted,
+        or the lowest-rms radius out of `skyline_radii`; with workers > 1 the slits run in
+        a process pool. The corrected slitlets are passed to update_callback and returned.
+        """
+        settings = _extract2d_settings(
+            trace_file=trace_file, trace_inst=trace_inst, trace_type=trace_type, trace_degree=trace_degree,
+            trace_sigdegree=trace_sigdegree, trace_pix0=trace_pix0, trace_rad=trace_rad, trace_model=trace_model,
+            trace_sc0=trace_sc0, trace_rows=trace_rows, trace_transpose=trace_transpose, trace_lags=trace_lags,
+            trace_channel=trace_channel, trace_hdu=trace_hdu, trace_spectrum=trace_spectrum,
+            extract2d_rows=extract2d_rows, extract2d_buffer=extract2d_buffer,
+            findpeak_sc0=findpeak_sc0, findpeak_width=findpeak_width, findpeak_thresh=findpeak_thresh,
+            findpeak_sort=findpeak_sort, findpeak_back_percentile=findpeak_back_percentile,
+            findpeak_method=findpeak_method, findpeak_smooth=findpeak_smooth, findpeak_diff=findpeak_diff,
+            findpeak_bundle=findpeak_bundle, findpeak_verbose=findpeak_verbose, findpeak_plot=findpeak_plot,
+            skyline_thresh=skyline_thresh, skyline_inter=skyline_inter, skyline_linear=skyline_linear,
+            skyline_file=skyline_file, skyline_rows=skyline_rows, skyline_obj_rad=skyline_obj_rad,
+            correcting_value=correcting_value)
+
+        if auto_accept:
+            if logger:
+                log_params = {'Adjustment Choice': adjust_wavelength}
+                logger.log_action("Science & Extraction - 2D Extract", " Setup & Run 2D Extrction", log_params)
+            final_corrected_slits = self._extract2d_all(red, trace, targets, imcr, flat_im, settings, folder,
+                                                        adjust_wavelength, skyline_radii, workers)
+            if update_callback is not None:
+                update_callback(final_corrected_slits)
+            return final_corrected_slits
+
+        # GUI modules are only needed by the interactive path, so auto_accept/batch users never import them
+        import ipywidgets as widgets
+        from IPython.display import clear_output
+
         def _draw_selection_lines(display_obj, peak_row, extraction_rad, sky_rows, ncols):
             """
             Draws lines on the display to show the science aperture and all selected sky rows.
@@ -184,7 +805,7 @@ class CofiProcessor:
             return False
 
         val1 = widgets.Dropdown(
-            options=[('2D wavelength adjustment', True), ('No 2D wavelength adjustment', False)],
+            options=[(ADJUST_LABELS[True], True), (ADJUST_LABELS[False], False)],
             value=False,
             description='Adjustment Choice:',
             layout=widgets.Layout(width='auto'),
@@ -198,34 +819,17 @@ class CofiProcessor:
             style={'button_color': '#2980B9'},
         )
 
-        if logger:
-            log_params = {'Adjustment Choice': val1.value}
-            logger.log_action("Science & Extraction - 2D Extract", " Setup & Run 2D Extrction", log_params)
-
         def on_click_run(b):
             with output_2:
                 clear_output(wait=True)
                  
-                # out = trace.extract2d(imcr, rows=extract2d_rows, display=self.display, buffer=extract2d_buffer)
-                
-                # flat_out = None
-                # if flat_im is not None:
-                #     print("Extracting flat field slits...")
-                #     flat_out = trace.extract2d(flat_im, display=self.display)
-                # --- FIX: Convert bitmask dtype before calling extract2d ---
-
-                if hasattr(imcr, 'bitmask') and imcr.bitmask is not None:
-                    imcr.bitmask = imcr.bitmask.astype(np.uint32)
-                
-                out = trace.extract2d(imcr, rows=extract2d_rows, display=self.display, buffer=extract2d_buffer)
-                flat_out = None
-                if flat_im is not None:
-                    print("Extracting flat field slits...")
-                    if hasattr(flat_im, 'bitmask') and flat_im.bitmask is not None:
-                         flat_im.bitmask = flat_im.bitmask.astype(np.uint32)
-                    flat_out = trace.extract2d(flat_im, rows=extract2d_rows, display=self.display, buffer=extract2d_buffer)
+                out, flat_out = self._cut_slitlets(trace, imcr, flat_im, **settings['extract2d'])
                 
                 adjust_wavelength = val1.value if hasattr(val1, 'value') else True
+                # Logged on click so the choice actually used is what a replay picks up
+                if logger:
+                    log_params = {'Adjustment Choice': adjust_wavelength}
+                    logger.log_action("Science & Extraction - 2D Extract", " Setup & Run 2D Extrction", log_params)
                 diffs = []
                 final_corrected_slits = [] # <--- FIX: New list to store corrected slits
 
@@ -240,14 +844,7 @@ class CofiProcessor:
                 def next_target():
                     try:
                         science_slit, flat_slit, targ = next(target_iter)
-                        
-                        if flat_slit is not None:
-                            print(f"Applying flat field to slit for target {targ['ID']}...")
-                            self.display.clear()
-                            processed_slit = red.flat(science_slit, superflat=flat_slit, display=self.display)
-                        else:
-                            processed_slit = science_slit
-                        
+                        processed_slit = self._flat_field_slit(red, science_slit, flat_slit, targ)
                         process_slitlet(processed_slit, targ)
 
                     except StopIteration:
@@ -261,136 +858,74 @@ class CofiProcessor:
                             update_callback(final_corrected_slits)
 
                 def process_slitlet(o, targ):
-                    wav = spectra.WaveCal(f'./CofIwav_{o.header["OBJNAME"]}_{targ["ID"]}.fits')
+                    if not adjust_wavelength:
+                        o_corrected, peak, _ = _extract2d_slitlet(o, targ, settings, folder=folder,
+                                                                  adjust_wavelength=False)
+                        # <--- FIX: Append the corrected slit to our list
+                        final_corrected_slits.append(o_corrected)
+
+                        plt.figure()
+                        plt.plot(o_corrected.wave[peak[0]], o_corrected.data[peak[0]], label='Approximated spec with sky')
+                        plt.title('Visualization of 2D Extraction')
+                        plt.legend(loc='upper right')
+                        next_target()
+                        return
+
+                    wav = spectra.WaveCal(_slit_wavcal_file(o, targ))
                     orig = wav.model.c0_0
                     wav.add_wave(o)
 
-                    if adjust_wavelength:
-                        trace1 = spectra.Trace(file=trace_file, transpose=trace_transpose, lags=trace_lags,
-                                               sc0=trace_sc0, degree=trace_degree, sigdegree=trace_sigdegree,
-                                               inst=trace_inst, type=trace_type, pix0=trace_pix0, rad=trace_rad,
-                                               model=trace_model,rows=trace_rows, channel=trace_channel,
-                                               hdu=trace_hdu, spectrum=trace_spectrum)
-                        if findpeak_width is None:
-                            trace1.rows = [0, o.data.shape[0]]
-                            trace1.index = [0]
-                            center = o.shape[0] // 2
-                        else:
-                            center = findpeak_width
-                        
-                        peak, ind = trace1.findpeak(o, thresh=findpeak_thresh, width=center, sc0=findpeak_sc0, plot=findpeak_plot,
-                                                    sort=findpeak_sort, back_percentile=findpeak_back_percentile, smooth=findpeak_smooth,
-                                                    method=findpeak_method,verbose=findpeak_verbose, diff=findpeak_diff,bundle=findpeak_bundle)
-
-                        def run_skyline_and_prompt(current_rad):
-                            if skyline_rows is None:
-                                nrows = o.shape[0]
-                                rows = [x for x in range(nrows) if abs(x - peak[0]) > current_rad]
-                            else:
-                                rows = skyline_rows
-                            
-                            print(f'Processing rows for target {targ["ID"]} with radius {current_rad}:', rows)
+                    trace1 = spectra.Trace(**settings['trace'])
+                    peak = _findpeak(trace1, o, **settings['findpeak'])
+
+                    def run_skyline_and_prompt(current_rad):
+                        rows = _sky_rows(o, peak, current_rad, skyline_rows)
+                        print(f'Processing rows for target {targ["ID"]} with radius {current_rad}:', rows)
 
+                        wav.skyline(o, thresh=skyline_thresh, rows=rows, plot=plot_enabled(self.display),
+                                    linear=skyline_linear, file=skyline_file, inter=skyline_inter)
 
+                        # 1. Display the 2D image first, then draw the selection lines on top of it.
+                        if self.display:
+                            self.display.clear()
+                            self.display.tv(o)
+                        _draw_selection_lines(self.display, peak[0], current_rad, rows, o.shape[1])
                             
-                            wav.skyline(o, thresh=skyline_thresh, rows=rows, plot=plot_enabled(self.display),
-                                        linear=skyline_linear, file=skyline_file, inter=skyline_inter)
+                        prompt_label = widgets.Label("Are you satisfied with the skyline result?")
+                        yes_button = widgets.Button(description="Yes", button_style='success')
+                        no_button = widgets.Button(description="No", button_style='danger')
+                        radius_dropdown = widgets.Dropdown(options=list(range(2, 16)), value=current_rad, description='New Radius:')
 
-                            # 3. Draw the selection lines on top of the image.
-                            # --- REVISED VISUALIZATION LOGIC ---
-                            # 1. Display the 2D image first.
+                        def on_yes(b_inner):
+                            if param_area_feedback:
+                                param_area_feedback.children = []
+                            
+                            wav.add_wave(o)
                             if self.display:
-                                self.display.clear()
-                                # self.display.imexam()
                                 self.display.tv(o)
-                            _draw_selection_lines(self.display, peak[0], current_rad, rows, o.shape[1])
-                            # if self.display:
-                            #     self.display.tv(o)
-                            #     self.display.imexam()
-                                
-                            prompt_label = widgets.Label("Are you satisfied with the skyline result?")
-                            yes_button = widgets.Button(description="Yes", button_style='success')
-                            no_button = widgets.Button(description="No", button_style='danger')
-                            radius_dropdown = widgets.Dropdown(options=list(range(2, 16)), value=current_rad, description='New Radius:')
-
-                            def on_yes(b_inner):
-                                if param_area_feedback:
-                                    param_area_feedback.children = []
-                                
-                                wav.add_wave(o)
-                                if self.display:
-                                    self.display.tv(o)
-                                o_corrected = wav.correct(o, o.wave[o.shape[0] // correcting_value])
-                                if self.display:
-                                    self.display.tv(o_corrected)
-                                name = o.header["FILE"].split(".")[0]
-                                o_corrected[0].header['ADJUST'] = f'The extraction method used is: {val1.label}'
-                                o_corrected[0].header['SKYRAD'] = f'The radius used in skyline calibration adjustment is: {radius_dropdown.value}'
-                                # hdr['rad'] = f'The radius used in skyline calibration adjustment is: {radius_dropdown.value}'
-        
-                                folder_name = f"{folder}_2d_extractions"
-                                os.makedirs(folder_name, exist_ok=True) # Safely create directory
-                                
-                                full_path = os.path.join(folder_name, f'{name}_{targ["ID"]}_2d.fits')
-                                o_corrected.write(full_path, overwrite=True)
-                                
-                                # o_corrected.write(f'{name}_{targ["ID"]}_2d.fits')
-                                diffs.append(wav.model.c0_0 - orig)
-                                
-                                # <--- FIX: Append the corrected slit to our list
-                                final_corrected_slits.append(o_corrected)
-                                
-                                next_target()
-
-                            def on_no(b_inner):
-                                run_skyline_and_prompt(radius_dropdown.value)
+                            o_corrected = _correct_and_write_2d(wav, o, targ, folder, True, radius_dropdown.value,
+                                                                correcting_value)
+                            if self.display:
+                                self.display.tv(o_corrected)
+                            diffs.append(wav.model.c0_0 - orig)
                             
-                            yes_button.on_click(on_yes)
-                            no_button.on_click(on_no)
-                            button_box = widgets.HBox([yes_button, no_button])
+                            # <--- FIX: Append the corrected slit to our list
+                            final_corrected_slits.append(o_corrected)
+                            
+                            next_target()
 
-                            if param_area_feedback:
-                                param_area_feedback.children = [widgets.VBox([prompt_label,button_box
-                                                                              ,radius_dropdown],layout=widgets.Layout(border='2px solid grey'))]
-
-                        run_skyline_and_prompt(skyline_obj_rad)
-
-                    else: # Not adjust_wavelength
-                        trace1 = spectra.Trace(file=trace_file, transpose=trace_transpose, lags=trace_lags,
-                                               sc0=trace_sc0, degree=trace_degree, sigdegree=trace_sigdegree,
-                                               inst=trace_inst, type=trace_type, pix0=trace_pix0, rad=trace_rad,
-                                               model=trace_model,rows=trace_rows, channel=trace_channel,
-                                               hdu=trace_hdu, spectrum=trace_spectrum)
-                        if findpeak_width is None:
-                            trace1.rows = [0, o.data.shape[0]]
-                            trace1.index = [0]
-                            center = o.shape[0] // 2
-                        else:
-                            center = findpeak_width
-                        
-                        peak, ind = trace1.findpeak(o, thresh=findpeak_thresh, width=center, sc0=findpeak_sc0, plot=findpeak_plot,
-                                                    sort=findpeak_sort, back_percentile=findpeak_back_percentile, smooth=findpeak_smooth,
-                                                    method=findpeak_method,verbose=findpeak_verbose, diff=findpeak_diff,bundle=findpeak_bundle)
-                        nrows = o.shape[0]
-                        o_corrected = wav.correct(o, o.wave[nrows // correcting_value])
-                        name = o.header["FILE"].split(".")[0]
-                        o_corrected[0].header['ADJUST'] = f'The extraction method used is: {val1.label}'
-                        o_corrected[0].header['SKYRAD'] = f'The radius used in skyline calibration adjustment is: N/A'
-                        
-                        folder_name = f"{folder}_2d_extractions"
-                        os.makedirs(folder_name, exist_ok=True) # Safely create directory
-                        
-                        full_path = os.path.join(folder_name, f'{name}_{targ["ID"]}_not_adjusted_2d.fits')
-                        o_corrected.write(full_path, overwrite=True)
+                        def on_no(b_inner):
+                            run_skyline_and_prompt(radius_dropdown.value)
                         
-                        # <--- FIX: Append the corrected slit to our list
-                        final_corrected_slits.append(o_corrected)
-                        
-                        plt.figure()
-                        plt.plot(o_corrected.wave[peak[0]], o_corrected.data[peak[0]], label='Approximated spec with sky')
-                        plt.title('Visualization of 2D Extraction')
-                        plt.legend(loc='upper right')
-                        next_target()
+                        yes_button.on_click(on_yes)
+                        no_button.on_click(on_no)
+                        button_box = widgets.HBox([yes_button, no_button])
+
+                        if param_area_feedback:
+                            param_area_feedback.children = [widgets.VBox([prompt_label,button_box
+                                                                          ,radius_dropdown],layout=widgets.Layout(border='2px solid grey'))]
+
+                    run_skyline_and_prompt(skyline_obj_rad)
                 
                 next_target()
 
@@ -406,6 +941,76 @@ class CofiProcessor:
         else:
             print("2D spectrum extraction initiated. Use controls above.")
 
+    def extract1d_spectra(self, spec2d_list, targets_list, folder=None, rad=5, back=10, back_offset=2,
+                          sky=False, logger=None, per_target=None, workers=None, **params):
+        """
+        Non-interactive counterpart of multi_extract1d.
+
+        Extracts every 2D spectrum with the given aperture radius, background window
+        (`back`) and window offset (`back_offset`), optionally applies the 1D skyline
+        adjustment, and writes the results. `per_target` maps a target ID to a dict
+        overriding any of rad/back/back_offset/sky for that target. With workers > 1
+        the targets are extracted in a process pool; file names and the returned order
+        are the same as in the serial run. `params` are the trace_class_*, findpeak_*,
+        trace_method_*, extract_* and skyline_* keywords of multi_extract1d.
+        Returns the list of extracted spectra (slits without a peak, and targets whose
+        extraction failed, are skipped; the failures are reported).
+        """
+        settings = _extract1d_settings(**params)
+        parallel = workers is not None and workers > 1
+        jobs = []
+        for i, (spec2d_slice, targ) in enumerate(zip(spec2d_list, targets_list)):
+            choice = dict(rad=rad, back=back, back_offset=back_offset, sky=sky)
+            choice.update((per_target or {}).get(str(targ['ID']), {}))
+            if logger:
+                _log_1d_choice(logger, targ['ID'], **choice)
+            jobs.append((i, spec2d_slice, _row_dict(targ), settings, folder, choice['rad'], choice['back'],
+                         choice['back_offset'], choice['sky'], None if parallel else self.display))
+
+        results, errors = _run_target_jobs(_extract1d_target, jobs, workers)
+        extracted_1d_spectra = [spec1d for spec1d in results if spec1d is not None]
+        _report_failed(errors, jobs)
+        print("✅ All 1D extractions complete!\n")
+        self.spec1d_out = extracted_1d_spectra
+        return extracted_1d_spectra
+
+    def extract1d_best_radius(self, spec2d_list, targets_list, folder=None, radii=EXTRACTION_RADII, back=10,
+                              back_offset=2, sky=False, logger=None, workers=None, **params):
+        """
+        Extracts every 2D spectrum at each candidate radius and keeps the one with the best S/N.
+
+        S/N is the median per-pixel data/uncertainty of the extracted spectrum. The object is
+        traced once per slit; only the chosen extraction is skyline-adjusted (if `sky`) and
+        written. With workers > 1 the targets run in a process pool. `params` are those of
+        extract1d_spectra.
+        Returns (spectra, summary) where summary is a DataFrame with one row per target:
+        slit, ID, chosen radius, its S/N, the S/N at every radius tried and the
+        error of a target whose extraction failed (None otherwise).
+        """
+        settings = _extract1d_settings(**params)
+        jobs = [(i, spec2d_slice, _row_dict(targ), settings, folder, radii, back, back_offset, sky)
+                for i, (spec2d_slice, targ) in enumerate(zip(spec2d_list, targets_list))]
+        results, errors = _run_target_jobs(_extract1d_best_target, jobs, workers)
+
+        extracted_1d_spectra = []
+        rows = []
+        for i, result in enumerate(results):
+            if result is None:
+                result = None, {'slit': i, 'ID': str(jobs[i][2]['ID']), 'best_rad': None, 'best_snr': np.nan}
+            spec1d, row = result
+            row['error'] = errors.get(i)
+            rows.append(row)
+            if spec1d is None:
+                continue
+            if logger:
+                _log_1d_choice(logger, row['ID'], row['best_rad'], back, back_offset, sky)
+            extracted_1d_spectra.append(spec1d)
+
+        summary = pd.DataFrame(rows)
+        _report_failed(errors, jobs)
+        print("✅ All 1D extractions complete!\n")
+        self.spec1d_out = extracted_1d_spectra
+        return extracted_1d_spectra, summary
 
     # Interactive 1D Extraction (Restored to original interactive logic)
     def multi_extract1d(self, spec2d_list, targets_list, folder=None,
@@ -440,10 +1045,61 @@ class CofiProcessor:
                     # --- skyline() method parameters ---
                     skyline_thresh=50, skyline_inter=True, skyline_linear=False,
                     skyline_file='skyline.dat', skyline_rows=None, skyline_plot=True,
-                    logger=None,):
+                    logger=None,
+
+                    # --- Batch (no prompt) mode ---
+                    batch=False, batch_radii=EXTRACTION_RADII, batch_back=10, batch_back_offset=2,
+                    batch_sky=False, batch_workers=None):
+        """
+        Interactive 1D extraction: extracts each 2D spectrum and asks whether to keep it or
+        retry with another radius.
+
+        With batch=True no controls are shown: every target is extracted at each of
+        `batch_radii` and the best-S/N radius is kept (see extract1d_best_radius), using
+        `batch_workers` processes. The summary table is displayed in `output` (if given) and (spectra, summary) is returned.
+        """
+        if batch:
+            params = {key: value for key, value in locals().items()
+                      if key.startswith(('trace_class_', 'findpeak_', 'trace_method_', 'extract_', 'skyline_'))}
+            spectra_out, summary = self.extract1d_best_radius(spec2d_list, targets_list, folder=folder,
+                                                              radii=batch_radii, back=batch_back,
+                                                              back_offset=batch_back_offset, sky=batch_sky,
+                                                              logger=logger, workers=batch_workers, **params)
+            if output is not None:
+                # an output area means a notebook, where IPython is available
+                from IPython.display import display
+                with output:
+                    display(summary)
+            return spectra_out, summary
+
+        # GUI modules are only needed by the interactive path, so auto_accept/batch users never import them
+        import ipywidgets as widgets
+        from IPython.display import display
+
+        settings = _extract1d_settings(
+            trace_class_file=trace_class_file, trace_class_inst=trace_class_inst,
+            trace_class_type=trace_class_type, trace_class_degree=trace_class_degree,
+            trace_class_sigdegree=trace_class_sigdegree, trace_class_pix0=trace_class_pix0,
+            trace_class_rad=trace_class_rad, trace_class_model=trace_class_model,
+            trace_class_sc0=trace_class_sc0, trace_class_rows=trace_class_rows,
+            trace_class_transpose=trace_class_transpose, trace_class_lags=trace_class_lags,
+            trace_class_channel=trace_class_channel, trace_class_hdu=trace_class_hdu,
+            trace_class_spectrum=trace_class_spectrum,
+            findpeak_sc0=findpeak_sc0, findpeak_width=findpeak_width, findpeak_thresh=findpeak_thresh,
+            findpeak_sort=findpeak_sort, findpeak_back_percentile=findpeak_back_percentile,
+            findpeak_method=findpeak_method, findpeak_smooth=findpeak_smooth, findpeak_diff=findpeak_diff,
+            findpeak_bundle=findpeak_bundle, findpeak_verbose=findpeak_verbose, findpeak_plot=findpeak_plot,
+            trace_method_sc0=trace_method_sc0, trace_method_rad=trace_method_rad,
+            trace_method_thresh=trace_method_thresh, trace_method_index=trace_method_index,
+            trace_method_skip=trace_method_skip, trace_method_gaussian=trace_method_gaussian,
+            trace_method_verbose=trace_method_verbose, trace_method_srows=trace_method_srows,
+            extract_fit=extract_fit, extract_old=extract_old, extract_nout=extract_nout,
+            extract_threads=extract_threads, extract_medfilt=extract_medfilt,
+            skyline_thresh=skyline_thresh, skyline_inter=skyline_inter, skyline_linear=skyline_linear,
+            skyline_file=skyline_file, skyline_rows=skyline_rows, skyline_plot=skyline_plot)
 
         sky_choice = widgets.Dropdown(
-            options=[('No sky adjustment', 'no_sky'), ('Sky adjustment', 'sky')],
+            options=[(SKY_LABELS[False], 'no_sky'), (SKY_LABELS[True], 'sky')],
             value='no_sky', #if _initial_sky_cal_param else 'no_sky', # Initialize based on param
             description='1D Calibration choice:', # Clarified description
             # layout=widgets.Layout(width='240px'), # Adjusted width
@@ -453,7 +1109,7 @@ class CofiProcessor:
         # sky_choice.add_class('custom-dropdown')
 
         radius_dropdown = widgets.Dropdown(
-            options=[3, 4, 5, 6, 7, 8, 9, 10, 11,12,13,14,15],
+            options=EXTRACTION_RADII,
             value=5,
             description='Extraction radius:',
             # layout=widgets.Layout(width='180px'),
@@ -482,7 +1138,6 @@ class CofiProcessor:
         def on_run_extraction_click(b):
             run_button_1d.disabled = True  # prevent double-click
             rad = radius_dropdown.value
-            extract_back = extract1d_back_input.value
             do_sky = (sky_choice.value == 'sky')
     
             with param_area_2:
@@ -500,61 +1155,25 @@ class CofiProcessor:
                     'Sky window offset': extract1d_back_offset_input_.value,
                     '1d_calibration_choice': (sky_choice.value == 'sky'),
                 }
-                logger.log_action("Science & Extraction - 1D Extract", "Setup & Run 1D Extraction", log_params)
-                
-                trace_obj = spectra.Trace(file= trace_class_file, inst=trace_class_inst, type=trace_class_type, degree=trace_class_sigdegree, 
-                                           sigdegree=trace_class_sigdegree, pix0=trace_class_pix0, rad=trace_class_rad,
-                                           sc0=trace_class_sc0, transpose=trace_class_transpose, lags=trace_class_lags,
-                                           model=trace_class_model, spectrum=trace_class_spectrum,)
-
-                if findpeak_width is None:
-                    trace_obj.rows = [0, spec2d_slice.data.shape[0]]
-                    trace_obj.index = [0]
-                    center = spec2d_slice.shape[0] // 2
-                else:
-                    center = findpeak_width
+                if logger:
+                    logger.log_action("Science & Extraction - 1D Extract", "Setup & Run 1D Extraction", log_params)
+
                 with output_area:
-                    peak, _ = trace_obj.findpeak(
-                        spec2d_slice, sc0=findpeak_sc0, width=center, thresh=findpeak_thresh, sort=findpeak_sort, 
-                        back_percentile=findpeak_back_percentile, method=findpeak_method, smooth=findpeak_smooth, 
-                        diff=findpeak_diff, bundle=findpeak_bundle, verbose=findpeak_verbose, plot=findpeak_plot)
-                    
+                    trace_obj, peak = _trace_target(spec2d_slice, settings, display=self.display)
 
-                if len(peak) == 0:
+                if trace_obj is None:
                     with param_area_2:
                         print(f"   -> No peak found for slit {i}. Skipping.")
                     next_target()
                     return
-                if trace_method_srows is None:
-                    srows = [peak[0]]
-                else:
-                    srows = trace_method_srows
-                trace_obj.model = [lambda x: x * 0. + peak[0]]
-                with output_area:
-                    trace_obj.trace(spec2d_slice, srows, skip=trace_method_skip, gaussian=trace_method_gaussian, display=self.display,
-                                   sc0=trace_method_sc0,rad=trace_method_rad, thresh=trace_method_thresh,verbose=trace_method_verbose,
-                                   )
-                                   # )rad=trace_method_rad, thresh=trace_method_thresh, index=trace_method_index,
-                                   #  verbose=trace_method_verbose
-                                   # ) #sc0=trace_method_sc0,
-                
-                    # trace_obj.model = [lambda x: x * 0. + peak[0]]
 
                 def run_extraction_and_prompt():
                     rad = radius_dropdown.value
-                    # if extract_back is None:
-                    sky_width = rad - 5 
                     extract_back = extract1d_back_input.value
-                    back_regions = [[-1*extract_back + (-1 * sky_width), -rad-extract1d_back_offset_input_.value],
-                                    [extract_back + sky_width, rad+extract1d_back_offset_input_.value]] # [[-10, -rad], [10, rad]]
-                    # else:
-                    #     back_regions = extract_back
+                    back_offset = extract1d_back_offset_input_.value
                     with output_area:
-                        spec1d = trace_obj.extract(spec2d_slice, rad=rad, back=back_regions, display=self.display,
-                                                    fit=extract_fit, old=extract_old, nout=extract_nout,
-                                                    threads=extract_threads,medfilt=extract_medfilt
-                                                  )
-                    spec1d.wave = spec2d_slice.wave[peak]
+                        spec1d = _extract_spectrum(trace_obj, spec2d_slice, peak, rad, extract_back, back_offset,
+                                                   settings, display=self.display)
                     
                     yes_button = widgets.Button(description="Yes", button_style="success")
                     no_button = widgets.Button(description="No", button_style="danger")
@@ -564,27 +1183,12 @@ class CofiProcessor:
     
                     def on_yes(b):
                         if do_sky:
-                            wavcal = spectra.WaveCal(f'./CofIwav_{spec2d_slice.header['OBJNAME']}_{targ["ID"]}.fits') # CofIwav_{o.header['OBJNAME']}_{targ["ID"]}.fits
-                            swav = copy.deepcopy(wavcal)
-                            swav.skyline(spec1d, thresh=skyline_thresh, linear=skyline_linear, plot=skyline_plot, rows=skyline_rows, file=skyline_file)
-                            
+                            _apply_skyline(spec1d, spec2d_slice, targ, settings['skyline'])
                             with param_area_2:
                                 print("   -> Skyline calibration applied.")
                         # --- begin auto‐save block ---
-                        prefix = '2d_ad' if not do_sky else '1d_ad'
-                        name   = spec2d_slice.header["FILE"].split(".")[0]
-                        filename = f"{prefix}_{rad}_{name}_{targ['ID']}_{i}.fits"
-                                                # Define a directory for this science frame's extractions
-                        folder_name = f"{folder}_1d_extractions"
-                        os.makedirs(folder_name, exist_ok=True) # Safely create directory
-
-                        spec1d[0].header['1D_CAL'] = f'The calibration method used is: {sky_choice.label}'
-                        spec1d[0].header['EXT_RAD'] = f'The radius used for extracting this spectrum is: {radius_dropdown.value}'
-                        spec1d[0].header['BKG_WIDTH'] = f'The value used to define the sky background window is: {extract1d_back_input.value}'
-                        spec1d[0].header['BKG_OFF'] = f'The value used to offset the sky background window from the spectrum radius is: {extract1d_back_offset_input_.value}'
-                        
-                        full_path = os.path.join(folder_name, filename)
-                        spec1d.write(full_path, overwrite=True)
+                        full_path = _write_spectrum(spec1d, spec2d_slice, targ, i, folder, rad,
+                                                    extract_back, back_offset, do_sky)
                         with param_area_2:
                             print(f"   -> Saved spectrum to {full_path}")
                         # --- end auto‐save block ---
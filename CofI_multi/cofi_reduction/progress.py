@@ -0,0 +1,19 @@
+# cofi_reduction/progress.py
+
+# Progress reporting and cancellation shared by the pipeline steps and the widget's BackgroundRunner
+
+
+class Cancelled(Exception):
+    """Raised between units of work (frames, masters, slits) when a task is cancelled."""
+
+
+def check_cancelled(cancel):
+    """Raises Cancelled if the threading.Event `cancel` (may be None) is set."""
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+def report(progress, done, total, label=''):
+    """Calls the progress callback (may be None) with units done out of total."""
+    if progress is not None:
+        progress(done, total, label)
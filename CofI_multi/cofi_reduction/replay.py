@@ -0,0 +1,228 @@
+# cofi_reduction/replay.py
+
+import sys
+import json
+import argparse
+from .log import read_log
+from .pipeline import CofiPipeline, parse_frames
+
+# Order in which a plan is executed, whatever order the steps were logged in
+PLAN_STEPS = ['read_folder', 'compute_bias', 'compute_dark', 'compute_flat', 'compute_arcs',
+              'find_slits', 'filter_slits', 'update_arc_headers', 'calibrate_wavelength',
+              'reduce_science', 'reduce_sciences', 'extract2d', 'extract1d']
+
+
+def _none(value):
+    return None if value in ('None', '') else value
+
+
+def _lags(value):
+    """'-39,39' (how the widget logs lag ranges) -> range(-39, 39)."""
+    if value is None or isinstance(value, range):
+        return value
+    lag1, lag2 = str(value).split(',')
+    return range(int(lag1), int(lag2))
+
+
+def bias_params(p):
+    """compute_bias keywords from the parameters the widget logs for Compute Bias."""
+    return dict(frames=parse_frames(p['Bias Frames']), type=p.get('Combine Type', 'median'),
+                sigreject=p.get('Sigma Reject', 5.0), trim=p.get('Trim Bias', False))
+
+
+def dark_params(p):
+    """compute_dark keywords from the parameters the widget logs for Compute Dark."""
+    return dict(frames=parse_frames(p['Dark Frames']), type=p.get('Combine Type', 'median'),
+                sigreject=p.get('Sigma Reject', 5.0), clip=p.get('Clip (x Uncertainty)') or None,
+                apply_bias=p.get('Apply dark Bias', True), trim=p.get('Trim Dark', False))
+
+
+def flat_params(p):
+    """compute_flat keywords from the parameters the widget logs for Compute Flat."""
+    return dict(frames=parse_frames(p['Flat Frames']), type=p.get('Combine Type', 'median'),
+                sigreject=p.get('Sigma Reject', 5.0), spec=p.get('Spectral Flat', True),
+                width=p.get('Window Width', 101), normalize=p.get('Normalize Flat', True),
+                snmin=p.get('S/N Min (for Norm)', 50.0), apply_bias=p.get('Apply Bias', True),
+                apply_dark=p.get('Apply Dark', True), littrow=p.get('Flat littrow ', False),
+                trim=p.get('Trim Flats', False))
+
+
+def _find_slits_step(p):
+    cent = _none(p.get('spectra center location (if known)'))
+    return dict(flat_frame=parse_frames(p['Flat Frame for Slits'])[0], kms_file=p['KMS File'],
+                smooth=p.get('Smooth Radius (FindSlits)', 3.0), thresh=p.get('Edge Threshold (FindSlits)', 0.5),
+                degree=p.get('Fit Degree (FindSlits)', 2), skip=p.get('Pixels to skip (FindSlits)', 50),
+                sn=p.get('Use S/N for Edges (FindSlits)', True), cent=None if cent is None else int(cent))
+
+
+def _wave_cal_step(p):
+    params = dict(p)
+    # Replays never stop for plots or interactive line rejection
+    params.update(plot=False, plotinter=False, inter=False)
+    return params
+
+
+def _reduce_step(p):
+    params = {key: value for key, value in p.items() if key not in ('num', 'Apply bias', 'Apply dark', 'Apply flat')}
+    params.update(frame=parse_frames(p['num'])[0], apply_bias=p.get('Apply bias', True), apply_dark=p.get('Apply dark', True),
+                  apply_flat=p.get('Apply flat', False))
+    return params
+
+
+def log_to_plan(parsed_log, folder=None):
+    """
+    Turns a parsed CofiLogger log (see log.parse_log) into a replay plan.
+
+    The plan is an ordered dict mapping CofiPipeline method names to the keyword
+    arguments they are called with, in PLAN_STEPS order. When a step was logged
+    more than once, the last entry wins. Extraction output goes to `folder`,
+    defaulting to the target name in the log header.
+    """
+    steps = {}
+    per_target = {}
+    for entry in parsed_log['actions']:
+        action = (entry['action'] or '').strip()
+        p = entry['parameters']
+        if action == 'Read Folder':
+            steps['read_folder'] = dict(indir=p['folder_path'])
+        elif action == 'Compute Bias':
+            steps['compute_bias'] = bias_params(p)
+        elif action == 'Compute Dark':
+            steps['compute_dark'] = dark_params(p)
+        elif action == 'Compute Flat':
+            steps['compute_flat'] = flat_params(p)
+        elif action == 'Compute Arc':
+            steps['compute_arcs'] = dict(frames=parse_frames(p['Arc Frames']))
+        elif action == 'Find Slits':
+            steps['find_slits'] = _find_slits_step(p)
+            steps.pop('filter_slits', None) # a new slit search resets any earlier filter
+        elif action == 'Filter Slits':
+            steps['filter_slits'] = dict(method=p['Filter By'], values=p['Values'])
+        elif action == 'Reduce Run Wavelength Calibration':
+            steps['calibrate_wavelength'] = _wave_cal_step(p)
+        elif action == 'Reduce Science Frame':
+            steps['reduce_science'] = _reduce_step(p)
+        elif action == 'Setup & Run 2D Extrction':
+            if 'Adjustment Choice' in p:
+                steps.setdefault('extract2d', {})['adjust_wavelength'] = p['Adjustment Choice']
+            else:
+                params = dict(p, trace_lags=_lags(p.get('trace_lags')))
+                params['apply_flat'] = params.pop('2D flat apply', True)
+                params['adjust_wavelength'] = False # set by the 'Adjustment Choice' entry that follows
+                steps['extract2d'] = params
+        elif action == 'Setup & Run 1D Extraction':
+            rad_keys = [key for key in p if key.endswith('_rad') and not key.startswith(('trace_', 'skyline_'))]
+            if rad_keys:
+                targ_id = rad_keys[0][:-len('_rad')]
+                per_target[targ_id] = dict(rad=p[rad_keys[0]], back=p.get(f'{targ_id}_Bkg Region', 10),
+                                           back_offset=p.get('Sky window offset', 2),
+                                           sky=p.get('1d_calibration_choice', False))
+            else:
+                steps['extract1d'] = dict(p, trace_class_lags=_lags(p.get('trace_class_lags')))
+                per_target = {}
+        else:
+            print(f"ℹ️ Log action '{action}' is not part of the batch reduction. Skipping.")
+
+    if 'find_slits' in steps and 'compute_arcs' in steps:
+        steps['update_arc_headers'] = {}
+    folder = folder or parsed_log.get('target')
+    for step in ('extract2d', 'extract1d'):
+        if step in steps:
+            steps[step]['folder'] = folder
+    if 'extract1d' in steps:
+        steps['extract1d']['per_target'] = per_target
+
+    return {step: steps[step] for step in PLAN_STEPS if step in steps}
+
+
+def run_plan(pipeline, plan, stop_after=None):
+    """Calls each plan step on the pipeline in order, optionally stopping after `stop_after`."""
+    for step, kwargs in plan.items():
+        print(f"🚀 {step} ...")
+        getattr(pipeline, step)(**kwargs)
+        print(f"✅ {step} done.")
+        if step == stop_after:
+            break
+    return pipeline
+
+
+def build_replay_plan(log_file, indir=None, science=None, folder=None, kms_file=None,
+                      adjust_wavelength=None, clobber=None, workers=None):
+    """
+    Reads a log into a plan (see log_to_plan) and applies the command-line overrides.
+
+    Any override replaces the logged value, so the same log can reduce another
+    exposure (`science`) or night (`indir`) of the same mask.
+    """
+    plan = log_to_plan(read_log(log_file), folder=folder)
+    if indir is not None:
+        plan.setdefault('read_folder', {})['indir'] = indir
+        plan = {step: plan[step] for step in PLAN_STEPS if step in plan}
+    if science is not None and 'reduce_science' in plan:
+        plan['reduce_science']['frame'] = science
+    if kms_file is not None and 'find_slits' in plan:
+        plan['find_slits']['kms_file'] = kms_file
+    if adjust_wavelength is not None and 'extract2d' in plan:
+        plan['extract2d']['adjust_wavelength'] = adjust_wavelength
+    if clobber is not None and 'calibrate_wavelength' in plan:
+        plan['calibrate_wavelength']['clobber'] = clobber
+    if workers is not None:
+        for step in ('calibrate_wavelength', 'extract2d', 'extract1d'):
+            if step in plan:
+                plan[step]['workers'] = workers
+    return plan
+
+
+def replay_log(log_file, stop_after=None, display=None, logger=None, **overrides):
+    """
+    Re-runs a logged widget session as an unattended batch reduction.
+
+    `overrides` are those of build_replay_plan. Returns the CofiPipeline holding
+    every intermediate product.
+    """
+    plan = build_replay_plan(log_file, **overrides)
+    pipeline = CofiPipeline(display=display, logger=logger)
+    return run_plan(pipeline, plan, stop_after=stop_after)
+
+
+def _plan_to_json(plan):
+    return json.dumps(plan, indent=4, default=lambda value: f"{value.start},{value.stop}"
+                      if isinstance(value, range) else str(value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cofi-replay',
+                                     description='Replay a CofI reduction log as a batch reduction.')
+    parser.add_argument('log_file', help='log written by the reduction widget')
+    parser.add_argument('--indir', help='data folder (default: the logged folder)')
+    parser.add_argument('--science', help='science frame to reduce (default: the logged frame)')
+    parser.add_argument('--folder', help='output name for the extraction folders (default: log target)')
+    parser.add_argument('--kms', dest='kms_file', help='KMS file (default: the logged file)')
+    parser.add_argument('--adjust-wavelength', dest='adjust_wavelength', action='store_true', default=None,
+                        help='apply the 2D skyline wavelength adjustment')
+    parser.add_argument('--no-adjust-wavelength', dest='adjust_wavelength', action='store_false',
+                        help='skip the 2D skyline wavelength adjustment')
+    parser.add_argument('--clobber', action='store_true', default=None,
+                        help='recompute existing wavelength solutions')
+    parser.add_argument('--workers', type=int, help='worker processes for wavelength calibration and 2D/1D extraction')
+    parser.add_argument('--stop-after', choices=PLAN_STEPS, help='last step to run')
+    parser.add_argument('--dry-run', action='store_true', help='print the plan and exit')
+    args = parser.parse_args(argv)
+
+    overrides = dict(indir=args.indir, science=parse_frames(args.science)[0] if args.science else None,
+                     folder=args.folder, kms_file=args.kms_file, adjust_wavelength=args.adjust_wavelength,
+                     clobber=args.clobber, workers=args.workers)
+    if args.dry_run:
+        print(_plan_to_json(build_replay_plan(args.log_file, **overrides)))
+        return 0
+    try:
+        replay_log(args.log_file, stop_after=args.stop_after, **overrides)
+    except Exception as e:
+        print(f"❌ Replay failed: {e}")
+        return 1
+    print("✅ Replay complete.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,11 @@
 import os
+import glob
 import datetime
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import ipywidgets as widgets
-from IPython.display import display, clear_output
 from astropy.io import fits
 from astropy.nddata import StdDevUncertainty
 from astropy import units as u
@@ -15,20 +15,256 @@ from specutils.manipulation import box_smooth
 from astropy.modeling import models, fitting
 from scipy.stats import sem
 
+# Rest wavelengths of the Ca II triplet (Å) and the names of the lines in the results
+CAT_LINES = (('Blue', 8498.02), ('Center', 8542.09), ('Red', 8662.14))
+
+# Fit settings of the analysis (the defaults of the UI sliders and dropdowns)
+FIT_DEFAULTS = dict(search_width=30, smooth_width=0, fit_width=17, model='Gaussian')
+
+
+def load_spectrum(fp):
+    """Read FITS and build a Spectrum1D."""
+    with fits.open(fp) as hdul:
+        if hdul[0].header['INSTRUME'] == 'kosmos':
+            flux = hdul[1].data.flatten()
+            wl   = hdul[4].data[0].flatten()
+            err  = hdul[2].data.flatten()
+        else:
+            flux = hdul[0].data.flatten()
+            hdr  = hdul[0].header
+
+            # 2. Read the WCS linear solution from header
+            crval1 = hdr['CRVAL1']   # starting wavelength at reference pixel (Å)
+            crpix1 = hdr['CRPIX1']   # reference pixel index (1-based)
+            cdelt1 = hdr['CDELT1']   # wavelength increment per pixel (Å)
+            
+            # 3. Build pixel indices and compute wavelength array
+            #    Note: header pixels are 1-based, numpy is 0-based:
+            n_pix = hdr['NAXIS1']
+            pixels = np.arange(n_pix)         # 0,1,2,...,4059
+            wavelength = (pixels + 1 - crpix1) * cdelt1 + crval1
+            wl = wavelength.flatten()
+
+            gain = hdr['gain'] #1.48 # e-/ADU
+            read_noise = hdr['RDNOISE'] #3.89 # e-
+            
+            # Convert flux from ADU to electrons to calculate Poisson noise
+            flux_electrons = flux * gain
+            
+            # Calculate total error (read noise + Poisson noise) in electrons
+            err_electrons = np.sqrt(flux_electrons + read_noise**2)
+            
+            # Convert error back to ADU
+            err = err_electrons / gain
+            
+    return Spectrum1D(spectral_axis=wl*u.angstrom,
+                      flux=flux*u.adu,
+                      uncertainty=StdDevUncertainty(err))
+
+
+def normalize_spectrum(spec):
+    """
+    Continuum-subtracted CaT region (flux / continuum - 1, 8450-8700 Å).
+    Returns (normalized, region, continuum values).
+    """
+    # slice by wavelength with Quantity
+    sub = spec[8450*u.angstrom : 8700*u.angstrom]
+
+    # fit continuum
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        cont_model = fit_generic_continuum(sub)
+
+    # evaluate continuum & subtract
+    cont_vals = cont_model(sub.spectral_axis)
+    norm_flux = (sub.flux / cont_vals - 1) * u.adu
+
+    # build a new normalized Spectrum1D
+    normalized = Spectrum1D(
+        spectral_axis = sub.spectral_axis,
+        flux          = norm_flux,
+        uncertainty   = StdDevUncertainty(sub.uncertainty.array),
+    )
+    return normalized, sub, cont_vals
+
+
+def fit_cat_lines(normalized, search_width=30, smooth_width=0, fit_width=17, model='Gaussian'):
+    """
+    Detect the 3 CaT lines of a normalized spectrum, fit each (Gaussian or Voigt)
+    and compute their S/N. Returns (one result dict per fitted line, plot data:
+    wl, fl, the fitted curves and the noise mask).
+    """
+    # 1) prepare spectrum
+    spec = (box_smooth(normalized, width=smooth_width)
+            if smooth_width > 0 else normalized)
+    wl, fl = spec.spectral_axis.value, spec.flux.value
+
+    # 2) detect approximate line centers
+    centers = []
+    for name, rest in CAT_LINES:
+        mask = (wl >= rest - search_width) & (wl <= rest + search_width)
+        if mask.any():
+            idx = np.argmin(fl[mask])
+            centers.append(wl[mask][idx])
+
+    fitter = fitting.LevMarLSQFitter()
+    results, curves = [], []
+
+    # 3) fit each line
+    for c, (name, rest) in zip(centers, CAT_LINES):
+        window = (wl >= c - fit_width) & (wl <= c + fit_width)
+        x, y   = wl[window], fl[window]
+        if len(x) < 5:
+            print(f"⚠️ Not enough data for {name} line at {c:.2f} Å")
+            continue
+
+        # original trough
+        orig_idx  = np.argmin(y)
+        orig_wave = x[orig_idx]
+        orig_flux = y[orig_idx]
+
+        # initial model
+        if model == 'Voigt':
+            init = models.Voigt1D(x_0=orig_wave, amplitude_L=orig_flux,
+                                  fwhm_G=5, fwhm_L=5)
+        else:
+            init = models.Gaussian1D(amplitude=orig_flux,
+                                    mean=orig_wave, stddev=2)
+
+        fit = fitter(init, x, y)
+
+        # profile center
+        center_val = (fit.x_0.value if model=='Voigt'
+                      else fit.mean.value)
+
+        # evaluate fit on a fine grid
+        x_full = np.linspace(orig_wave - fit_width,
+                             orig_wave + fit_width, 300)
+        y_full = fit(x_full)
+
+        # fitted trough
+        fit_idx   = np.argmin(y_full)
+        fit_wave  = x_full[fit_idx]
+        fit_flux  = y_full[fit_idx]
+
+        rez = {
+            'Line':                    name,
+            'Model_Type':              model,
+            'Orig_Trough_Wavelength':  orig_wave,
+            'Orig_Trough_Flux':        orig_flux,
+            'Fit_Trough_Wavelength':   fit_wave,
+            'Fit_Trough_Flux':         fit_flux,
+            'Fit_Center':              center_val,
+        }
+
+        # amplitudes & widths
+        if model=='Voigt':
+            rez.update({
+                'Amplitude_L': fit.amplitude_L.value,
+                'FWHM_G':      fit.fwhm_G.value,
+                'FWHM_L':      fit.fwhm_L.value
+            })
+        else:
+            rez.update({
+                'Amplitude': fit.amplitude.value,
+                'Stddev':    fit.stddev.value
+            })
+
+        results.append(rez)
+        curves.append((name, x_full, y_full, center_val))
+
+    # 4) noise region: everything outside the fit windows
+    mask_all = np.zeros_like(wl, dtype=bool)
+    for c in centers:
+        mask_all |= ((wl >= c - fit_width) &
+                     (wl <= c + fit_width))
+    noise_mask = ~mask_all
+
+    # compute noise σ
+    noise_std = np.std(fl[noise_mask])
+
+    # 5) compute S/N for each line
+    for rez in results:
+        snr = (abs(rez['Orig_Trough_Flux']) / noise_std
+               if noise_std>0 else np.nan)
+        rez['S/N'] = snr
+
+    return results, dict(wl=wl, fl=fl, curves=curves, noise_mask=noise_mask)
+
+
+def star_id(fp, postfix=4):
+    """Target ID of a spectrum: the TARGID header card, or field `postfix` of the '_'-separated file name."""
+    try:
+        targid = fits.getheader(fp, 0).get('TARGID')
+    except OSError:
+        targid = None
+    if targid:
+        return str(targid).strip()
+    split_name = os.path.basename(fp).strip('fits').split('_')
+    return split_name[postfix] if len(split_name) > postfix else "N/A"
+
+
+def analyze_spectrum(fp, postfix=4, **fit_params):
+    """
+    Load, normalize and fit the CaT lines of one spectrum without plotting.
+    Returns one row per fitted line, with File name and Star ID first.
+    """
+    normalized, _, _ = normalize_spectrum(load_spectrum(fp))
+    results, _ = fit_cat_lines(normalized, **{**FIT_DEFAULTS, **fit_params})
+    first = {'File name': os.path.basename(fp), 'Star ID': star_id(fp, postfix)}
+    return [{**first, **rez} for rez in results]
+
+
+def _analyze_job(fp, postfix, fit_params):
+    """analyze_spectrum for a worker process: (rows, None) or ([], error message)."""
+    try:
+        return analyze_spectrum(fp, postfix, **fit_params), None
+    except Exception as e:
+        return [], str(e)
+
+
+def find_spectra(source, pattern='*.fits'):
+    """Spectra of a folder (matching `pattern`), a glob or a list of paths, sorted."""
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, pattern)))
+    return sorted(glob.glob(source))
+
+
+def write_results(df, csv_name):
+    """Append or create <name>_rv_analysis/<csv_name> (name: the part before the first '_'). Returns the path."""
+    name = csv_name.split("_")[0]
+
+    folder_name = f"{name}_rv_analysis"
+    os.makedirs(folder_name, exist_ok=True) # Safely create directory
+    
+    full_path = os.path.join(folder_name, f'{csv_name}')
+    
+    mode   = 'a' if os.path.exists(full_path) else 'w'
+    header = not os.path.exists(full_path)
+    df.to_csv(full_path, index=False, mode=mode, header=header)
+    return full_path
+
+
 class AstroAnalysis:
     # Rest wavelengths for the Ca II triplet
-    REST_L, REST_C, REST_R = 8498.02, 8542.09, 8662.14
+    REST_L, REST_C, REST_R = (rest for name, rest in CAT_LINES)
 
-    def __init__(self):
+    def __init__(self, ui=True):
         # place to hold data & results
         self.spectrum    = None
         self.normalized  = None
         self.file_name = None
         self.fit_results = []
-        # build and display the UI once
-        self._build_ui()
+        self.batch_results = None
+        # build and display the UI once (ui=False for scripted use, without ipywidgets)
+        if ui:
+            self._build_ui()
 
     def _build_ui(self):
+        import ipywidgets as widgets
+        from IPython.display import display
         # File, user & output filename
         self.file_path    = widgets.Text(description='FITS Path:', placeholder='path/to/your/file.fits',
                                          layout=widgets.Layout(width='400px'))
@@ -37,18 +273,18 @@ class AstroAnalysis:
         
         self.csv_name     = widgets.Text(description='CSV File Name:', placeholder = 'e.g. M3_stacked',layout=widgets.Layout(width='300px'))
         # parameter sliders
-        self.search_width = widgets.FloatSlider(value=30, min=5, max=100, step=1,
+        self.search_width = widgets.FloatSlider(value=FIT_DEFAULTS['search_width'], min=5, max=100, step=1,
                                                 description='Search Width (Å):', continuous_update=False,
                                                style={'description_width': 'initial'})
-        self.smooth_width = widgets.IntSlider(value=0, min=0, max=20, step=1,
+        self.smooth_width = widgets.IntSlider(value=FIT_DEFAULTS['smooth_width'], min=0, max=20, step=1,
                                               description='Smooth Width (px):', continuous_update=False,
                                              style={'description_width': 'initial'})
-        self.fit_width    = widgets.FloatSlider(value=17, min=1, max=50, step=1,
+        self.fit_width    = widgets.FloatSlider(value=FIT_DEFAULTS['fit_width'], min=1, max=50, step=1,
                                                 description='Fit Half‑Width (Å):', continuous_update=False,
                                                style={'description_width': 'initial'})
         self.postfix = widgets.Dropdown(options=list(range(1,11)), value=4, description='ID Postfix:')
         # model selector and run button
-        self.model_select = widgets.Dropdown(options=['Voigt','Gaussian'], value='Gaussian', description='Model:')
+        self.model_select = widgets.Dropdown(options=['Voigt','Gaussian'], value=FIT_DEFAULTS['model'], description='Model:')
         self.run_button   = widgets.Button(description='Run Analysis', button_style='success')
         self.run_button.on_click(self._on_run)
 
@@ -63,6 +299,7 @@ class AstroAnalysis:
         display(ui, self.output)
 
     def _on_run(self, _):
+        from IPython.display import clear_output
         with self.output:
             clear_output()
             fp = self.file_path.value.strip()
@@ -85,69 +322,50 @@ class AstroAnalysis:
             self._save_csv()
             print("✅ Analysis complete.")
 
+    def analyze_batch(self, source, pattern='*.fits', workers=None, postfix=4, csv_name=None, user='',
+                      **fit_params):
+        """
+        Batch counterpart of Run Analysis: load, continuum, CaT fits and S/N of every
+        spectrum in a folder (matching `pattern`), glob or list, without plotting.
+        With workers > 1 the spectra are analyzed in a process pool. `fit_params`
+        overrides FIT_DEFAULTS (search_width, smooth_width, fit_width, model).
+        Returns one table with a row per line and spectrum (also kept as
+        batch_results); with csv_name (.csv added if missing) it is appended to the CSV like _save_csv.
+        """
+        paths = find_spectra(source, pattern)
+        if not paths:
+            print(f"❌ No spectra found in {source!r}.")
+            return None
+        jobs = [(fp, postfix, fit_params) for fp in paths]
+        if workers is None or workers <= 1 or len(jobs) <= 1:
+            outcomes = [_analyze_job(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_analyze_job, *job) for job in jobs]
+                outcomes = [future.result() for future in futures]
+
+        rows = []
+        for fp, (result, error) in zip(paths, outcomes):
+            if error is not None:
+                print(f"❌ {os.path.basename(fp)}: {error}")
+            rows += result
+        df = pd.DataFrame(rows)
+        df.insert(0, 'User',        user)
+        df.insert(1, 'Date & Time', datetime.datetime.now().isoformat(sep=' '))
+        print(f"✅ {len(paths) - sum(error is not None for _, error in outcomes)}/{len(paths)} spectra analyzed.")
+        if csv_name and not df.empty:
+            if not csv_name.lower().endswith('.csv'):
+                csv_name += '.csv'
+            print(f"💾 Results saved to '{write_results(df, csv_name)}'")
+        self.batch_results = df
+        return df
+
     def _load_spectrum(self, fp):
         """Read FITS and build a Spectrum1D."""
-        with fits.open(fp) as hdul:
-            if hdul[0].header['INSTRUME'] == 'kosmos':
-                flux = hdul[1].data.flatten()
-                wl   = hdul[4].data[0].flatten()
-                err  = hdul[2].data.flatten()
-            else:
-                flux = hdul[0].data.flatten()
-                hdr  = hdul[0].header
-
-                # 2. Read the WCS linear solution from header
-                crval1 = hdr['CRVAL1']   # starting wavelength at reference pixel (Å)
-                crpix1 = hdr['CRPIX1']   # reference pixel index (1-based)
-                cdelt1 = hdr['CDELT1']   # wavelength increment per pixel (Å)
-                
-                # 3. Build pixel indices and compute wavelength array
-                #    Note: header pixels are 1-based, numpy is 0-based:
-                n_pix = hdr['NAXIS1']
-                pixels = np.arange(n_pix)         # 0,1,2,...,4059
-                wavelength = (pixels + 1 - crpix1) * cdelt1 + crval1
-                wl = wavelength.flatten()
-
-                gain = hdr['gain'] #1.48 # e-/ADU
-                read_noise = hdr['RDNOISE'] #3.89 # e-
-                
-                # Convert flux from ADU to electrons to calculate Poisson noise
-                flux_electrons = flux * gain
-                
-                # Calculate total error (read noise + Poisson noise) in electrons
-                err_electrons = np.sqrt(flux_electrons + read_noise**2)
-                
-                # Convert error back to ADU
-                err = err_electrons / gain
-                
-        self.spectrum = Spectrum1D(spectral_axis=wl*u.angstrom,
-                                   flux=flux*u.adu,
-                                   uncertainty=StdDevUncertainty(err))
+        self.spectrum = load_spectrum(fp)
     
     def _normalize(self):
-        spec = self.spectrum
-    
-        # slice by wavelength with Quantity
-        sub = spec[8450*u.angstrom : 8700*u.angstrom]
-    
-        # fit continuum
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore')
-            cont_model = fit_generic_continuum(sub)
-    
-        # evaluate continuum & subtract
-        cont_vals = cont_model(sub.spectral_axis)
-        norm_flux = (sub.flux / cont_vals - 1) * u.adu
-    
-        # build a new normalized Spectrum1D
-        self.normalized = Spectrum1D(
-            spectral_axis = sub.spectral_axis,
-            flux          = norm_flux,
-            uncertainty   = StdDevUncertainty(sub.uncertainty.array),
-        )
-
-    # (your plotting code here, unchanged)
-
+        self.normalized, sub, cont_vals = normalize_spectrum(self.spectrum)
 
         # show continuum & normalized
         fig, (ax1,ax2) = plt.subplots(2,1,figsize=(10,8), sharex=True)
@@ -165,123 +383,35 @@ class AstroAnalysis:
 
     def _fit_and_plot(self):
         """Detect the 3 CaT lines, fit each, plot the results, and compute S/N."""
-        # 1) prepare spectrum
-        spec = (box_smooth(self.normalized, width=self.smooth_width.value)
-                if self.smooth_width.value > 0 else self.normalized)
-        wl, fl = spec.spectral_axis.value, spec.flux.value
-
-        # 2) detect approximate line centers
-        centers = []
-        for rest in (self.REST_L, self.REST_C, self.REST_R):
-            mask = (wl >= rest - self.search_width.value) & (wl <= rest + self.search_width.value)
-            if mask.any():
-                idx = np.argmin(fl[mask])
-                centers.append(wl[mask][idx])
+        # 1) detect, fit and measure the lines
+        results, plot_data = fit_cat_lines(self.normalized, search_width=self.search_width.value,
+                                           smooth_width=self.smooth_width.value,
+                                           fit_width=self.fit_width.value, model=self.model_select.value)
+        wl, fl, noise_mask = plot_data['wl'], plot_data['fl'], plot_data['noise_mask']
+
+        # 2) file name & star ID of each row
+        self.file_name = os.path.basename(self.file_path.value)
+        first = {'File name': self.file_name, 'Star ID': star_id(self.file_path.value, self.postfix.value)}
+        self.fit_results = [{**first, **rez} for rez in results]
 
         # 3) set up the plot
         fig, ax = plt.subplots(figsize=(12,6))
         ax.plot(wl, fl, 'k', alpha=0.7, label='Normalized Spec', zorder=2)
 
-        fitter = fitting.LevMarLSQFitter()
-        self.fit_results = []
-
-        # 4) fit each line
-        for c, color, name in zip(centers, ['blue','green','red'], ['Blue','Center','Red']):
-            window = (wl >= c - self.fit_width.value) & (wl <= c + self.fit_width.value)
-            x, y   = wl[window], fl[window]
-            if len(x) < 5:
-                print(f"⚠️ Not enough data for {name} line at {c:.2f} Å")
-                continue
-
-            # original trough
-            orig_idx  = np.argmin(y)
-            orig_wave = x[orig_idx]
-            orig_flux = y[orig_idx]
-
-            # initial model
-            if self.model_select.value == 'Voigt':
-                init = models.Voigt1D(x_0=orig_wave, amplitude_L=orig_flux,
-                                      fwhm_G=5, fwhm_L=5)
-            else:
-                init = models.Gaussian1D(amplitude=orig_flux,
-                                        mean=orig_wave, stddev=2)
-
-            fit = fitter(init, x, y)
-
-            # profile center
-            center_val = (fit.x_0.value if self.model_select.value=='Voigt'
-                          else fit.mean.value)
-
-            # evaluate fit on a fine grid
-            x_full = np.linspace(orig_wave - self.fit_width.value,
-                                 orig_wave + self.fit_width.value, 300)
-            y_full = fit(x_full)
-
-            # fitted trough
-            fit_idx   = np.argmin(y_full)
-            fit_wave  = x_full[fit_idx]
-            fit_flux  = y_full[fit_idx]
-
-            # assemble parameters
-            self.file_name = os.path.basename(self.file_path.value)
-            split_name    = self.file_name.strip('fits').split('_')
-            star_id       = ( split_name[self.postfix.value]
-                              if len(split_name)>self.postfix.value else "N/A" )
-
-            rez = {
-                'File name':               self.file_name,
-                'Star ID':                 star_id,
-                'Line':                    name,
-                'Model_Type':              self.model_select.value,
-                'Orig_Trough_Wavelength':  orig_wave,
-                'Orig_Trough_Flux':        orig_flux,
-                'Fit_Trough_Wavelength':   fit_wave,
-                'Fit_Trough_Flux':         fit_flux,
-                'Fit_Center':              center_val,
-            }
-
-            # amplitudes & widths
-            if self.model_select.value=='Voigt':
-                rez.update({
-                    'Amplitude_L': fit.amplitude_L.value,
-                    'FWHM_G':      fit.fwhm_G.value,
-                    'FWHM_L':      fit.fwhm_L.value
-                })
-            else:
-                rez.update({
-                    'Amplitude': fit.amplitude.value,
-                    'Stddev':    fit.stddev.value
-                })
-
-            self.fit_results.append(rez)
-
-            # overplot fit
+        # 4) overplot the fits
+        colors = {'Blue': 'blue', 'Center': 'green', 'Red': 'red'}
+        for name, x_full, y_full, center_val in plot_data['curves']:
+            color = colors[name]
             ax.plot(x_full, y_full, '--', color=color,
                     label=f'{name} {self.model_select.value} Fit', zorder=3)
             ax.axvline(center_val, color=color, ls=':', zorder=3)
 
-        # 5) compute & show noise region on top
-        mask_all = np.zeros_like(wl, dtype=bool)
-        for c in centers:
-            mask_all |= ((wl >= c - self.fit_width.value) &
-                         (wl <= c + self.fit_width.value))
-        noise_mask = ~mask_all
-
-        # scatter noise points *on top* in magenta
+        # 5) scatter noise points *on top* in magenta
         ax.scatter(wl[noise_mask], fl[noise_mask],
                    s=15, color='magenta', alpha=0.6,
                    label='Noise Samples', zorder=4)
 
-        # compute noise σ
-        noise_std = np.std(fl[noise_mask])
-
-        # 6) compute S/N for each line
-        for rez in self.fit_results:
-            snr = (abs(rez['Orig_Trough_Flux']) / noise_std
-                   if noise_std>0 else np.nan)
-            rez['S/N'] = snr
-
-        # 7) finalize
+        # 6) finalize
         ax.spines['top'].set_visible(False)
         ax.spines['right'].set_visible(False)
         ax.spines['left'].set_color('gray')
@@ -313,19 +443,7 @@ class AstroAnalysis:
         df.insert(1, 'Date & Time', datetime.datetime.now().isoformat(sep=' '))
 
         # write or append
-        path   = self.csv_name.value
-        
-        name = path.split("_")[0]
-
-        
-        folder_name = f"{name}_rv_analysis"
-        os.makedirs(folder_name, exist_ok=True) # Safely create directory
-        
-        full_path = os.path.join(folder_name, f'{path}')
-        
-        mode   = 'a' if os.path.exists(full_path) else 'w'
-        header = not os.path.exists(full_path)
-        df.to_csv(full_path, index=False, mode=mode, header=header)
+        full_path = write_results(df, self.csv_name.value)
 
         print(f"💾 Results saved to '{full_path}'")
 
@@ -342,6 +460,8 @@ class AstroAnalysis:
     def calculate_radial_velocity(self, csv_path):
         import numpy as np
         from scipy.stats import sem
+        import ipywidgets as widgets
+        from IPython.display import display, clear_output
     
         try:
             df = pd.read_csv(csv_path)
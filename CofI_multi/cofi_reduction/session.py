@@ -0,0 +1,175 @@
+# cofi_reduction/session.py
+
+import os
+import json
+import pickle
+import shutil
+import datetime
+import pandas as pd
+from astropy.table import Table
+from pyvista import imred, dataclass
+
+# Pipeline state written to a session directory, and how each piece is stored
+SESSION_STATE = {
+    'red': 'reducer',            # folder + instrument only; the Reducer is rebuilt on load
+    'bias_frame': 'fits',
+    'dark_frame': 'fits',
+    'flat_frame': 'fits',
+    'arcs_frame': 'fits',
+    'full_trace': 'pickle',      # Trace holds astropy models, Trace.write does not round-trip them all
+    'full_targets': 'table',
+    'trace': 'pickle',
+    'targets': 'table',
+    'arcec': 'fits_list',
+    'reduced_frame': 'fits',
+    'reduced_frames': 'fits_dict',
+    'spec2d_out': 'fits_list',
+    'spec2d_by_frame': 'fits_list_dict', # frame -> slitlets, from apply_geometry
+    'spec1d_out': 'fits_list',
+    'radius_summary': 'csv',
+}
+
+METADATA_FILE = 'session.json'
+
+
+def _read_fits_list(path, count):
+    return [dataclass.Data.read(os.path.join(path, f'{i:04d}.fits')) for i in range(count)]
+
+
+def _write_fits_list(path, images):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    for i, im in enumerate(images):
+        im.write(os.path.join(path, f'{i:04d}.fits'), overwrite=True)
+
+
+class Session:
+    """
+    Checkpoint directory for the in-memory state of a CofiPipeline.
+
+    Masters, reduced frames and slitlets are written as FITS (Data.write), the target
+    tables as ECSV, the traces as pickles and the Reducer as its folder/instrument;
+    session.json records what is saved, by which step and when. `loaders()` returns
+    one callable per saved piece, so a resumed pipeline reads only what it uses.
+    """
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        self.metadata = self._read_metadata()
+
+    def _read_metadata(self):
+        path = os.path.join(self.session_dir, METADATA_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'saved': {}, 'steps': []}
+
+    def _write_metadata(self):
+        path = os.path.join(self.session_dir, METADATA_FILE)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.metadata, f, indent=4)
+        os.replace(f'{path}.tmp', path)
+
+    def _path(self, name, kind):
+        extension = {'fits': '.fits', 'pickle': '.pkl', 'table': '.ecsv', 'csv': '.csv', 'reducer': ''}
+        return os.path.join(self.session_dir, name + extension.get(kind, ''))
+
+    def saved(self):
+        """Names of the saved pieces of state."""
+        return list(self.metadata['saved'])
+
+    def save(self, pipeline, names, step=None, frames=None):
+        """
+        Writes the named pipeline attributes. For 'reduced_frames' only the `frames`
+        keys are (re)written if given. Attributes that are None are dropped from the session.
+        """
+        os.makedirs(self.session_dir, exist_ok=True)
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        for name in names:
+            kind = SESSION_STATE[name]
+            value = getattr(pipeline, name)
+            if value is None or (kind == 'reducer' and not value):
+                self._remove(name)
+                continue
+            path = self._path(name, kind)
+            entry = {'kind': kind, 'step': step, 'time': now}
+            if kind == 'reducer':
+                entry.update(indir=value.dir, inst=pipeline.inst)
+            elif kind == 'fits':
+                value.write(path, overwrite=True)
+            elif kind == 'pickle':
+                with open(path, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            elif kind == 'table':
+                value.write(path, format='ascii.ecsv', overwrite=True)
+            elif kind == 'csv':
+                value.to_csv(path, index=False)
+            elif kind == 'fits_list':
+                _write_fits_list(path, value)
+                entry['count'] = len(value)
+            elif kind == 'fits_dict':
+                os.makedirs(path, exist_ok=True)
+                keys = dict(self.metadata['saved'].get(name, {}).get('keys', {}))
+                for key in (value if frames is None else frames):
+                    file = f'{os.path.basename(str(key))}.fits'
+                    value[key].write(os.path.join(path, file), overwrite=True)
+                    keys[file] = key
+                entry['keys'] = {file: key for file, key in keys.items() if key in value}
+            elif kind == 'fits_list_dict':
+                # one fits_list folder per key; like fits_dict, only the `frames` keys are rewritten
+                os.makedirs(path, exist_ok=True)
+                saved = self.metadata['saved'].get(name, {})
+                keys, counts = dict(saved.get('keys', {})), dict(saved.get('counts', {}))
+                for key in (value if frames is None else frames):
+                    folder = os.path.basename(str(key))
+                    _write_fits_list(os.path.join(path, folder), value[key])
+                    keys[folder], counts[folder] = key, len(value[key])
+                entry['keys'] = {folder: key for folder, key in keys.items() if key in value}
+                entry['counts'] = {folder: counts[folder] for folder in entry['keys']}
+            self.metadata['saved'][name] = entry
+        if step is not None:
+            self.metadata['steps'].append({'step': step, 'time': now})
+        self._write_metadata()
+
+    def _remove(self, name):
+        entry = self.metadata['saved'].pop(name, None)
+        if entry is None:
+            return
+        path = self._path(name, entry['kind'])
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def load(self, name):
+        """Reads one saved piece of state."""
+        entry = self.metadata['saved'][name]
+        kind = entry['kind']
+        path = self._path(name, kind)
+        if kind == 'reducer':
+            return imred.Reducer(entry['inst'], dir=entry['indir'])
+        if kind == 'fits':
+            return dataclass.Data.read(path)
+        if kind == 'pickle':
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        if kind == 'table':
+            return Table.read(path, format='ascii.ecsv')
+        if kind == 'csv':
+            return pd.read_csv(path)
+        if kind == 'fits_list':
+            return _read_fits_list(path, entry['count'])
+        if kind == 'fits_dict':
+            return {key: dataclass.Data.read(os.path.join(path, file)) for file, key in entry['keys'].items()}
+        if kind == 'fits_list_dict':
+            return {key: _read_fits_list(os.path.join(path, folder), entry['counts'][folder])
+                    for folder, key in entry['keys'].items()}
+        raise ValueError(f"Unknown session entry kind '{kind}' for {name}")
+
+    def loaders(self):
+        """name -> zero-argument callable reading it, for every saved piece of state."""
+        return {name: (lambda name=name: self.load(name)) for name in self.metadata['saved']}
+
+    def summary(self):
+        """Saved state as a DataFrame (name, kind, step, time)."""
+        return pd.DataFrame([dict(name=name, kind=entry['kind'], step=entry['step'], time=entry['time'])
+                             for name, entry in self.metadata['saved'].items()])
@@ -1,15 +1,19 @@
 import os
 import ast
-import json
+import inspect
+import textwrap
+import functools
 import numpy as np
-import copy
 import ipywidgets as widgets
 from IPython.display import display, clear_output
 import pandas as pd
-from pyvista import imred, tv, stars, slitmask, image, spectra
-from .processor import CofiProcessor
+from pyvista import tv, stars, image
+from .pipeline import CofiPipeline, parse_frames
 from .cofi_guide_widget import CofiGuideWidget
-from .log import CofiLogger
+from .log import CofiLogger, parse_log
+from .replay import bias_params, dark_params, flat_params
+from .classify import summarize_plans
+from .background import BackgroundRunner
 
 # --------------------------------------------------------------------
 # START OF CORRECTED SECTION
@@ -299,36 +303,186 @@ def get_srt_or_list(widget_value):
     else:
         return cleaned_value
 
+# Rows shown when ipydatagrid is not installed
+GRID_FALLBACK_ROWS = 50
+
+def show_table(table, grid=None, max_height=400):
+    """
+    Displays an astropy Table or DataFrame in an ipydatagrid DataGrid, which draws only
+    the visible rows and sorts/filters in the browser, instead of rendering every row as
+    HTML. `grid` (a DataGrid returned by an earlier call) is refilled rather than
+    recreated. Without ipydatagrid only the first rows are shown. Returns the grid.
+    """
+    df = table.to_pandas() if hasattr(table, 'to_pandas') else table
+    try:
+        from ipydatagrid import DataGrid
+    except ImportError:
+        print(f"ℹ️ Showing the first {min(len(df), GRID_FALLBACK_ROWS)} of {len(df)} rows. "
+              "Install the [gui] extra (ipydatagrid) for a scrollable, sortable grid.")
+        display(df.head(GRID_FALLBACK_ROWS))
+        return None
+    height = min(max_height, 24 * (len(df) + 1) + 20)
+    if grid is None:
+        grid = DataGrid(df, base_row_size=24, base_column_size=110, auto_fit_columns=True,
+                        selection_mode='cell', layout={'height': f'{height}px'})
+    else:
+        grid.data = df
+        grid.layout.height = f'{height}px'
+    display(grid)
+    return grid
+
+def _pipeline_attribute(name):
+    """Widget attribute that reads and writes the matching CofiPipeline state."""
+    return property(lambda self: getattr(self.pipeline, name),
+                    lambda self, value: setattr(self.pipeline, name, value))
+
+@functools.lru_cache(maxsize=None)
+def _widget_sections(cls):
+    """Widget name -> section, from the self.<name> assignments in each _create_<section>_widgets."""
+    sections = {}
+    for section in cls.WIDGET_SECTIONS:
+        source = textwrap.dedent(inspect.getsource(getattr(cls, f'_create_{section}_widgets')))
+        for node in ast.walk(ast.parse(source)):
+            if (isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store)
+                    and isinstance(node.value, ast.Name) and node.value.id == 'self'):
+                sections.setdefault(node.attr, section)
+    return sections
+
+def _lazy_pages(container_class, pages):
+    """
+    Tab or Accordion of (title, builder) pages. Page i starts empty and is filled with
+    builder() the first time it is selected, so unopened pages are never created or rendered.
+    Accordions start collapsed.
+    """
+    boxes = [widgets.VBox([]) for _ in pages]
+    container = container_class(children=boxes)
+    for i, (title, _) in enumerate(pages):
+        container.set_title(i, title)
+
+    def build(index):
+        if index is not None and not boxes[index].children:
+            boxes[index].children = [pages[index][1]()]
+
+    container.observe(lambda change: build(change['new']), names='selected_index')
+    if container_class is widgets.Accordion:
+        container.selected_index = None
+    build(container.selected_index)
+    return container
+
 class CofiReductionWidget:
-    def __init__(self, display_enabled=True):
+    # Reduction state lives on the headless pipeline; the widget only forwards it
+    red = _pipeline_attribute('red')
+    bias_frame = _pipeline_attribute('bias_frame')
+    dark_frame = _pipeline_attribute('dark_frame')
+    flat_frame = _pipeline_attribute('flat_frame')
+    arcs_frame = _pipeline_attribute('arcs_frame')
+    trace = _pipeline_attribute('trace')
+    targets = _pipeline_attribute('targets')
+    reduced_frame = _pipeline_attribute('reduced_frame')
+    spec2d_out = _pipeline_attribute('spec2d_out')
+    spec1d_out = _pipeline_attribute('spec1d_out')
+    arcec = _pipeline_attribute('arcec')
+    full_trace = _pipeline_attribute('full_trace')
+    full_targets = _pipeline_attribute('full_targets')
+
+    # Per-tab input widgets, created on first use (see __getattr__) in this order
+    WIDGET_SECTIONS = ('data', 'calibration', 'slits', 'reduce', 'wavecal', 'extract2d', 'extract1d')
+
+    # Button -> handler, attached when the button's section is created
+    BUTTON_HANDLERS = {
+        'read_folder_button': '_read_folder_handler',
+        'propose_frames_button': '_propose_frames_handler',
+        'compute_bias_button': '_compute_bias_handler',
+        'compute_dark_button': '_compute_dark_handler',
+        'compute_flat_button': '_compute_flat_handler',
+        'compute_arcs_button': '_compute_arcs_handler',
+        'build_calibrations_button': '_build_calibrations_handler',
+        'find_slits_button': '_find_slits_handler',
+        'update_headers_button': '_update_headers_handler',
+        'filter_slits_button': '_filter_slits_handler',
+        'reset_filter_button': '_reset_filter_handler',
+        'reduce_button': '_reduce_science_handler',
+        'run_wave_cal_button': '_run_wave_cal_handler',
+        'run_shift_check_button': '_run_shift_check_handler',
+        'start_extract2d_button': '_start_extract2d_handler',
+        'start_extract1d_button': '_start_extract1d_handler',
+        'load_log_button': '_load_log_handler',
+        'resume_session_button': '_resume_session_handler',
+    }
+
+    def __init__(self, display_enabled=True, pipeline=None):
+        """
+        display_enabled turns the pyvista TV display on; it is only opened when
+        something is displayed. `pipeline` attaches the widget to an existing
+        CofiPipeline (the reduction state, which needs no UI at all).
+        """
         load_style()
         self.display_enabled = display_enabled
-        self.tv = tv.TV() if self.display_enabled else None
+        self._tv = None
+        self._built_sections = set()
         self.guide_widget = CofiGuideWidget()
-        self.processor = CofiProcessor(display_1=self.tv)
-
-        # Internal state attributes
-        self.red = None
-        self.bias_frame = None
-        self.dark_frame = None
-        self.flat_frame = None
-        self.arcs_frame = None
-        self.trace = None
-        self.targets = None
-        self.reduced_frame = None
-        self.spec2d_out = None
-        self.spec1d_out = None
-        self.arcec = None
-        self.full_trace = None
-        self.full_targets = None
+        self.pipeline = pipeline if pipeline is not None else CofiPipeline()
+        self.processor = self.pipeline.processor
 
         self._create_widgets()
         self._setup_ui()
-        self.logger = CofiLogger()
-        self._attach_handlers()
+        self.logger = self.pipeline.logger or CofiLogger()
+        self.pipeline.logger = self.logger
         self.widget_map = None
+        self.proposed_plans = {} # mask -> plan, from 'Propose Frames from Headers'
+        self.log_grid = None # data grids reused by show_table
+        self.targets_grid = None
+
+    @property
+    def tv(self):
+        """pyvista TV display, opened on first use and shared with the pipeline (None if disabled)."""
+        if self._tv is None and self.display_enabled:
+            self._tv = tv.TV()
+            self.pipeline.display = self._tv
+            self.processor.display = self._tv
+        return self._tv
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set yet (e.g. a handler or the log loader reading
+        # a tab that was never opened): create just the section that defines `name`
+        section = _widget_sections(type(self)).get(name)
+        if section is not None and '_built_sections' in self.__dict__ and section not in self._built_sections:
+            self._build_section(section)
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def _build_section(self, section):
+        """Creates the input widgets of one section (once) and attaches its button handlers."""
+        if section in self._built_sections:
+            return
+        self._built_sections.add(section)
+        existing = set(self.__dict__)
+        getattr(self, f'_create_{section}_widgets')()
+        for button, handler in self.BUTTON_HANDLERS.items():
+            if button in self.__dict__ and button not in existing:
+                self.__dict__[button].on_click(getattr(self, handler))
 
     def _create_widgets(self):
+        """Widgets every tab shares. The per-tab input widgets are created by _build_section."""
+        # --- Output & Interactive Areas ---
+        self.output_area = widgets.Output(layout={'border': '1px solid #ccc', 'padding': '10px', 'min_height': 'auto'})
+        self.output_area.add_class('custom-output-area')
+        # Long steps (flat, reduce, wave cal, all calibrations) run here with a progress bar and Cancel
+        self.runner = BackgroundRunner(output=self.output_area)
+        
+        self.processor_2d_control_area = widgets.VBox([], layout={'padding': '5px'})
+        self.processor_2d_feedback_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
+        self.processor_2d_output_area = widgets.Output(layout={'border': '1px solid #ace', 'padding': '10px', 'min_height':'auto'})
+        self.processor_2d_output_area.add_class('interactive-processor-area')
+        
+        self.processor_1d_control_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
+        self.processor_1d_feedback_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
+        self.processor_1d_log_area = widgets.Output(layout={'border': '1px solid #aec', 'padding': '10px', 'min_height':'auto'})
+        self.processor_1d_log_area.add_class('interactive-processor-area')
+
+    def _create_data_widgets(self):
+        """Data Input tab: folder, log loader and session widgets."""
         # --- Main Data Input ---
         self.folder_path_input = widgets.Text(placeholder='e.g., UT230909', description='Folder Path:',style={'description_width': 'initial'},
                                                 layout= custom_input_layout)
@@ -336,9 +490,12 @@ class CofiReductionWidget:
                                                 layout= custom_input_layout)
         self.read_folder_button = widgets.Button(description='Read Folder', icon='folder-open',style={'description_width': 'initial'},
                                                 layout= custom_input_layout)
+        self.propose_frames_button = widgets.Button(description='Propose Frames from Headers', icon='magic',
+                                                    style={'description_width': 'initial'}, layout=custom_input_layout)
         self.folder_path_input.add_class('cofi-input-widget')
         self.log_file_input.add_class('cofi-input-widget')
         self.read_folder_button.add_class('custom-button')
+        self.propose_frames_button.add_class('custom-button')
 
         # --- Log File Loader ---
         self.log_uploader = widgets.FileUpload(
@@ -356,8 +513,21 @@ class CofiReductionWidget:
         )
         self.log_uploader.add_class('cofi-input-widget')
         self.load_log_button.add_class('custom-button')
-        
 
+        # --- Session Checkpoints ---
+        self.session_checkbox = widgets.Checkbox(value=True, description='Checkpoint session (<log file name>_session)',
+                                                 style={'description_width': 'initial'}, layout=custom_input_layout)
+        self.resume_session_button = widgets.Button(
+            description='Resume Session',
+            icon='history',
+            style={'description_width': 'initial'},
+            layout=custom_input_layout
+        )
+        self.session_checkbox.add_class('cofi-input-widget')
+        self.resume_session_button.add_class('custom-button')
+
+    def _create_calibration_widgets(self):
+        """Calibration tabs: bias, dark, flat, arcs and build-all widgets."""
         # --- Calibration: Bias ---
         self.bias_files_input = widgets.Text(placeholder='e.g., 74,75,76', description='Bias Frames:',
                                             style={'description_width': 'initial'},layout= custom_input_layout)
@@ -446,6 +616,17 @@ class CofiReductionWidget:
         self.compute_arcs_button.add_class('custom-button')
         self.compute_arcs_button.add_class('run-button')
 
+        # --- Calibration: All at once ---
+        self.calib_workers_input = widgets.IntText(value=4, description='Parallel workers:',
+                                                   style={'description_width': 'initial'},layout= custom_input_layout)
+        self.build_calibrations_button = widgets.Button(description='Build All Calibrations', icon='cogs',style={'description_width': 'initial'},
+                                                        layout= custom_input_layout)
+        self.calib_workers_input.add_class('cofi-input-widget')
+        self.build_calibrations_button.add_class('custom-button')
+        self.build_calibrations_button.add_class('run-button')
+
+    def _create_slits_widgets(self):
+        """Slits & Targets tabs: find and filter slits widgets."""
         # --- Slits & Targets: Find Slits ---
         self.slit_flat_file_input = widgets.Text(placeholder='e.g., 21', description='Flat Frame for Slits:',
                                                 style={'description_width': 'initial'},layout= custom_input_layout)
@@ -493,8 +674,10 @@ class CofiReductionWidget:
         self.filter_slits_button.add_class('custom-button')
         self.reset_filter_button.add_class('custom-button')
 
+    def _create_reduce_widgets(self):
+        """Reduce tab widgets."""
         # --- Science: Reduce ---
-        self.science_file_input = widgets.Text(placeholder='e.g., 20', description='Science Frame:',
+        self.science_file_input = widgets.Text(placeholder='e.g., 20 or 7,8,9 or 7-9', description='Science Frame(s):',
                                               style={'description_width': 'initial'},layout= custom_input_layout)
         self.reduce_crbox_input = widgets.Text(value='lacosmic', description='Cosmic Ray Algo:', style={'description_width': 'initial'},layout= custom_input_layout)
         self.reduce_crsig_input = widgets.FloatText(value=5.0, description='CR Sigma (lacosmic):',
@@ -515,6 +698,9 @@ class CofiReductionWidget:
         
         self.reduce_seeing_input = widgets.FloatText(value=2.0, description='Seeing (for solve):',style={'description_width': 'initial'},layout= custom_input_layout)
         self.reduce_solve_checkbox = widgets.Checkbox(value=False, description='Attempt Plate Solve')
+        self.reduce_workers_input = widgets.IntText(value=1, description='Parallel workers (several frames):',
+                                                    style={'description_width': 'initial'},layout= custom_input_layout)
+        self.reduce_write_checkbox = widgets.Checkbox(value=False, description='Write reduced frames to disk')
         self.reduce_button = widgets.Button(description='Reduce Science Frame', icon='rocket',style={'description_width': 'initial'},
                                            layout= custom_input_layout)
         self.science_file_input.add_class('cofi-input-widget')
@@ -534,9 +720,13 @@ class CofiReductionWidget:
         self.reduce_appy_flat_checkbox.add_class('cofi-input-widget')
         self.reduce_seeing_input.add_class('cofi-input-widget')
         self.reduce_solve_checkbox.add_class('cofi-input-widget')
+        self.reduce_workers_input.add_class('cofi-input-widget')
+        self.reduce_write_checkbox.add_class('cofi-input-widget')
         self.reduce_button.add_class('custom-button')
         self.reduce_button.add_class('run-button')
 
+    def _create_wavecal_widgets(self):
+        """Wave Cal tab widgets."""
         # --- Science: Wave Calibration ---
         self.wavecal_clobber_checkbox = widgets.Checkbox(value=False, description='Recalibrate (Clobber)')
         self.wavecal_lamp_spec_input = widgets.Text(value='KOSMOS/KOSMOS_red_waves.fits', description='Lamp Spec File (ref):',style={'description_width': 'initial'},layout= custom_input_layout)
@@ -631,7 +821,9 @@ class CofiReductionWidget:
         self.run_wave_cal_button.add_class('custom-button')
         self.run_wave_cal_button.add_class('run-button')
         self.run_shift_check_button.add_class('custom-button')
-        
+
+    def _create_extract2d_widgets(self):
+        """2D Extract tab widgets."""
         # --- Science: 2D Extraction ---
         self.start_extract2d_button = widgets.Button(description='Setup & Run 2D Extraction', icon='layer-group',style={'description_width': 'initial'},layout= custom_input_layout)
         self.start_extract2d_button.add_class('custom-button')
@@ -747,6 +939,8 @@ class CofiReductionWidget:
         self.extract2d_buffer_input.add_class('cofi-input-widget')
         self._2d_flat_field_checkbox.add_class('cofi-input-widget')
 
+    def _create_extract1d_widgets(self):
+        """1D Extract tab widgets."""
         # --- Science: 1D Extraction ---
         self.start_extract1d_button = widgets.Button(description='Setup & Run 1D Extraction', icon='chart-bar',style={'description_width': 'initial'},layout= custom_input_layout)
         self.start_extract1d_button.add_class('custom-button')
@@ -897,122 +1091,139 @@ class CofiReductionWidget:
         self.extract1d_skyline_inter_checkbox.add_class('cofi-input-widget')
         self.extract1d_skyline_plot_checkbox.add_class('cofi-input-widget')
 
-        # --- Output & Interactive Areas ---
-        self.output_area = widgets.Output(layout={'border': '1px solid #ccc', 'padding': '10px', 'min_height': 'auto'})
-        self.output_area.add_class('custom-output-area')
-        
-        self.processor_2d_control_area = widgets.VBox([], layout={'padding': '5px'})
-        self.processor_2d_feedback_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
-        self.processor_2d_output_area = widgets.Output(layout={'border': '1px solid #ace', 'padding': '10px', 'min_height':'auto'})
-        self.processor_2d_output_area.add_class('interactive-processor-area')
-        
-        self.processor_1d_control_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
-        self.processor_1d_feedback_area = widgets.VBox([], layout=widgets.Layout(padding='5px', align_items='center'))
-        self.processor_1d_log_area = widgets.Output(layout={'border': '1px solid #aec', 'padding': '10px', 'min_height':'auto'})
-        self.processor_1d_log_area.add_class('interactive-processor-area')
-    
     def _setup_ui(self):
-        # --- Calibration Sub-tabs with Advanced Accordions ---
+        # Every tab page and 'Advanced' accordion is built the first time it is opened
+        # (see _lazy_pages), which also creates its input widgets
+        # --- Main Tabs ---
+        main_tabs = _lazy_pages(widgets.Tab, [
+            ("📖 User Guide", self._guide_tab), ("📁 Data Input", self._data_input_tab),
+            ("⚙️ Calibration", lambda: _lazy_pages(widgets.Tab, [
+                ('Bias', self._bias_tab), ('Dark', self._dark_tab), ('Flat', self._flat_tab),
+                ('Arcs', self._arcs_tab), ('All', self._all_calibrations_tab)])),
+            ("🔎 Slits & Targets", lambda: _lazy_pages(widgets.Tab, [
+                ('Find Slits', self._find_slits_tab), ('Filter Targets', self._filter_slits_tab)])),
+            ("🔬 Science & Extract", lambda: _lazy_pages(widgets.Tab, [
+                ('Wave Cal', self._wave_cal_tab), ('Reduce', self._reduce_tab),
+                ('2D Extract', self._extract2d_tab), ('1D Extract', self._extract1d_tab)]))])
+
+        self.full_ui = widgets.VBox([widgets.HTML("<h1 class='cofi-main-title'>CofI Reduction Interface</h1>"), main_tabs, self.runner.widget, self.output_area])
+
+    # --- Tab pages (built on first open) ---
+
+    def _guide_tab(self):
+        tab6_content = self.guide_widget.display()
+        tab6_content.add_class('cofi-guide-container')
+        return tab6_content
 
-        # 1. Bias Tab
-        bias_advanced_box = widgets.VBox([
+    def _data_input_tab(self):
+        self._build_section('data')
+        return widgets.VBox([
+            widgets.HTML("<h3 class='sub-tab-title'>Load Observation Data</h3>"),
+            self.folder_path_input, 
+            self.log_file_input,
+            self.session_checkbox,
+            self.read_folder_button,
+            self.propose_frames_button,
+            widgets.HTML("<hr>"), # Visual separator
+            widgets.HTML("<h3 class='sub-tab-title'>Load Settings from Log</h3>"),
+            self.log_uploader,
+            self.load_log_button,
+            widgets.HTML("<hr>"),
+            widgets.HTML("<h3 class='sub-tab-title'>Resume Session</h3>"),
+            self.resume_session_button
+        ])
+
+    def _bias_tab(self):
+        self._build_section('calibration')
+        bias_accordion = _lazy_pages(widgets.Accordion, [('Advanced Parameters', lambda: widgets.VBox([
             self.bias_type_dropdown, self.bias_sigreject_input,
             self.bias_display, self.bias_trim_checkbox
-        ])
-        bias_accordion = widgets.Accordion(children=[bias_advanced_box])
-        bias_accordion.set_title(0, 'Advanced Parameters')
-        bias_accordion.selected_index = None # Collapsed by default
-        bias_tab_content = widgets.VBox([
+        ]))])
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Compute Master Bias</h3>"),
             self.bias_files_input,
             bias_accordion,
             self.compute_bias_button
         ])
 
-        # 2. Dark Tab
-        dark_advanced_box = widgets.VBox([
+    def _dark_tab(self):
+        self._build_section('calibration')
+        dark_accordion = _lazy_pages(widgets.Accordion, [('Advanced Parameters', lambda: widgets.VBox([
             self.dark_type_dropdown, self.dark_sigreject_input, self.dark_clip_input,
             self.apply_dark_bias_checkbox, self.dark_display, self.dark_trim_checkbox
-        ])
-        dark_accordion = widgets.Accordion(children=[dark_advanced_box])
-        dark_accordion.set_title(0, 'Advanced Parameters')
-        dark_accordion.selected_index = None
-        dark_tab_content = widgets.VBox([
+        ]))])
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Compute Master Dark</h3>"),
             self.dark_files_input,
             dark_accordion,
             self.compute_dark_button
         ])
 
-        # 3. Flat Tab
-        flat_advanced_box = widgets.VBox([
+    def _flat_tab(self):
+        self._build_section('calibration')
+        flat_accordion = _lazy_pages(widgets.Accordion, [('Advanced Parameters', lambda: widgets.VBox([
             self.flat_type_dropdown, self.flat_sigreject_input, self.flat_spec_checkbox,
             self.flat_width_input, self.flat_normalize_checkbox, self.flat_snmin_input,
             self.apply_bias_checkbox , self.apply_dark_checkbox, self.flat_display,
             self.flat_littrow_checkbox, self.flat_trim_checkbox
-        ])
-        flat_accordion = widgets.Accordion(children=[flat_advanced_box])
-        flat_accordion.set_title(0, 'Advanced Parameters')
-        flat_accordion.selected_index = None
-        flat_tab_content = widgets.VBox([
+        ]))])
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Compute Master Flat</h3>"),
             self.flat_files_input,
             flat_accordion,
             self.compute_flat_button
         ])
 
-        # 4. Arcs Tab (No changes needed here)
-        arcs_tab_content = widgets.VBox([
+    def _arcs_tab(self):
+        self._build_section('calibration')
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Compute Master Arcs</h3>"),
             self.arc_files_input,
             self.compute_arcs_button
         ])
-        
-        calibration_sub_tabs = widgets.Tab(children=[bias_tab_content, dark_tab_content, flat_tab_content, arcs_tab_content])
-        calibration_sub_tabs.set_title(0, 'Bias'); calibration_sub_tabs.set_title(1, 'Dark'); calibration_sub_tabs.set_title(2, 'Flat'); calibration_sub_tabs.set_title(3, 'Arcs')
 
-        # --- Slits & Targets Sub-tabs with Advanced Accordions ---
-        
-        # 5. Find Slits Tab
-        find_slits_advanced_box = widgets.VBox([
+    def _all_calibrations_tab(self):
+        self._build_section('calibration')
+        return widgets.VBox([
+            widgets.HTML("<h3 class='sub-tab-title'>Build All Calibrations</h3>"),
+            widgets.HTML("Uses the frames and settings of the Bias, Dark, Flat and Arcs tabs and the "
+                         "'Flat Frame for Slits'. Independent masters are built at the same time."),
+            self.calib_workers_input,
+            self.build_calibrations_button
+        ])
+
+    def _find_slits_tab(self):
+        self._build_section('slits')
+        find_slits_accordion = _lazy_pages(widgets.Accordion, [('Advanced Parameters', lambda: widgets.VBox([
             self.findslits_smooth_input, self.findslits_degree_input,
             self.findslits_skip_input, self.findslits_cent_input
-        ])
-        find_slits_accordion = widgets.Accordion(children=[find_slits_advanced_box])
-        find_slits_accordion.set_title(0, 'Advanced Parameters')
-        find_slits_accordion.selected_index = None
+        ]))])
         find_slits_box = widgets.VBox([
             self.slit_flat_file_input, self.kms_file_input,
             self.findslits_thresh_input, self.findslits_sn_checkbox,
             find_slits_accordion, self.find_slits_button
         ])
+        return widgets.VBox([widgets.HTML("<h3 class='sub-tab-title'>Find Slits/Targets</h3>"), find_slits_box])
 
+    def _filter_slits_tab(self):
+        self._build_section('slits')
         filter_slits_box = widgets.VBox([
             self.filter_method_dropdown, self.filter_values_input,
             widgets.HBox([self.filter_slits_button, self.update_headers_button, self.reset_filter_button])
         ])
-        
-        slits_targets_sub_tabs = widgets.Tab(children=[
-            widgets.VBox([widgets.HTML("<h3 class='sub-tab-title'>Find Slits/Targets</h3>"), find_slits_box]),
-            widgets.VBox([widgets.HTML("<h3 class='sub-tab-title'>Filter Slits & Update Headers</h3>"), filter_slits_box])
-        ])
-        slits_targets_sub_tabs.set_title(0, 'Find Slits'); slits_targets_sub_tabs.set_title(1, 'Filter Targets')
-
-        # --- Science & Extraction Sub-tabs with Advanced Accordions ---
+        return widgets.VBox([widgets.HTML("<h3 class='sub-tab-title'>Filter Slits & Update Headers</h3>"), filter_slits_box])
 
-        # 6. Reduce Tab
-        reduce_advanced_box = widgets.VBox([
+    def _reduce_tab(self):
+        self._build_section('reduce')
+        reduce_accordion = _lazy_pages(widgets.Accordion, [('Advanced Parameters', lambda: widgets.VBox([
             #self.use_calibrations_checkbox
             self.reduce_appy_bias_checkbox,self.reduce_appy_dark_checkbox,self.reduce_appy_flat_checkbox, 
             self.reduce_seeing_input, self.reduce_solve_checkbox,
             self.reduce_channel_input, self.reduce_scat_input, self.reduce_badpix_input,
             self.reduce_trim_checkbox, self.reduce_sigfrac_input, self.reduce_ext_input,
-            self.reduce_utr_checkbox
-        ])
-        reduce_accordion = widgets.Accordion(children=[reduce_advanced_box])
-        reduce_accordion.set_title(0, 'Advanced Parameters')
-        reduce_accordion.selected_index = None
-        reduce_tab_content = widgets.VBox([
+            self.reduce_utr_checkbox, self.reduce_workers_input, self.reduce_write_checkbox
+        ]))])
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Reduce Science Frame</h3>"),
             self.science_file_input, self.reduce_crbox_input,
             self.reduce_crsig_input, self.reduce_objlim_input,
@@ -1020,8 +1231,8 @@ class CofiReductionWidget:
             self.reduce_button
         ])
 
-        # --- The rest of the UI setup remains the same ---
-
+    def _wave_cal_tab(self):
+        self._build_section('wavecal')
         # Group the main, frequently used wavelength calibration widgets
         main_wave_cal_box = widgets.VBox([
             self.wavecal_clobber_checkbox,
@@ -1038,7 +1249,7 @@ class CofiReductionWidget:
         ])
         
         # Group the advanced/optional identify() parameters in a separate box
-        advanced_id_params_box = widgets.VBox([
+        advanced_id_params_box = lambda: widgets.VBox([
             self.wavecal_id_maxshift_input,
             self.wavecal_id_disp_input,
             self.wavecal_id_sample_input,
@@ -1071,20 +1282,20 @@ class CofiReductionWidget:
         ])
         
         # Use an accordion to make the advanced options collapsible
-        advanced_options_accordion = widgets.Accordion(children=[advanced_id_params_box])
-        advanced_options_accordion.set_title(0, 'Advanced Identify Parameters')
-        advanced_options_accordion.selected_index = None # Start with it collapsed
+        advanced_options_accordion = _lazy_pages(widgets.Accordion, [('Advanced Identify Parameters', advanced_id_params_box)])
         
         # Combine all components into the final tab layout
-        wave_cal_tab_content = widgets.VBox([
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>Wavelength Calibration</h3>"),
             main_wave_cal_box,
             advanced_options_accordion, # Add the collapsible section
             widgets.HBox([self.run_shift_check_button,self.run_wave_cal_button])
         ])
-        
-        # --- Create VBoxes for each parameter group for the Accordion ---
-        trace_params_vbox = widgets.VBox([
+
+    def _extract2d_tab(self):
+        self._build_section('extract2d')
+        # --- One VBox per parameter group of the Accordion ---
+        trace_params_vbox = lambda: widgets.VBox([
             self.extract2d_trace_degree_input, self.extract2d_trace_sigdegree_input,
             self.extract2d_trace_type_input, self.extract2d_trace_rad_input,
             self.extract2d_trace_lags_input, self.extract2d_trace_pix0_input,
@@ -1094,7 +1305,7 @@ class CofiReductionWidget:
             self.extract2d_trace_model_input,
             self.extract2d_trace_hdu_input, self.extract2d_trace_transpose_checkbox
         ])
-        findpeak_params_vbox = widgets.VBox([
+        findpeak_params_vbox = lambda: widgets.VBox([
             self.extract2d_findpeak_thresh_input, self.extract2d_findpeak_backperc_input,
             self.extract2d_findpeak_width_input, self.extract2d_findpeak_smooth_input,
             self.extract2d_findpeak_sc0_input, self.extract2d_findpeak_method_input,
@@ -1102,25 +1313,20 @@ class CofiReductionWidget:
             self.extract2d_findpeak_sort_checkbox, self.extract2d_findpeak_verbose_checkbox,
             self.extract2d_findpeak_plot_checkbox,
         ])
-        skyline_params_vbox = widgets.VBox([
+        skyline_params_vbox = lambda: widgets.VBox([
             self.extract2d_skyline_thresh_input,
             self.extract2d_skyline_file_input, self.extract2d_skyline_rows_input,
             self.extract2d_skyline_linear_checkbox, self.extract2d_skyline_inter_checkbox,
             self.extract2d_skyline_obj_rad_input,self.extract2d_correcting_value_input,
         ])
-        extract_params_vbox = widgets.VBox([
+        extract_params_vbox = lambda: widgets.VBox([
             self.extract2d_rows_input, self.extract2d_buffer_input,self._2d_flat_field_checkbox
         ])
         
-        # --- Create the Accordion to hold the parameter groups ---
-        params_accordion = widgets.Accordion(children=[
-            trace_params_vbox, findpeak_params_vbox, skyline_params_vbox, extract_params_vbox
-        ])
-        params_accordion.set_title(0, 'Trace Parameters')
-        params_accordion.set_title(1, 'FindPeak Parameters')
-        params_accordion.set_title(2, 'Skyline Parameters')
-        params_accordion.set_title(3, 'Extraction Parameters')
-        params_accordion.selected_index = None # Start collapsed
+        # --- The Accordion holding the parameter groups ---
+        params_accordion = _lazy_pages(widgets.Accordion, [
+            ('Trace Parameters', trace_params_vbox), ('FindPeak Parameters', findpeak_params_vbox),
+            ('Skyline Parameters', skyline_params_vbox), ('Extraction Parameters', extract_params_vbox)])
         
         # --- Define the main box for default parameters ---
         extract2d_params_box = widgets.VBox([
@@ -1129,7 +1335,7 @@ class CofiReductionWidget:
         ])
         
         # --- Define the final layout for the 2D extraction tab ---
-        extract2d_tab_content = widgets.VBox([
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>2D Spectral Extraction</h3>"),
             extract2d_params_box,
             self.start_extract2d_button,
@@ -1138,8 +1344,10 @@ class CofiReductionWidget:
             widgets.HTML("<h4>Log / Output (from processor):</h4>"), self.processor_2d_output_area
         ])
 
-        # --- Create VBoxes for each parameter group for the 1D Accordion ---
-        extract1d_main_vbox = widgets.VBox([
+    def _extract1d_tab(self):
+        self._build_section('extract1d')
+        # --- One VBox per parameter group of the 1D Accordion ---
+        extract1d_main_vbox = lambda: widgets.VBox([
             # self.extract1d_plot_spectra_checkbox, 
             # self.extract1d_back_input,
             self.extract1d_fit_checkbox,
@@ -1147,7 +1355,7 @@ class CofiReductionWidget:
             self.extract1d_nout_input, self.extract1d_threads_input,
             # self.extract1d_sky_width_input,
         ])
-        trace_class_vbox = widgets.VBox([
+        trace_class_vbox = lambda: widgets.VBox([
             self.extract1d_trace_degree_input, self.extract1d_trace_sigdegree_input,
             self.extract1d_trace_class_lags_input, self.extract1d_trace_class_type_input,
             self.extract1d_trace_class_rad_input, self.extract1d_trace_class_pix0_input,
@@ -1157,7 +1365,7 @@ class CofiReductionWidget:
             self.extract1d_trace_class_model_input,self.extract1d_trace_class_spectrum_input,
             self.extract1d_trace_class_transpose_checkbox
         ])
-        findpeak1d_vbox = widgets.VBox([
+        findpeak1d_vbox = lambda: widgets.VBox([
             self.extract1d_findpeak_thresh_input, self.extract1d_findpeak_backperc_input,
             self.extract1d_findpeak_width_input, self.extract1d_findpeak_method_input,
             self.extract1d_findpeak_smooth_input, self.extract1d_findpeak_sc0_input,
@@ -1165,28 +1373,23 @@ class CofiReductionWidget:
             self.extract1d_findpeak_sort_checkbox, self.extract1d_findpeak_verbose_checkbox,
             self.extract1d_findpeak_plot_checkbox
         ])
-        trace_method_vbox = widgets.VBox([
+        trace_method_vbox = lambda: widgets.VBox([
             self.extract1d_trace_skip_input, self.extract1d_trace_method_rad_input,
             self.extract1d_trace_method_thresh_input, self.extract1d_trace_method_sc0_input,
             self.extract1d_trace_method_srows_input, self.extract1d_trace_method_index_input, 
             self.extract1d_trace_method_gaussian_checkbox, self.extract1d_trace_method_verbose_checkbox
         ])
-        skyline1d_vbox = widgets.VBox([
+        skyline1d_vbox = lambda: widgets.VBox([
             self.extract1d_skyline_thresh_input, self.extract1d_skyline_file_input,
             self.extract1d_skyline_rows_input, self.extract1d_skyline_linear_checkbox,
             self.extract1d_skyline_inter_checkbox,self.extract1d_skyline_plot_checkbox
         ])
         
-        # --- Create the Accordion to hold the parameter groups ---
-        params1d_accordion = widgets.Accordion(children=[
-            extract1d_main_vbox, trace_class_vbox, findpeak1d_vbox, trace_method_vbox, skyline1d_vbox
-        ])
-        params1d_accordion.set_title(0, 'Extraction & Plotting')
-        params1d_accordion.set_title(1, 'Trace Class Parameters')
-        params1d_accordion.set_title(2, 'FindPeak Parameters')
-        params1d_accordion.set_title(3, 'Trace Method Parameters')
-        params1d_accordion.set_title(4, 'Skyline Parameters')
-        params1d_accordion.selected_index = None # Start collapsed
+        # --- The Accordion holding the parameter groups ---
+        params1d_accordion = _lazy_pages(widgets.Accordion, [
+            ('Extraction & Plotting', extract1d_main_vbox), ('Trace Class Parameters', trace_class_vbox),
+            ('FindPeak Parameters', findpeak1d_vbox), ('Trace Method Parameters', trace_method_vbox),
+            ('Skyline Parameters', skyline1d_vbox)])
         
         # --- Define the main box for default parameters ---
         extract1d_params_box = widgets.VBox([
@@ -1195,7 +1398,7 @@ class CofiReductionWidget:
         ])
         
         # --- Define the final layout for the 1D extraction tab ---
-        extract1d_tab_content = widgets.VBox([
+        return widgets.VBox([
             widgets.HTML("<h3 class='sub-tab-title'>1D Spectral Extraction</h3>"),
             extract1d_params_box,
             self.start_extract1d_button,
@@ -1203,48 +1406,6 @@ class CofiReductionWidget:
             widgets.HTML("<h4>Feedback Prompt (from processor):</h4>"), self.processor_1d_feedback_area,
             widgets.HTML("<h4>Log / Output (from processor):</h4>"), self.processor_1d_log_area
         ])
-        
-        science_sub_tabs = widgets.Tab(children=[ wave_cal_tab_content, reduce_tab_content, extract2d_tab_content, extract1d_tab_content])
-        science_sub_tabs.set_title(0, 'Wave Cal'); science_sub_tabs.set_title(1, 'Reduce'); science_sub_tabs.set_title(2, '2D Extract'); science_sub_tabs.set_title(3, '1D Extract')
-
-        # --- Main Tabs ---
-        tab6_content = self.guide_widget.display()
-        tab6_content.add_class('cofi-guide-container')
-        # data_input_tab_content = widgets.VBox([self.folder_path_input, self.log_file_input, self.read_folder_button])
-
-        data_input_tab_content = widgets.VBox([
-            widgets.HTML("<h3 class='sub-tab-title'>Load Observation Data</h3>"),
-            self.folder_path_input, 
-            self.log_file_input,
-            self.read_folder_button,
-            widgets.HTML("<hr>"), # Visual separator
-            widgets.HTML("<h3 class='sub-tab-title'>Load Settings from Log</h3>"),
-            self.log_uploader,
-            self.load_log_button
-        ])
-        
-        main_tabs = widgets.Tab(children=[tab6_content, data_input_tab_content, calibration_sub_tabs, slits_targets_sub_tabs, science_sub_tabs])
-        main_tabs.set_title(0,  "📖 User Guide"); main_tabs.set_title(1, "📁 Data Input"); main_tabs.set_title(2, "⚙️ Calibration"); main_tabs.set_title(3, "🔎 Slits & Targets"); main_tabs.set_title(4, "🔬 Science & Extract")
-
-        self.full_ui = widgets.VBox([widgets.HTML("<h1 class='cofi-main-title'>CofI Reduction Interface</h1>"), main_tabs, self.output_area])
-
-    def _attach_handlers(self):
-        self.read_folder_button.on_click(self._read_folder_handler)
-        self.compute_bias_button.on_click(self._compute_bias_handler)
-        self.compute_dark_button.on_click(self._compute_dark_handler)
-        self.compute_flat_button.on_click(self._compute_flat_handler)
-        self.compute_arcs_button.on_click(self._compute_arcs_handler)
-        self.find_slits_button.on_click(self._find_slits_handler)
-        self.update_headers_button.on_click(self._update_headers_handler)
-        self.filter_slits_button.on_click(self._filter_slits_handler)
-        self.reset_filter_button.on_click(self._reset_filter_handler) # Attach reset handler
-        self.reduce_button.on_click(self._reduce_science_handler)
-        self.run_wave_cal_button.on_click(self._run_wave_cal_handler)
-        self.run_shift_check_button.on_click(self._run_shift_check_handler)
-        self.start_extract2d_button.on_click(self._start_extract2d_handler) # New handler
-        self.start_extract1d_button.on_click(self._start_extract1d_handler) # New handler
-        # In CofiReductionWidget1._attach_handlers
-        self.load_log_button.on_click(self._load_log_handler)
 
     def show(self):
         display(self.full_ui)
@@ -1273,21 +1434,117 @@ class CofiReductionWidget:
             params = {'folder_path': indir}
             self.logger.log_action("Data Input", "Read Folder", params)
             try:
-                self.red = imred.Reducer('KOSMOS', dir=indir) # KOSMOS is instrument default
+                if self.session_checkbox.value:
+                    self.pipeline.start_session(self._session_dir())
+                self.pipeline.read_folder(indir) # KOSMOS is instrument default
                 print(f"✅ Reducer initialized for folder: {indir}")
-                display(self.red.log().show_in_notebook(display_length=len(self.red.log()))) # Show full log
+                log = self.pipeline.folder_log() # indexed headers, only changed files are reread
+                self.log_grid = show_table(log, self.log_grid)
             except Exception as e:
                 print(f"❌ Error initializing Reducer: {e}")
 
-    def _compute_bias_handler(self, b):
-        # 1. Gather all parameters for logging
-        params = {
+    def _propose_frames_handler(self, b):
+        """Fills the frame inputs from the header classification (first mask; all plans in self.proposed_plans)."""
+        with self.output_area:
+            clear_output(wait=True)
+            try:
+                self.pipeline._require('red')
+                self.proposed_plans = self.pipeline.propose_plans(kms_files=self.kms_file_input.value.strip() or None)
+            except Exception as e:
+                print(f"❌ Error classifying frames: {e}")
+                return
+            if not self.proposed_plans:
+                print("⚠️ No science frames found in the headers. Enter the frames by hand.")
+                return
+            display(summarize_plans(self.proposed_plans))
+            mask, plan = next(iter(self.proposed_plans.items()))
+
+            def frames(step):
+                return ','.join(str(frame) for frame in plan.get(step, {}).get('frames', []))
+
+            self.bias_files_input.value = frames('compute_bias')
+            self.dark_files_input.value = frames('compute_dark')
+            self.flat_files_input.value = frames('compute_flat')
+            self.arc_files_input.value = frames('compute_arcs')
+            self.science_file_input.value = frames('reduce_sciences')
+            if 'compute_flat' in plan:
+                self.slit_flat_file_input.value = str(plan['compute_flat']['frames'][0])
+            print(f"✅ Frame inputs filled for mask '{mask}'. Check them before computing.")
+            if len(self.proposed_plans) > 1:
+                print(f"ℹ️ {len(self.proposed_plans)} masks found; their plans are in widget.proposed_plans "
+                      "(run one with replay.run_plan).")
+
+    def _bias_log_params(self):
+        return {
             'Bias Frames': self.bias_files_input.value,
             'Combine Type': self.bias_type_dropdown.value,
             'Sigma Reject': self.bias_sigreject_input.value,
             'display individual': self.bias_display.value,
             'Trim Bias': self.bias_trim_checkbox.value
         }
+
+    def _dark_log_params(self):
+        return {
+            'Dark Frames': self.dark_files_input.value,
+            'Combine Type': self.dark_type_dropdown.value,
+            'Sigma Reject': self.dark_sigreject_input.value,
+            'Clip (x Uncertainty)': self.dark_clip_input.value,
+            'Display Individual': self.dark_display.value,
+            'Apply dark Bias': self.apply_dark_bias_checkbox.value,
+            'Trim Dark': self.dark_trim_checkbox.value
+        }
+
+    def _flat_log_params(self):
+        return {
+            'Flat Frames': self.flat_files_input.value,
+            'Combine Type': self.flat_type_dropdown.value,
+            'Sigma Reject': self.flat_sigreject_input.value,
+            'Spectral Flat': self.flat_spec_checkbox.value,
+            'Window Width': self.flat_width_input.value,
+            'Normalize Flat': self.flat_normalize_checkbox.value,
+            'S/N Min (for Norm)': self.flat_snmin_input.value,
+            'Apply Bias': self.apply_bias_checkbox.value,
+            'Apply Dark': self.apply_dark_checkbox.value,
+            'Display Individual flats': self.flat_display.value,
+            'Flat littrow ': self.flat_littrow_checkbox.value,
+            'Trim Flats': self.flat_trim_checkbox.value
+        }
+
+    def _build_calibrations_handler(self, b):
+        """Builds every calibration whose frames are filled in, concurrently (see CofiPipeline.build_calibrations)."""
+        with self.output_area:
+            clear_output(wait=True)
+            if not self.red: print("❌ Reducer not set. Read folder first."); return
+            requested = {}
+            # Logged as the individual steps so the log still replays
+            if self.bias_files_input.value.strip():
+                params = self._bias_log_params()
+                self.logger.log_action("Calibration - Bias", "Compute Bias", params)
+                requested['bias'] = bias_params(params)
+            if self.dark_files_input.value.strip():
+                params = self._dark_log_params()
+                self.logger.log_action("Calibration - Dark", "Compute Dark", params)
+                requested['dark'] = dark_params(params)
+            if self.flat_files_input.value.strip():
+                params = self._flat_log_params()
+                self.logger.log_action("Calibration - Flat", "Compute Flat", params)
+                requested['flat'] = flat_params(params)
+            if self.arc_files_input.value.strip():
+                self.logger.log_action("Calibration - Arcs", "Compute Arc", {'Arc Frames': self.arc_files_input.value})
+                requested['arcs'] = self.arc_files_input.value
+            if self.slit_flat_file_input.value.strip():
+                requested['slit_flat'] = self.slit_flat_file_input.value
+            if not requested: print("❌ No calibration frames given."); return
+            print(f"🚀 Building {', '.join(requested)} with {self.calib_workers_input.value} worker(s)...")
+            def task(progress, cancel):
+                timings = self.pipeline.build_calibrations(workers=self.calib_workers_input.value,
+                                                           progress=progress, cancel=cancel, **requested)
+                print(f"✅ Calibrations built: {', '.join(f'{kind} ({sec:.1f} s)' for kind, sec in timings.items())}")
+            self.runner.run("Build Calibrations", task)
+
+    def _compute_bias_handler(self, b):
+        # 1. Gather all parameters for logging
+        params = self._bias_log_params()
         # 2. Log the action before executing it
         self.logger.log_action("Calibration - Bias", "Compute Bias", params)
         
@@ -1301,10 +1558,10 @@ class CofiReductionWidget:
             else:
                 bias_display = None
             try:
-                self.bias_frame = self.red.mkbias(files, display=bias_display, # display handled by self.tv
-                                                    type=self.bias_type_dropdown.value,
-                                                    sigreject=self.bias_sigreject_input.value,
-                                                   trim = self.bias_trim_checkbox.value)
+                self.pipeline.compute_bias(files, display=bias_display, # display handled by self.tv
+                                           type=self.bias_type_dropdown.value,
+                                           sigreject=self.bias_sigreject_input.value,
+                                           trim=self.bias_trim_checkbox.value)
                 print(f"✅ Master Bias created from frames: {files}")
                 if self.tv and self.bias_frame is not None : self.tv.tv(self.bias_frame)
             except Exception as e:
@@ -1312,15 +1569,7 @@ class CofiReductionWidget:
 
     def _compute_dark_handler(self, b):
         # 1. Gather all parameters for logging
-        params = {
-            'Dark Frames': self.dark_files_input.value,
-            'Combine Type': self.dark_type_dropdown.value,
-            'Sigma Reject': self.dark_sigreject_input.value,
-            'Clip (x Uncertainty)': self.dark_clip_input.value,
-            'Display Individual': self.dark_display.value,
-            'Apply dark Bias': self.apply_dark_bias_checkbox.value,
-            'Trim Dark': self.dark_trim_checkbox.value
-        }
+        params = self._dark_log_params()
         # 2. Log the action before executing it
         self.logger.log_action("Calibration - Dark", "Compute Dark", params)
         with self.output_area:
@@ -1328,11 +1577,6 @@ class CofiReductionWidget:
             if not self.red: print("❌ Reducer not set. Read folder first."); return
             files = self._parse_input(self.dark_files_input.value)
             if not files: print("❌ Dark frames input is empty."); return
-                
-            if self.apply_dark_bias_checkbox.value:
-                dark_biases = self.bias_frame
-            else:
-                dark_biases = None
 
             if self.dark_display.value:
                 dark_display = self.tv
@@ -1343,12 +1587,12 @@ class CofiReductionWidget:
             else:
                 dark_clip = self.dark_clip_input.value
             try:
-
-                self.dark_frame = self.red.mkdark(files, bias=dark_biases, display=dark_display,
-                                                    type=self.dark_type_dropdown.value,
-                                                    sigreject=self.dark_sigreject_input.value,
-                                                    clip=dark_clip,
-                                                   trim= self.dark_trim_checkbox.value)
+                self.pipeline.compute_dark(files, display=dark_display,
+                                           type=self.dark_type_dropdown.value,
+                                           sigreject=self.dark_sigreject_input.value,
+                                           clip=dark_clip,
+                                           apply_bias=self.apply_dark_bias_checkbox.value,
+                                           trim=self.dark_trim_checkbox.value)
                 print(f"✅ Master Dark created from frames: {files}")
                 if self.tv and self.dark_frame is not None: self.tv.tv(self.dark_frame)
             except Exception as e:
@@ -1356,21 +1600,7 @@ class CofiReductionWidget:
 
     def _compute_flat_handler(self, b):
         # 1. Gather all parameters for logging
-        params = {
-            'Flat Frames': self.flat_files_input.value,
-            'Combine Type': self.flat_type_dropdown.value,
-            'Sigma Reject': self.flat_sigreject_input.value,
-            'Spectral Flat': self.flat_spec_checkbox.value,
-            'Window Width': self.flat_width_input.value,
-            'Normalize Flat': self.flat_normalize_checkbox.value,
-            'S/N Min (for Norm)': self.flat_snmin_input.value,
-            'Apply Bias': self.apply_bias_checkbox.value,
-            'Apply Dark': self.apply_dark_checkbox.value,
-            'Display Individual flats': self.flat_display.value,
-            'Flat littrow ': self.flat_littrow_checkbox.value,
-            'Trim Flats': self.flat_trim_checkbox.value
-            
-        }
+        params = self._flat_log_params()
         # 2. Log the action before executing it
         self.logger.log_action("Calibration - Flat", "Compute Flat", params)
         with self.output_area:
@@ -1378,35 +1608,36 @@ class CofiReductionWidget:
             if not self.red: print("❌ Reducer not set. Read folder first."); return
             files = self._parse_input(self.flat_files_input.value)
             if not files: print("❌ Flat frames input is empty."); return
-            
-            if self.apply_bias_checkbox.value:
-                flat_biases = self.bias_frame
-            else:
-                flat_biases = None
-                
-            if self.apply_dark_checkbox.value:
-                flat_darks = self.dark_frame
-            else:
-                flat_darks = None
-                
+
+            flat_kwargs = dict(type=self.flat_type_dropdown.value,
+                               sigreject=self.flat_sigreject_input.value,
+                               spec=self.flat_spec_checkbox.value,
+                               width=self.flat_width_input.value,
+                               normalize=self.flat_normalize_checkbox.value,
+                               snmin=self.flat_snmin_input.value,
+                               apply_bias=self.apply_bias_checkbox.value,
+                               apply_dark=self.apply_dark_checkbox.value,
+                               trim=self.flat_trim_checkbox.value,
+                               littrow=self.flat_littrow_checkbox.value)
             if self.flat_display.value:
-                flat_display = self.tv
-            else:
-                flat_display = None
-            try:
-                self.flat_frame = self.red.mkflat(files, bias=flat_biases, dark=flat_darks, display=flat_display,
-                                                    type=self.flat_type_dropdown.value,
-                                                    sigreject=self.flat_sigreject_input.value,
-                                                    spec=self.flat_spec_checkbox.value,
-                                                    width=self.flat_width_input.value,
-                                                    normalize=self.flat_normalize_checkbox.value,
-                                                    snmin=self.flat_snmin_input.value,
-                                                    trim= self.flat_trim_checkbox.value,
-                                                   littrow = self.flat_littrow_checkbox.value)
+                # showing each flat as mkflat combines them needs the TV, i.e. the notebook thread
+                try:
+                    self.pipeline.compute_flat(files, display=self.tv, **flat_kwargs)
+                    print(f"✅ Master Flat created from frames: {files}")
+                    if self.tv and self.flat_frame is not None: self.tv.tv(self.flat_frame)
+                except Exception as e:
+                    print(f"❌ Error computing flat: {e}")
+                return
+            # Otherwise the flat is built off the notebook thread (no display) and the TV only shows the result
+            def task(progress, cancel):
+                # mkflat combines the frames in one call, so progress is per master
+                progress(0, 1, 'flat')
+                self.pipeline.compute_flat(files, **flat_kwargs)
+                progress(1, 1, 'flat')
                 print(f"✅ Master Flat created from frames: {files}")
+            def show_flat():
                 if self.tv and self.flat_frame is not None: self.tv.tv(self.flat_frame)
-            except Exception as e:
-                print(f"❌ Error computing flat: {e}")
+            self.runner.run("Compute Flat", task, on_done=show_flat)
 
     def _compute_arcs_handler(self, b):
         # 1. Gather all parameters for logging
@@ -1423,7 +1654,7 @@ class CofiReductionWidget:
             files = self._parse_input(self.arc_files_input.value)
             if not files: print("❌ Arc frames input is empty."); return
             try:
-                self.arcs_frame = self.red.sum(files) # sum doesn't take display
+                self.pipeline.compute_arcs(files)
                 print(f"✅ Master Arc(s) created from frames: {files}")
                 if self.tv and self.arcs_frame is not None: self.tv.tv(self.arcs_frame)
             except Exception as e:
@@ -1456,29 +1687,18 @@ class CofiReductionWidget:
             if not os.path.isfile(kms_file): print(f"❌ KMS file not found: {kms_file}"); return
             
             try:
-                # Reduce the single flat frame specified for slit finding
-                flat_image_data = self.red.reduce(flat_file_id[0], display=None) # Reduce returns image data
-                if flat_image_data is None:
-                    print(f"❌ Failed to reduce flat frame {flat_file_id[0]}.")
-                    return
                 if self.findslits_cent_input.value == 'None':
                     cent_value = None
                 else:
                     cent_value = int(self.findslits_cent_input.value)
-                    
-                self.trace = spectra.Trace(transpose=True) # KOSMOS specific
-                bottom, top = self.trace.findslits(flat_image_data, display=self.tv, # Pass image data
-                                                   smooth=self.findslits_smooth_input.value,
-                                                   thresh=self.findslits_thresh_input.value,
-                                                   degree=self.findslits_degree_input.value,
-                                                   skip = self.findslits_skip_input.value,
-                                                   sn=self.findslits_sn_checkbox.value,
-                                                   cent = cent_value)
-                self.targets = slitmask.read_kms(kms_file, sort='YMM') # YMM sort is KOSMOS typical
-                
-                # Store the original full list for potential reset
-                self.full_trace = copy.deepcopy(self.trace)
-                self.full_targets = self.targets.copy() # Use .copy() for astropy Table
+
+                bottom, top = self.pipeline.find_slits(flat_file_id[0], kms_file,
+                                                       smooth=self.findslits_smooth_input.value,
+                                                       thresh=self.findslits_thresh_input.value,
+                                                       degree=self.findslits_degree_input.value,
+                                                       skip=self.findslits_skip_input.value,
+                                                       sn=self.findslits_sn_checkbox.value,
+                                                       cent=cent_value)
 
                 print(f"✅ Found {len(bottom)} slits.")
                 if len(self.targets) != len(bottom) or len(self.targets) != len(top):
@@ -1488,13 +1708,16 @@ class CofiReductionWidget:
                     else:
                         slit_size = len(bottom)
                     print(f"⚠️ Warning: Found {slit_size} slits but KMS file has {len(self.targets)} targets.")
-                display(self.targets.to_pandas())
+                self._show_targets()
             except Exception as e:
                 print(f"❌ Error finding slits: {e}")
                 import traceback
                 traceback.print_exc()
 
 
+    def _show_targets(self):
+        self.targets_grid = show_table(self.targets, self.targets_grid)
+
     def _update_headers_handler(self, b):
         self.tv.tvclear()
         self.tv.clear()
@@ -1503,10 +1726,7 @@ class CofiReductionWidget:
             if not self.trace or self.arcs_frame is None or self.targets is None:
                 print("❌ Trace, Arcs, or Targets not available. Run previous steps."); return
             try:
-                self.arcec = self.trace.extract2d(self.arcs_frame, display=self.tv)
-                for arc, target in zip(self.arcec, self.targets):
-                    arc.header['XMM'] = target['XMM']
-                    arc.header['YMM'] = target['YMM']
+                self.pipeline.update_arc_headers()
                 print("✅ Arc headers updated with XMM and YMM for currently selected targets.")
             except Exception as e:
                 print(f"❌ Error updating arc headers: {e}")
@@ -1533,60 +1753,17 @@ class CofiReductionWidget:
                 # self._reset_filter_handler(None) 
                 return
 
-            data = self.full_targets.to_pandas() # Filter from the original full list
-            method = self.filter_method_dropdown.value
-            selected_indices = [] # Store indices relative to self.full_targets
-
             try:
-                if method == 'Index':
-                    raw_indices = [idx.strip() for idx in value_str.split(',') if idx.strip()]
-                    for idx_str in raw_indices:
-                        if idx_str.isdigit():
-                            idx = int(idx_str)
-                            if 0 <= idx < len(self.full_targets):
-                                selected_indices.append(idx)
-                            else:
-                                print(f"⚠️ Index {idx} out of range (0-{len(self.full_targets)-1}).")
-                        else:
-                            print(f"⚠️ Invalid index '{idx_str}'.")
-                
-                elif method == 'ID':
-                    ids_to_find = [val.strip().strip("'\"") for val in value_str.split(',')]
-                    # Ensure 'ID' column exists and is string type for comparison
-                    if 'ID' in data.columns:
-                        data['ID_str'] = data['ID'].astype(str).str.strip()
-                        mask = data['ID_str'].isin(ids_to_find)
-                        selected_indices = data.index[mask].tolist()
-                    else:
-                        print("⚠️ 'ID' column not found in targets table.")
-                
-                elif method == 'Name':
-                    names_to_find = [val.strip().strip("'\"") for val in value_str.split(',')]
-                    if 'NAME' in data.columns:
-                        data['NAME_str'] = data['NAME'].astype(str).str.strip()
-                        mask = data['NAME_str'].isin(names_to_find)
-                        selected_indices = data.index[mask].tolist()
-                    else:
-                        print("⚠️ 'NAME' column not found in targets table.")
-
-                if not selected_indices:
+                selected = self.pipeline.filter_slits(self.filter_method_dropdown.value, value_str)
+                if selected is None:
                     print("⚠️ No targets found matching the filter criteria. Current selection remains unchanged.")
                     # Display current targets again so user isn't confused
-                    if self.targets is not None: display(self.targets.to_pandas())
+                    if self.targets is not None: self._show_targets()
                     else: print(" (No targets currently selected)")
                     return
 
-                # Filter the trace object based on selected_indices from full_trace
-                gdtrace = copy.deepcopy(self.full_trace) # Start from original trace
-                gdtrace.model = [self.full_trace.model[i] for i in selected_indices if i < len(self.full_trace.model)]
-                gdtrace.rows = [self.full_trace.rows[i] for i in selected_indices if i < len(self.full_trace.rows)]
-                
-                # Update the main trace and targets attributes
-                self.trace = gdtrace
-                self.targets = self.full_targets[selected_indices] # Filter original table by indices
-                
                 print(f"✅ Filter applied. Selected {len(self.targets)} targets:")
-                display(self.targets.to_pandas())
+                self._show_targets()
 
             except Exception as e:
                 print(f"❌ An error occurred during filtering: {e}")
@@ -1600,21 +1777,21 @@ class CofiReductionWidget:
                 print("❌ No original target list to reset to. Run 'Find Slits' first.")
                 return
             
-            self.trace = copy.deepcopy(self.full_trace)
-            self.targets = self.full_targets.copy() # Use .copy() for astropy Table
+            self.pipeline.reset_filter()
             self.filter_values_input.value = '' # Clear filter input
             print("✅ Filter has been reset. Showing all original targets.")
-            display(self.targets.to_pandas())
+            self._show_targets()
 
     def _reduce_science_handler(self, b):
-        self.tv.tvclear()
-        self.tv.clear()
+        if self.tv:
+            self.tv.tvclear()
+            self.tv.clear()
         with self.output_area:
             clear_output(wait=True)
             if not self.red: print("❌ Reducer not set."); return
-            science_file_id = self._parse_input(self.science_file_input.value)
+            science_file_id = parse_frames(self.science_file_input.value)
             if not science_file_id or not isinstance(science_file_id[0], (int, str)):
-                    print("❌ Science frame input is empty or invalid (must be a single frame ID/name)."); return
+                    print("❌ Science frame input is empty or invalid."); return
 
             crbox_value = get_srt_or_list(self.reduce_crbox_input.value)
             try:
@@ -1623,7 +1800,7 @@ class CofiReductionWidget:
                     'bias': self.bias_frame if self.reduce_appy_bias_checkbox.value else None,
                     'dark': self.dark_frame if self.reduce_appy_dark_checkbox.value else None,
                     'flat': self.flat_frame if self.reduce_appy_flat_checkbox.value else None,
-                    'display': self.tv if self.display_enabled and self.tv is not None else None,
+                    'display': None, # reduced in the background; the TV shows the result (see on_done)
                     'crbox': crbox_value if self.reduce_crbox_input.value != 'none' else None,
                     'crsig': self.reduce_crsig_input.value,
                     'objlim': self.reduce_objlim_input.value,
@@ -1672,11 +1849,43 @@ class CofiReductionWidget:
                 # Create a new dictionary for logging that excludes the 'display' key
                 # log_kwargs = {key: (True if key == 'display' else value) for key, value in kwargs.items()}
                 #{key: value for key, value in kwargs.items() if key != 'display'}
+                if len(science_file_id) > 1:
+                    log_kwargs['num'] = self.science_file_input.value
                 self.logger.log_action("Science & Extraction - Reduce", "Reduce Science Frame", log_kwargs)
-        
-                self.reduced_frame = self.red.reduce( **kwargs)
-                print(f"✅ Science frame {science_file_id[0]} reduced.")
-                #if self.tv and self.reduced_frame is not None : self.tv.tv(self.reduced_frame)
+
+                if len(science_file_id) > 1:
+                    reduce_params = {key: value for key, value in log_kwargs.items()
+                                     if key not in ('num', 'Apply bias', 'Apply dark', 'Apply flat')}
+                    write_dir = None
+                    if self.reduce_write_checkbox.value:
+                        write_dir = f"{self.pipeline.output_folder(self.log_file_input.value or None)}_reduced"
+                    def task(progress, cancel):
+                        self.pipeline.reduce_sciences(science_file_id, workers=self.reduce_workers_input.value,
+                                                      write_dir=write_dir,
+                                                      apply_bias=self.reduce_appy_bias_checkbox.value,
+                                                      apply_dark=self.reduce_appy_dark_checkbox.value,
+                                                      apply_flat=self.reduce_appy_flat_checkbox.value,
+                                                      progress=progress, cancel=cancel, **reduce_params)
+                        print(f"✅ Science frames {science_file_id} reduced; extraction will use frame {science_file_id[0]}.")
+                        if write_dir:
+                            print(f"   Reduced frames written to {write_dir}/")
+                    self.runner.run("Reduce Science Frames", task)
+                    return
+
+                reduce_params = {key: value for key, value in log_kwargs.items()
+                                 if key not in ('num', 'Apply bias', 'Apply dark', 'Apply flat')}
+                def task(progress, cancel):
+                    progress(0, 1, 'frame')
+                    self.pipeline.reduce_science(science_file_id[0],
+                                                 apply_bias=self.reduce_appy_bias_checkbox.value,
+                                                 apply_dark=self.reduce_appy_dark_checkbox.value,
+                                                 apply_flat=self.reduce_appy_flat_checkbox.value,
+                                                 display=None, **reduce_params)
+                    progress(1, 1, 'frame')
+                    print(f"✅ Science frame {science_file_id[0]} reduced.")
+                def show_reduced():
+                    if self.tv and self.reduced_frame is not None: self.tv.tv(self.reduced_frame)
+                self.runner.run("Reduce Science Frame", task, on_done=show_reduced)
             except Exception as e:
                 print(f"❌ Error reducing science frame: {e}")
                 import traceback
@@ -1744,8 +1953,16 @@ class CofiReductionWidget:
                     'rows': rows_value if self.wavecal_id_rows_input.value != 'None' else None
                 }
                 self.logger.log_action("Science & Extraction - Wave Cal", "Reduce Run Wavelength Calibration", params)
-                self.processor.calibrate_wavelength(self.arcec, self.targets, **params)
-                print("✅ Wavelength Calibration process complete.")
+                if params['plot'] or params['plotinter'] or params['inter']:
+                    # plots and interactive line rejection need the notebook thread
+                    self.processor.calibrate_wavelength(self.arcec, self.targets, cache=self.pipeline.wave_cache, **params)
+                    print("✅ Wavelength Calibration process complete.")
+                    return
+                def task(progress, cancel):
+                    self.processor.calibrate_wavelength(self.arcec, self.targets, cache=self.pipeline.wave_cache,
+                                                        display=None, progress=progress, cancel=cancel, **params)
+                    print("✅ Wavelength Calibration process complete.")
+                self.runner.run("Wave Cal", task)
             except Exception as e:
                 print(f"❌ Error during wavelength calibration: {e}")
                 import traceback
@@ -1774,6 +1991,7 @@ class CofiReductionWidget:
     # --- Callbacks and Handlers for Interactive Extraction ---
     def _update_spec2d_out_callback(self, result_list):
         self.spec2d_out = result_list
+        self.pipeline.checkpoint('extract2d', 'spec2d_out')
         with self.processor_2d_output_area: # self.output_area: # Use main output area for final confirmation
             # Don't clear here, processor_2d_output_area has detailed logs
             if result_list is not None:
@@ -2034,6 +2252,27 @@ class CofiReductionWidget:
             #update_callback=self._update_spec1d_out_callback
         )
 
+    def _session_dir(self):
+        star_name = os.path.basename(os.path.normpath(self.log_file_input.value)) or "reduction_session"
+        return f"{star_name}_session"
+
+    def _resume_session_handler(self, b):
+        """Restores the pipeline state checkpointed in <log file name>_session; frames load on first use."""
+        with self.output_area:
+            clear_output(wait=True)
+            session_dir = self._session_dir()
+            try:
+                restored = self.pipeline.resume(session_dir)
+            except Exception as e:
+                print(f"❌ Could not resume session from '{session_dir}': {e}")
+                return
+            red_entry = self.pipeline.session.metadata['saved'].get('red')
+            if red_entry is not None:
+                self.folder_path_input.value = red_entry['indir']
+            print(f"✅ Session restored from '{session_dir}': {', '.join(restored)}")
+            print("ℹ️ Frames are read from the session the first time a step uses them.")
+            display(self.pipeline.session.summary())
+
     def _load_log_handler(self, b):
         """Handles the log file upload and initiates parsing."""
         if not self.log_uploader.value:
@@ -2272,22 +2511,8 @@ class CofiReductionWidget:
         }
 
         all_params = {}
-        # ... (code to parse log_content and populate all_params remains the same) ...
-        in_params_block = False
-        json_str_buffer = ""
-        for line in log_content.splitlines():
-            if line.strip() == "PARAMETERS:":
-                in_params_block = True
-                json_str_buffer = ""
-                continue
-            if in_params_block:
-                json_str_buffer += line
-                try:
-                    params = json.loads(json_str_buffer)
-                    all_params.update(params)
-                    in_params_block = False
-                except json.JSONDecodeError:
-                    continue
+        for entry in parse_log(log_content)['actions']:
+            all_params.update(entry['parameters'])
     
         applied_count = 0
         for key, value in all_params.items():
@@ -9,18 +9,27 @@ setup(
         "numpy",
         "pandas",
         "matplotlib",
-        "ipywidgets",
-        "pandas",
         "astropy", # 7.1.0 this version works
         "astro-pyvista", # 0.4.1 and this version works
         "ccdproc",
-        "PyQt5",
-        "PyQt6",
-        "PySide6",
         "specutils",
-        "ipydatagrid",
-        # PyQt5, PyQt6,PySide6,
         # "photutils==2.20" This is a dependency in pyvista, so it's not required here.
         # Add any other dependencies needed by your package
     ],
+    extras_require={
+        # Notebook widgets (CofiReductionWidget, AstroAnalysis UI, stacker) and the Qt backends pyvista.tv uses
+        "gui": [
+            "ipywidgets",
+            "ipydatagrid",
+            "PyQt5",
+            "PyQt6",
+            "PySide6",
+        ],
+    },
+    entry_points={
+        "console_scripts": [
+            "cofi-replay=cofi_reduction.replay:main",
+            "cofi-stack=cofi_reduction.cofi_stacker:main",
+        ],
+    },
 )
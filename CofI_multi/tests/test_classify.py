@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from cofi_reduction.classify import classify_frames, frame_type, group_frames
+
+
+@pytest.mark.parametrize('lamp', ['Neon', 'Argon', 'Krypton', 'Helium', 'Mercury', 'Xenon', 'Cadmium',
+                                  'Thorium-Argon', 'Ne', 'ThAr', 'HeNeAr', 'neon lamp'])
+def test_arc_lamp_names(lamp):
+    assert frame_type('Object', 30, lamp) == 'arc'
+
+
+@pytest.mark.parametrize('lamp', ['Quartz', 'QTH', 'Halogen'])
+def test_flat_lamp_names(lamp):
+    assert frame_type('Object', 5, lamp) == 'flat'
+
+
+@pytest.mark.parametrize('lamp', [None, '', 'None', 'off', 'Dome'])
+def test_no_lamp_is_science(lamp):
+    assert frame_type('Object', 600, lamp) == 'science'
+
+
+def test_full_lamp_name_frames_stay_out_of_the_science_group():
+    table = pd.DataFrame({
+        'FILE': ['M3.0001.fits', 'M3.0002.fits', 'M3.0003.fits'],
+        'IMAGETYP': ['Object', 'Object', 'Object'],
+        'OBJNAME': ['M3', 'M3', 'M3'],
+        'EXPTIME': [600.0, 30.0, 5.0],
+        'GRATING': ['red', 'red', 'red'],
+        'LAMP': ['', 'Neon', 'Quartz'],
+    })
+    frames = classify_frames(table)
+    assert list(frames['TYPE']) == ['science', 'arc', 'flat']
+    mask = group_frames(frames)['masks'][('M3', 'red')]
+    assert mask['science'] == [1]
+    assert mask['arc'] == [2]
+    assert mask['flat'] == [3]
+    assert mask['exptime'] == 600.0